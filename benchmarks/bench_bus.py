@@ -0,0 +1,70 @@
+"""
+benchmarks.bench_bus
+~~~~~~~~~~~~~~~~~~~~
+
+Latency and throughput of the message bus between two wrappers::
+
+    $ python benchmarks/bench_bus.py [messages [payload_bytes]]
+
+Latency is the round trip of a ping answered by a pong. Throughput is one
+wrapper publishing to another that waits for every message.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from testkit.processes import ProcessManager, ProcessWrapper
+
+DEFAULT_MESSAGES = 10000
+DEFAULT_PAYLOAD = 16
+
+
+def create_wrappers(messages, payload_size):
+    payload = 'x' * payload_size
+
+    class PongWrapper(ProcessWrapper):
+        def run(self):
+            for index in xrange(messages):
+                self.publish('pong', self.wait_for_message('ping'))
+            for index in xrange(messages):
+                self.publish('stream', payload)
+            while True:
+                time.sleep(1.0)
+
+    class PingWrapper(ProcessWrapper):
+        def run(self):
+            start = time.time()
+            for index in xrange(messages):
+                self.publish('ping', payload)
+                self.wait_for_message('pong')
+            elapsed = time.time() - start
+            print '%d byte payloads: %.1f us round trip' % (payload_size,
+                    elapsed / messages * 1000000)
+            start = time.time()
+            for index in xrange(messages):
+                self.wait_for_message('stream')
+            elapsed = time.time() - start
+            print '%d byte payloads: %.0f messages per second' % (
+                    payload_size, messages / elapsed)
+            sys.stdout.flush()
+    return [PongWrapper, PingWrapper]
+
+
+def main():
+    messages = DEFAULT_MESSAGES
+    payload_size = DEFAULT_PAYLOAD
+    if len(sys.argv) > 1:
+        messages = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        payload_size = int(sys.argv[2])
+    # Keep every message of the stream so the reader never overflows
+    manager_cls = type('BusBenchmarkManager', (ProcessManager,),
+            {'bus_queue_size': messages})
+    manager_cls.from_wrappers(create_wrappers(messages, payload_size),
+            {}).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+benchmarks.bench_exception_pickling
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Pickled size and pickling time of ``PicklableExceptionInfo`` for deep
+tracebacks spread over a few long modules, compared with the former
+representation of one object with its own filename per frame::
+
+    $ python benchmarks/bench_exception_pickling.py [depth ...]
+"""
+import os
+import sys
+import time
+import cPickle
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from testkit.exceptionutils import PicklableExceptionInfo
+
+DEFAULT_DEPTHS = [5, 50, 500]
+MODULES = 5
+FIRST_LINE = 4000
+REPEATS = 200
+
+
+class LegacyTracebackData(object):
+    def __init__(self, code_filename, lineno):
+        self._code_filename = code_filename
+        self._lineno = lineno
+
+
+class LegacyExceptionInfo(object):
+    def __init__(self, info):
+        self._exc_type = info.exc_type
+        self._exc_value = info.exc_value
+        self._traceback_list = [LegacyTracebackData(filename, lineno)
+                for filename, lineno, name in info.frames]
+
+
+def make_stack(depth):
+    """Function f0 of a chain of depth functions spread over MODULES
+    modules. The last one raises
+    """
+    namespace = {}
+    for index in xrange(depth):
+        filename = os.path.join(os.getcwd(), 'service', 'module_%d.py' %
+                (index % MODULES))
+        lines = [''] * (FIRST_LINE + index * 2)
+        lines.append('def f%d():' % index)
+        if index == depth - 1:
+            lines.append('    raise ValueError("bottom")')
+        else:
+            lines.append('    f%d()' % (index + 1))
+        exec compile('\n'.join(lines), filename, 'exec') in namespace
+    return namespace['f0']
+
+
+def capture(depth):
+    try:
+        make_stack(depth)()
+    except ValueError:
+        return PicklableExceptionInfo.exc_info()
+
+
+def measure(info):
+    start = time.time()
+    for i in xrange(REPEATS):
+        pickled = cPickle.dumps(info, 2)
+        cPickle.loads(pickled)
+    return len(pickled), (time.time() - start) / REPEATS
+
+
+def main():
+    depths = [int(depth) for depth in sys.argv[1:]] or DEFAULT_DEPTHS
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), max(depths) * 2 + 100))
+    print '%6s %-8s %10s %16s' % ('frames', 'format', 'bytes',
+            'dumps + loads')
+    for depth in depths:
+        info = capture(depth)
+        for name, candidate in [('legacy', LegacyExceptionInfo(info)),
+                ('packed', info)]:
+            size, elapsed = measure(candidate)
+            print '%6d %-8s %10d %13.3f ms' % (depth, name, size,
+                    elapsed * 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+benchmarks.bench_processes
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Processes started per second by ``ProcessManager`` and the file descriptors
+the parent holds per running wrapper::
+
+    $ python benchmarks/bench_processes.py [replicas_per_manager ...]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from testkit.processes import ProcessManager, ProcessWrapper
+
+ROUNDS = 10
+
+
+class QuickWrapper(ProcessWrapper):
+    def run(self):
+        pass
+
+
+def open_file_descriptors():
+    return len(os.listdir('/proc/self/fd'))
+
+
+def measure_throughput(count):
+    wrappers = [(QuickWrapper, count)]
+    start = time.time()
+    for i in xrange(ROUNDS):
+        ProcessManager.from_wrappers(wrappers, {}).run()
+    elapsed = time.time() - start
+    print '%d wrappers: %.1f processes started per second' % (count,
+            count * ROUNDS / elapsed)
+
+
+def measure_file_descriptors(count):
+    before = open_file_descriptors()
+    manager = ProcessManager.from_wrappers([(QuickWrapper, count)], {})
+    manager.monitors
+    during = open_file_descriptors()
+    manager._stop_processes()
+    print '%d wrappers: %.1f file descriptors per wrapper' % (count,
+            float(during - before) / count)
+
+
+def main():
+    counts = [int(count) for count in sys.argv[1:]] or [20]
+    for count in counts:
+        measure_throughput(count)
+        measure_file_descriptors(count)
+
+
+if __name__ == '__main__':
+    main()
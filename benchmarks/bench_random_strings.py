@@ -0,0 +1,57 @@
+"""
+benchmarks.bench_random_strings
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Time to generate fixture keys one at a time with ``random_string`` compared
+with ``random_strings``::
+
+    $ python benchmarks/bench_random_strings.py [count] [length]
+
+NumPy's generator is only measured when NumPy is installed.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from testkit.data import random_string, random_strings
+
+DEFAULT_COUNT = 100000
+DEFAULT_LENGTH = 16
+
+
+def measure(name, generate, count):
+    start = time.time()
+    strings = generate()
+    elapsed = time.time() - start
+    assert len(strings) == count
+    print '%-22s %9.3f s %12.0f strings/s' % (name, elapsed, count / elapsed)
+
+
+def main():
+    count = DEFAULT_COUNT
+    length = DEFAULT_LENGTH
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        length = int(sys.argv[2])
+    print '%d strings of %d characters' % (count, length)
+    measure('random_string loop',
+            lambda: [random_string(length) for i in xrange(count)], count)
+    measure('os.urandom',
+            lambda: random_strings(count, length), count)
+    measure('seeded random.Random',
+            lambda: random_strings(count, length, seed=1), count)
+    measure('ranged lengths',
+            lambda: random_strings(count, (1, length * 2 - 1)), count)
+    try:
+        import numpy
+    except ImportError:
+        return
+    measure('numpy RandomState', lambda: random_strings(count, length,
+        rng=numpy.random.RandomState(1)), count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+benchmarks.bench_reraise
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+Latency of ``PicklableExceptionInfo.reraise`` after unpickling, for deep
+tracebacks whose frames sit thousands of lines into a module, with and
+without the cache of fake raise code objects::
+
+    $ python benchmarks/bench_reraise.py [depth ...]
+"""
+import os
+import sys
+import time
+import cPickle
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from testkit import exceptionutils
+from testkit.exceptionutils import PicklableExceptionInfo, FakeCodeCache
+
+DEFAULT_DEPTHS = [5, 50, 500]
+# Line of the first generated function
+FIRST_LINE = 4000
+REPEATS = 20
+
+
+def make_module(depth):
+    """A module whose function f0 raises after calling down depth
+    functions, each on its own line far down the module
+    """
+    lines = [''] * (FIRST_LINE - 1)
+    for index in xrange(depth):
+        lines.append('def f%d():' % index)
+        if index == depth - 1:
+            lines.append('    raise ValueError("bottom")')
+        else:
+            lines.append('    f%d()' % (index + 1))
+    namespace = {}
+    exec compile('\n'.join(lines), 'generated_%d.py' % depth,
+            'exec') in namespace
+    return namespace['f0']
+
+
+def capture(depth):
+    f = make_module(depth)
+    try:
+        f()
+    except ValueError:
+        return PicklableExceptionInfo.exc_info()
+
+
+def time_reraises(exception_info):
+    # Failures arrive pickled from other processes. Each is reraised once
+    pickled = cPickle.dumps(exception_info, 2)
+    received = [cPickle.loads(pickled) for i in xrange(REPEATS)]
+    start = time.time()
+    for exception_info in received:
+        try:
+            exception_info.reraise()
+        except ValueError:
+            pass
+    return (time.time() - start) / REPEATS
+
+
+def main():
+    depths = [int(depth) for depth in sys.argv[1:]] or DEFAULT_DEPTHS
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), max(depths) * 2 + 100))
+    print '%6s %14s %14s' % ('frames', 'uncached', 'cached')
+    for depth in depths:
+        exception_info = capture(depth)
+        # A cache that holds nothing compiles every frame every time
+        exceptionutils.fake_code_cache = FakeCodeCache(size=0)
+        uncached = time_reraises(exception_info)
+        exceptionutils.fake_code_cache = FakeCodeCache()
+        time_reraises(exception_info)
+        cached = time_reraises(exception_info)
+        print '%6d %11.3f ms %11.3f ms' % (depth, uncached * 1000,
+                cached * 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+benchmarks.bench_results
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+Latency and memory of returning large results from ``timeout`` children
+through shared memory compared with pickling them through the pipe::
+
+    $ python benchmarks/bench_results.py [size_in_mb ...]
+
+Every measurement runs in a fresh interpreter so peak RSS is not shared
+between runs.
+"""
+import os
+import sys
+import time
+import resource
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from testkit import timeouts
+
+DEFAULT_SIZES_MB = [1, 100, 1024]
+
+
+def make_result(size):
+    return 'x' * size
+
+
+def measure(mode, size_mb):
+    if mode == 'pickled':
+        timeouts.share_large_value = lambda value: value
+    timed = timeouts.timeout(600)(make_result)
+    size = size_mb * 1024 * 1024
+    start = time.time()
+    result = timed(size)
+    elapsed = time.time() - start
+    assert len(result) == size
+    parent_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    print '%6d MB %-8s %9.1f ms  parent peak %6d MB  child peak %6d MB' % (
+            size_mb, mode, elapsed * 1000, parent_rss // 1024,
+            child_rss // 1024)
+
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == '--measure':
+        measure(sys.argv[2], int(sys.argv[3]))
+        return
+    sizes = [int(size) for size in sys.argv[1:]] or DEFAULT_SIZES_MB
+    for size_mb in sizes:
+        for mode in ['shared', 'pickled']:
+            sys.stdout.flush()
+            subprocess.call([sys.executable, __file__, '--measure', mode,
+                str(size_mb)])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+benchmarks.bench_shared_options
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Start up time and memory of sharing one large fixture with many wrappers
+through ``shared_buffer`` compared with pickling it in shared options::
+
+    $ python benchmarks/bench_shared_options.py [size_in_mb [wrappers]]
+
+Every measurement runs in a fresh interpreter so peak RSS is not shared
+between runs.
+"""
+import os
+import sys
+import time
+import resource
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from testkit.processes import ProcessWrapper, ProcessManager, shared_buffer
+
+DEFAULT_SIZE_MB = 100
+DEFAULT_WRAPPERS = 8
+
+
+def create_wrapper(mode, size):
+    class FixtureProcess(ProcessWrapper):
+        def shared_options(self):
+            if self.replica_index != 0:
+                return {}
+            fixture = 'x' * size
+            if mode == 'shared':
+                fixture = shared_buffer(fixture)
+            return {'fixture': fixture}
+
+        def setup(self, shared_options):
+            self.fixture = shared_options['FixtureProcess'][0]['fixture']
+
+        def run(self):
+            assert len(self.fixture) == size
+    return FixtureProcess
+
+
+def measure(mode, size_mb, wrappers):
+    size = size_mb * 1024 * 1024
+    wrapper_cls = create_wrapper(mode, size)
+    manager = ProcessManager.from_wrappers([(wrapper_cls, wrappers)], {},
+            runtime_timeout=600)
+    start = time.time()
+    manager.start()
+    elapsed = time.time() - start
+    manager._stop_processes()
+    parent_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    print ('%6d MB x %3d %-8s start %9.1f ms  parent peak %6d MB  '
+            'child peak %6d MB' % (size_mb, wrappers, mode, elapsed * 1000,
+                parent_rss // 1024, child_rss // 1024))
+
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == '--measure':
+        measure(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+        return
+    size_mb = DEFAULT_SIZE_MB
+    wrappers = DEFAULT_WRAPPERS
+    if len(sys.argv) > 1:
+        size_mb = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        wrappers = int(sys.argv[2])
+    for mode in ['shared', 'pickled']:
+        sys.stdout.flush()
+        subprocess.call([sys.executable, __file__, '--measure', mode,
+            str(size_mb), str(wrappers)])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+benchmarks.bench_start_methods
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Child start up latency when every child needs a set of heavy modules::
+
+    $ python benchmarks/bench_start_methods.py [wrappers]
+
+Compares importing the modules in each forked child, preloading them in the
+parent before forking, and reusing pooled ``timeout`` workers. Every mode
+runs in a fresh interpreter so nothing is imported beforehand.
+"""
+import os
+import sys
+import time
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from testkit.processes import ProcessManager, ProcessWrapper
+from testkit.timeouts import timeout
+
+DEFAULT_WRAPPERS = 8
+CALLS = 20
+
+# A stand in for the imports of a typical service under test
+IMPORT_GRAPH = ['json', 'decimal', 'logging.handlers', 'urllib2',
+    'httplib', 'cookielib', 'ssl', 'smtplib', 'email.mime.multipart',
+    'xml.dom.minidom', 'xml.etree.ElementTree', 'sqlite3', 'csv',
+    'tarfile', 'zipfile', 'difflib', 'unittest', 'pydoc', 'optparse',
+    'SimpleHTTPServer', 'multiprocessing.managers']
+
+
+def import_graph():
+    for name in IMPORT_GRAPH:
+        __import__(name)
+
+
+class ImportingWrapper(ProcessWrapper):
+    def setup(self, shared_options):
+        import_graph()
+
+    def run(self):
+        pass
+
+
+def measure_manager(mode, wrappers):
+    preload = None
+    if mode == 'preload':
+        preload = IMPORT_GRAPH
+    manager = ProcessManager.from_wrappers([(ImportingWrapper, wrappers)],
+            {}, preload=preload)
+    start = time.time()
+    manager.start()
+    elapsed = time.time() - start
+    manager._stop_processes()
+    print 'ProcessManager %-8s %3d wrappers ready in %7.1f ms' % (mode,
+            wrappers, elapsed * 1000)
+
+
+def measure_timeout(mode):
+    options = {}
+    if mode == 'preload':
+        options['preload'] = IMPORT_GRAPH
+    elif mode == 'pooled':
+        options['pooled'] = True
+    timed = timeout(10, **options)(import_graph)
+    start = time.time()
+    for i in xrange(CALLS):
+        timed()
+    elapsed = time.time() - start
+    print 'timeout        %-8s %6.2f ms per call' % (mode,
+            elapsed / CALLS * 1000)
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--measure':
+        if sys.argv[2] == 'timeout':
+            measure_timeout(sys.argv[3])
+        else:
+            measure_manager(sys.argv[3], int(sys.argv[4]))
+        return
+    wrappers = DEFAULT_WRAPPERS
+    if len(sys.argv) > 1:
+        wrappers = int(sys.argv[1])
+    for mode in ['fork', 'preload']:
+        sys.stdout.flush()
+        subprocess.call([sys.executable, __file__, '--measure', 'manager',
+            mode, str(wrappers)])
+    for mode in ['fork', 'preload', 'pooled']:
+        sys.stdout.flush()
+        subprocess.call([sys.executable, __file__, '--measure', 'timeout',
+            mode])
+
+
+if __name__ == '__main__':
+    main()
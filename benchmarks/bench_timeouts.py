@@ -0,0 +1,60 @@
+"""
+benchmarks.bench_timeouts
+~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Per call overhead of ``timeout`` with a new process per call, with the
+worker pool and with the in process engine::
+
+    $ python benchmarks/bench_timeouts.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from testkit.timeouts import timeout, get_worker_pool, shutdown_worker_pool
+
+CALLS = 200
+
+
+def noop():
+    pass
+
+
+@timeout(5)
+def process_test():
+    noop()
+
+
+@timeout(5, pooled=True)
+def pooled_test():
+    noop()
+
+
+@timeout(5, engine='inprocess')
+def inprocess_test():
+    noop()
+
+
+def measure(name, f):
+    # Warm up (starts the pool for pooled tests)
+    f()
+    start = time.time()
+    for i in xrange(CALLS):
+        f()
+    elapsed = time.time() - start
+    print '%-10s %8.3f ms per call' % (name, elapsed * 1000.0 / CALLS)
+
+
+def main():
+    measure('direct', noop)
+    measure('process', process_test)
+    get_worker_pool()
+    measure('pooled', pooled_test)
+    shutdown_worker_pool()
+    measure('inprocess', inprocess_test)
+
+
+if __name__ == '__main__':
+    main()
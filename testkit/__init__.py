@@ -5,3 +5,6 @@ from .context import *
 from .data import *
 from .timeouts import *
 from .processes import *
+from .scheduler import *
+from .loadgen import *
+from .failures import *
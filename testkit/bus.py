@@ -0,0 +1,202 @@
+"""
+testkit.bus
+~~~~~~~~~~~
+
+A publish/subscribe bus between the wrappers of a multiprocess test. The
+ProcessManager brokers it over each wrapper's control pipe.
+
+Every topic is a bounded log of the messages published to it during the
+current run. Each wrapper reads a topic from the start of the run with its
+own cursor, so nothing is missed by waiting late. Waits are requests to the
+manager, which answers when the next message is available. The manager never
+writes to a wrapper that isn't waiting.
+
+Every wait has a request id that its reply carries. A wait that times out is
+cancelled. If its reply was already on the way the wrapper drops it and the
+manager moves the wrapper's cursor back, so the message is read by the next
+wait instead.
+"""
+import time
+from collections import deque
+from .timeouts import TimeoutError
+
+BUS_MESSAGE_KINDS = ('bus_message', 'bus_overflow')
+
+# Topics used by testkit itself
+LOAD_GENERATORS_TOPIC = 'testkit.load_generators'
+LOAD_RESULTS_TOPIC = 'testkit.load_results'
+
+
+class MessageBusError(Exception):
+    pass
+
+
+class MessageBusOverflow(MessageBusError):
+    """Raised when messages on a topic were dropped before a wrapper read
+    them
+    """
+
+
+class TopicLog(object):
+    def __init__(self, topic, size):
+        self.topic = topic
+        self.messages = deque(maxlen=size)
+        # Index since the start of the run of the oldest retained message
+        self.first_index = 0
+        self.cursors = {}
+        # (waiter, request_id) of pending waits
+        self.waiting = []
+        # The last answered request of each waiter and its cursor before
+        self.answered = {}
+
+    def append(self, payload):
+        if len(self.messages) == self.messages.maxlen:
+            self.first_index += 1
+        self.messages.append(payload)
+
+    def next_reply(self, waiter, request_id):
+        """The reply for waiter's next message or None if there isn't one"""
+        cursor = self.cursors.get(waiter, 0)
+        if cursor < self.first_index:
+            reply = 'bus_overflow', (self.topic, self.first_index - cursor,
+                    request_id)
+            self.cursors[waiter] = self.first_index
+        elif cursor - self.first_index < len(self.messages):
+            reply = 'bus_message', (self.topic,
+                    self.messages[cursor - self.first_index], request_id)
+            self.cursors[waiter] = cursor + 1
+        else:
+            return None
+        self.answered[waiter] = (request_id, cursor)
+        return reply
+
+    def cancel(self, waiter, request_id):
+        if (waiter, request_id) in self.waiting:
+            self.waiting.remove((waiter, request_id))
+            return
+        answered_id, cursor = self.answered.get(waiter, (None, None))
+        if answered_id == request_id:
+            # The waiter drops the reply so it has to be sent again
+            self.cursors[waiter] = cursor
+            del self.answered[waiter]
+
+
+class MessageBus(object):
+    """The manager's side of the bus. Methods return the ``(waiter, kind,
+    payload)`` replies that should be sent. Every message published to one
+    of ``collected_topics`` is also kept for the manager, however many
+    there are
+    """
+    def __init__(self, queue_size=1024, collected_topics=()):
+        self._queue_size = queue_size
+        self._topics = {}
+        self._collected_topics = collected_topics
+        self._collected = {}
+
+    def _topic_log(self, topic):
+        log = self._topics.get(topic)
+        if log is None:
+            log = self._topics[topic] = TopicLog(topic, self._queue_size)
+        return log
+
+    def publish(self, topic, payload):
+        if topic in self._collected_topics:
+            self._collected.setdefault(topic, []).append(payload)
+        log = self._topic_log(topic)
+        log.append(payload)
+        replies = []
+        for waiter, request_id in log.waiting:
+            kind, reply = log.next_reply(waiter, request_id)
+            replies.append((waiter, kind, reply))
+        log.waiting = []
+        return replies
+
+    def wait(self, waiter, topic, request_id=None):
+        log = self._topic_log(topic)
+        reply = log.next_reply(waiter, request_id)
+        if reply is None:
+            log.waiting.append((waiter, request_id))
+            return []
+        return [(waiter,) + reply]
+
+    def cancel(self, waiter, topic, request_id=None):
+        """Withdraws a wait that timed out, whether or not it was answered"""
+        self._topic_log(topic).cancel(waiter, request_id)
+
+    def collected(self, topic):
+        """Every message of the current run on a collected topic"""
+        return list(self._collected.get(topic, []))
+
+    def reset(self):
+        """Forgets every message. Called at the start of each run"""
+        self._topics = {}
+        self._collected = {}
+
+
+class BusClient(object):
+    """A wrapper's side of the bus"""
+    def __init__(self, send_message, connection):
+        self._send_message = send_message
+        self._connection = connection
+        self._last_request_id = 0
+
+    def publish(self, topic, payload=None):
+        self._send_message('bus_publish', (topic, payload))
+
+    def wait(self, topic, timeout=None):
+        """Returns the next message on topic. Raises TimeoutError if none is
+        published within timeout seconds
+        """
+        self._last_request_id += 1
+        request_id = self._last_request_id
+        self._send_message('bus_wait', (topic, request_id))
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self._connection.poll(remaining):
+                    self._send_message('bus_cancel', (topic, request_id))
+                    raise TimeoutError('Timed out waiting for a message on '
+                            '"%s"' % topic)
+            kind, payload = self._connection.recv()
+            if kind not in BUS_MESSAGE_KINDS:
+                raise MessageBusError('Unexpected "%s" message' % kind)
+            if payload[2] != request_id:
+                # Answers a wait that was cancelled
+                continue
+            return self._open(kind, payload)
+
+    def _open(self, kind, payload):
+        topic, message, request_id = payload
+        if kind == 'bus_overflow':
+            raise MessageBusOverflow('%d messages on "%s" were dropped before '
+                    'they were read' % (message, topic))
+        return message
+
+
+# The client of the wrapper running in this process
+_client = None
+
+
+def set_bus_client(client):
+    global _client
+    _client = client
+
+
+def _current_client():
+    if _client is None:
+        raise MessageBusError('The message bus is only available in a '
+                'wrapper process')
+    return _client
+
+
+def bus_publish(topic, payload=None):
+    """Publishes a message to every wrapper of the running test"""
+    _current_client().publish(topic, payload)
+
+
+def bus_wait(topic, timeout=None):
+    """Waits for the next message published on topic during this run"""
+    return _current_client().wait(topic, timeout)
@@ -4,6 +4,7 @@ testkit.data
 
 Various Data Test Tools
 """
+import os
 import random
 
 NUMBERS = "0123456789"
@@ -22,6 +23,111 @@ def random_string(length, chars=ALL_CHARS):
         array.append(c)
     return "".join(array)
 
+# Random bytes requested from the generator at a time
+RANDOM_CHUNK_SIZE = 1024 * 1024
+
+def _byte_table(chars):
+    """A table for ``str.translate`` mapping bytes onto chars and the bytes
+    it should delete. Only the largest multiple of ``len(chars)`` bytes is
+    kept so that every char is equally likely
+    """
+    _check_chars(chars)
+    usable = 256 - 256 % len(chars)
+    table = ''.join(chars[byte % len(chars)] for byte in xrange(usable))
+    table += '\0' * (256 - usable)
+    deleted = ''.join(chr(byte) for byte in xrange(usable, 256))
+    return table, deleted, usable
+
+def _random_bytes(count, rng):
+    if rng is None:
+        return os.urandom(count)
+    if hasattr(rng, 'bytes'):
+        # numpy.random.RandomState and Generator
+        return rng.bytes(count)
+    chunks = []
+    while count > 0:
+        size = min(count, RANDOM_CHUNK_SIZE)
+        bits = rng.getrandbits(size * 8)
+        chunks.append(('%0*x' % (size * 2, bits)).decode('hex'))
+        count -= size
+    return ''.join(chunks)
+
+def _check_chars(chars):
+    if not 0 < len(chars) <= 256:
+        raise ValueError('chars must have between 1 and 256 characters')
+
+def _random_chars(total, chars, rng):
+    if isinstance(chars, unicode):
+        # str.translate only maps bytes, so draw positions in chars first
+        _check_chars(chars)
+        positions = _random_chars(total,
+                ''.join(chr(index) for index in xrange(len(chars))), rng)
+        return positions.decode('latin-1').translate(dict(enumerate(chars)))
+    table, deleted, usable = _byte_table(chars)
+    pieces = []
+    remaining = total
+    while remaining > 0:
+        # Enough bytes that deleted ones rarely need another round
+        size = remaining * 256 // usable + 64
+        piece = _random_bytes(size, rng).translate(table, deleted)
+        piece = piece[:remaining]
+        pieces.append(piece)
+        remaining -= len(piece)
+    return ''.join(pieces)
+
+def _check_length(length):
+    if length < 0:
+        raise ValueError('String lengths must not be negative')
+
+def _draw_lengths(count, length, rng):
+    if callable(length):
+        lengths = [length(rng) for i in xrange(count)]
+        for string_length in lengths:
+            _check_length(string_length)
+        return lengths
+    shortest, longest = length
+    _check_length(shortest)
+    if longest < shortest:
+        raise ValueError('The longest length is below the shortest')
+    if hasattr(rng, 'integers'):
+        # numpy.random.Generator
+        return rng.integers(shortest, longest + 1, size=count).tolist()
+    if hasattr(rng, 'bytes'):
+        # numpy.random.RandomState
+        return rng.randint(shortest, longest + 1, size=count).tolist()
+    return [rng.randint(shortest, longest) for i in xrange(count)]
+
+def random_strings(count, length, chars=ALL_CHARS, seed=None, rng=None):
+    """Generates count random strings at once.
+
+    ``length`` is a fixed length, a ``(shortest, longest)`` range each
+    length is drawn from uniformly, or a function returning a length when
+    called with the random number generator.
+
+    Bytes come from ``os.urandom`` unless a ``seed`` or a ``random.Random``
+    as ``rng`` is given to make the strings reproducible. A NumPy
+    ``RandomState`` or ``Generator`` as ``rng`` is faster still. The bytes
+    are mapped onto chars with one ``str.translate`` call for all strings.
+    Unicode chars give unicode strings. Negative lengths raise a ValueError.
+    """
+    if rng is None and seed is not None:
+        rng = random.Random(seed)
+    if isinstance(length, (int, long)):
+        _check_length(length)
+        if not length:
+            return [chars[:0]] * count
+        data = _random_chars(count * length, chars, rng)
+        return [data[start:start + length]
+                for start in xrange(0, count * length, length)]
+    lengths = _draw_lengths(count, length, rng or random.Random())
+    data = _random_chars(sum(lengths), chars, rng)
+    strings = []
+    start = 0
+    for string_length in lengths:
+        strings.append(data[start:start + string_length])
+        start += string_length
+    return strings
+
 def dict_to_object(d):
     return type('DictAsObject', (object,), d)
     
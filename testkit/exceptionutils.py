@@ -1,4 +1,11 @@
 import sys
+import array
+import hashlib
+import marshal
+import linecache
+import threading
+import traceback
+from collections import OrderedDict
 
 
 # on pypy we can take advantage of transparent proxies
@@ -16,6 +23,133 @@ except SyntaxError:
 except TypeError:
     raise_helper = 'raise __internal_exception__[0], __internal_exception__[1]'
 
+# Number of fake raise code objects kept for reuse
+FAKE_CODE_CACHE_SIZE = 1024
+
+
+class FakeCodeCache(object):
+    """A least recently used cache of the code objects that raise at a line
+    of a file. Compiling one means compiling ``lineno`` lines, so frames
+    deep into large modules are costly to recreate on every reraise.
+    """
+    def __init__(self, size=FAKE_CODE_CACHE_SIZE):
+        self.size = size
+        self._codes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, filename, lineno):
+        key = (filename, lineno)
+        with self._lock:
+            code = self._codes.pop(key, None)
+            if code is not None:
+                # Most recently used entries are last
+                self._codes[key] = code
+                return code
+        code = compile('\n' * (lineno - 1) + raise_helper, filename, 'exec')
+        with self._lock:
+            self._codes[key] = code
+            while len(self._codes) > self.size:
+                self._codes.popitem(last=False)
+        return code
+
+    def __len__(self):
+        return len(self._codes)
+
+    def clear(self):
+        with self._lock:
+            self._codes.clear()
+
+fake_code_cache = FakeCodeCache()
+
+
+# Version of the binary encoding of PackedFrames. Decoding rejects others
+FRAMES_ENCODING_VERSION = 1
+
+
+class PackedFrames(object):
+    """The location of every frame of a traceback. Each filename is stored
+    once in ``filenames`` and frames are ``(file_index, lineno, name)``
+    tuples.
+
+    Pickled as one versioned string. Function names get a table like the
+    filenames and every frame becomes three little endian 32 bit integers.
+    """
+    __slots__ = ('filenames', 'frames')
+
+    def __init__(self, filenames=None, frames=None):
+        self.filenames = filenames or []
+        self.frames = frames or []
+
+    @classmethod
+    def from_traceback(cls, tb):
+        filenames = []
+        frames = []
+        file_indexes = {}
+        while tb:
+            code = tb.tb_frame.f_code
+            filename = code.co_filename
+            file_index = file_indexes.get(filename)
+            if file_index is None:
+                file_index = file_indexes[filename] = len(filenames)
+                filenames.append(filename)
+            frames.append((file_index, tb.tb_lineno, code.co_name))
+            tb = tb.tb_next
+        return cls(filenames, frames)
+
+    def __iter__(self):
+        """Yields ``(filename, lineno, name)`` for every frame"""
+        filenames = self.filenames
+        for file_index, lineno, name in self.frames:
+            yield filenames[file_index], lineno, name
+
+    def __len__(self):
+        return len(self.frames)
+
+    def encode(self):
+        names = []
+        name_indexes = {}
+        for file_index, lineno, name in self.frames:
+            if name not in name_indexes:
+                name_indexes[name] = len(names)
+                names.append(name)
+        packed = array.array('I', [0]) * (3 * len(self.frames))
+        packed[0::3] = array.array('I', [frame[0] for frame in self.frames])
+        packed[1::3] = array.array('I', [frame[1] for frame in self.frames])
+        packed[2::3] = array.array('I', [name_indexes[frame[2]]
+            for frame in self.frames])
+        if sys.byteorder == 'big':
+            packed.byteswap()
+        return chr(FRAMES_ENCODING_VERSION) + marshal.dumps(
+                (self.filenames, names, packed.tostring()), 2)
+
+    @classmethod
+    def decode(cls, data):
+        version = ord(data[0])
+        if version != FRAMES_ENCODING_VERSION:
+            raise ValueError('Unsupported frames encoding version %d' %
+                    version)
+        filenames, names, packed_string = marshal.loads(data[1:])
+        packed = array.array('I')
+        packed.fromstring(packed_string)
+        if sys.byteorder == 'big':
+            packed.byteswap()
+        frames = zip(packed[0::3], packed[1::3],
+                [names[index] for index in packed[2::3]])
+        return cls(filenames, frames)
+
+    def __reduce__(self):
+        return _decode_frames, (self.encode(),)
+
+
+def _decode_frames(data):
+    return PackedFrames.decode(data)
+
+
+def _unpickle_exception_info(exc_type, exc_value, frames):
+    info = PicklableExceptionInfo(exc_type, exc_value)
+    info._frames = frames
+    return info
+
 
 def store_any_exception(func, args=None, kwargs=None):
     args = args or tuple()
@@ -29,6 +163,20 @@ def store_any_exception(func, args=None, kwargs=None):
 
 
 class PicklableExceptionInfo(object):
+    """An exception and its traceback that can be sent to another process
+    and reraised there.
+
+    Only the location of each frame is kept for pickling. The original
+    traceback is used for as long as the info stays in its process. Once
+    pickled, a traceback is only rebuilt from the frames when the exception
+    is reraised. ``reconstructions`` counts how often that happens.
+    """
+    __slots__ = ('_exc_type', '_exc_value', '_frames', '_traceback',
+            '_generated_traceback', '_fingerprint')
+
+    # Tracebacks rebuilt from frames in this process
+    reconstructions = 0
+
     @classmethod
     def exc_info(cls):
         exc_info = sys.exc_info()
@@ -39,25 +187,80 @@ class PicklableExceptionInfo(object):
     def __init__(self, exc_type, exc_value):
         self._exc_type = exc_type
         self._exc_value = exc_value
-        self._traceback_list = []
+        self._frames = PackedFrames()
+        # None of these are pickled
+        self._traceback = None
+        self._generated_traceback = None
+        self._fingerprint = None
+
+    def __reduce__(self):
+        return _unpickle_exception_info, (self._exc_type, self._exc_value,
+                self._frames)
+
+    @property
+    def exc_type(self):
+        return self._exc_type
+
+    @property
+    def exc_value(self):
+        return self._exc_value
+
+    @property
+    def frames(self):
+        """``(filename, lineno, function name)`` of every frame"""
+        return list(self._frames)
+
+    @property
+    def fingerprint(self):
+        """A hash of the exception's type and the location of every frame.
+        Failures with the same cause share it even if their messages differ
+        """
+        if self._fingerprint is None:
+            self._fingerprint = self._hash_locations(
+                    ['%s:%d:%s' % frame for frame in self._frames])
+        return self._fingerprint
+
+    def set_location(self, location):
+        """Fingerprints the exception by location, such as the name of what
+        timed out, instead of by its frames. For exceptions that testkit
+        raises on behalf of other code
+        """
+        self._fingerprint = self._hash_locations([location])
+
+    def _hash_locations(self, locations):
+        exc_type = self._exc_type
+        parts = ['%s.%s' % (getattr(exc_type, '__module__', ''),
+            getattr(exc_type, '__name__', exc_type))]
+        parts.extend(locations)
+        return hashlib.sha1('\n'.join(parts)).hexdigest()
+
+    def detached(self):
+        """A copy without the original traceback, which keeps every frame
+        and its locals alive
+        """
+        return _unpickle_exception_info(self._exc_type, self._exc_value,
+                self._frames)
 
     def save_traceback(self, tb):
         """Save the original traceback"""
-        traceback_list = self._traceback_list
-        current_tb = tb
-        while current_tb:
-            traceback_data = PicklableTracebackData.from_traceback(current_tb)
-            traceback_list.append(traceback_data)
-            current_tb = current_tb.tb_next
+        self._traceback = tb
+        self._frames = PackedFrames.from_traceback(tb)
 
     def reraise(self):
-        generated_tb = self.generated_traceback()
-        raise self._exc_type, self._exc_value, generated_tb.tb
+        tb = self._traceback
+        if tb is None and self._frames:
+            tb = self.generated_traceback().tb
+        raise self._exc_type, self._exc_value, tb
 
     def generated_traceback(self):
+        """The traceback rebuilt from the frames. Built once per info"""
+        if self._generated_traceback is not None:
+            return self._generated_traceback
+        PicklableExceptionInfo.reconstructions += 1
         prev_tb = None
         initial_tb = None
-        for traceback_data in self._traceback_list:
+        for filename, lineno, name in self._frames:
+            traceback_data = PicklableTracebackData(filename, lineno)
             exc_info = traceback_data.create_exc_info(self._exc_type,
                     self._exc_value)
             exc_type, exc_value, tb = exc_info
@@ -67,10 +270,27 @@ class PicklableExceptionInfo(object):
             else:
                 prev_tb.set_next(frame)
             prev_tb = frame
+        self._generated_traceback = initial_tb
         return initial_tb
 
+    def format(self):
+        """The traceback and exception as printed by Python, formatted from
+        the frames without rebuilding the traceback
+        """
+        lines = []
+        if self._frames:
+            lines.append('Traceback (most recent call last):\n')
+            lines.extend(traceback.format_list([(filename, lineno, name,
+                linecache.getline(filename, lineno).strip() or None)
+                for filename, lineno, name in self._frames]))
+        lines.extend(traceback.format_exception_only(self._exc_type,
+            self._exc_value))
+        return ''.join(lines)
+
 
 class PicklableTracebackData(object):
+    __slots__ = ('_code_filename', '_lineno')
+
     @classmethod
     def from_traceback(cls, tb):
         frame = tb.tb_frame
@@ -85,8 +305,7 @@ class PicklableTracebackData(object):
 
     def create_exc_info(self, exc_type, exc_value):
         code_filename = self._code_filename
-        fake_code = compile('\n' * (self._lineno - 1) + raise_helper,
-                code_filename, 'exec')
+        fake_code = fake_code_cache.get(code_filename, self._lineno)
         tb_globals = {
             '__name__': code_filename,
             '__file__': code_filename,
@@ -0,0 +1,105 @@
+"""
+testkit.failures
+~~~~~~~~~~~~~~~~
+
+Groups failures that have the same cause. When a shared dependency breaks,
+hundreds of tests fail with the same traceback. Every failure reported by a
+ProcessMonitor, a ``timeout`` or the MultiprocessScheduler is recorded in
+``failure_collector`` by its fingerprint. Only the first failure of each
+group is kept, so memory grows with the number of distinct failures::
+
+    import atexit, sys
+    from testkit import failure_collector
+
+    atexit.register(lambda: sys.stderr.write(failure_collector.summary()))
+"""
+import threading
+from collections import OrderedDict
+
+# Sources kept as examples for each group of failures
+FAILURE_SOURCES = 5
+
+
+class FailureGroup(object):
+    """Failures that share a fingerprint. ``exception_info`` is the first of
+    them and ``sources`` name where the first few happened
+    """
+    def __init__(self, fingerprint, exception_info):
+        self.fingerprint = fingerprint
+        self.exception_info = exception_info
+        self.count = 0
+        self.sources = []
+
+    def add(self, source=None):
+        self.count += 1
+        if source is not None and len(self.sources) < FAILURE_SOURCES:
+            self.sources.append(source)
+
+    def format(self):
+        lines = ['%d x %s' % (self.count, self.fingerprint[:12])]
+        if self.sources:
+            more = ''
+            if self.count > len(self.sources):
+                more = ', ...'
+            lines.append('In %s%s' % (', '.join(self.sources), more))
+        lines.append(self.exception_info.format().rstrip('\n'))
+        return '\n'.join(lines)
+
+
+class FailureCollector(object):
+    """Counts failures by fingerprint, most frequent first in ``groups``"""
+    def __init__(self):
+        self._groups = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, exception_info, source=None):
+        """Records a failure and returns its FailureGroup"""
+        fingerprint = exception_info.fingerprint
+        with self._lock:
+            group = self._groups.get(fingerprint)
+            if group is None:
+                group = FailureGroup(fingerprint, exception_info.detached())
+                self._groups[fingerprint] = group
+            group.add(source)
+        return group
+
+    @property
+    def groups(self):
+        with self._lock:
+            groups = self._groups.values()
+        # Stable, so groups seen first stay first among equals
+        return sorted(groups, key=lambda group: group.count, reverse=True)
+
+    @property
+    def total(self):
+        """Failures recorded, counting duplicates"""
+        return sum(group.count for group in self.groups)
+
+    def __len__(self):
+        return len(self._groups)
+
+    def clear(self):
+        with self._lock:
+            self._groups.clear()
+
+    def summary(self):
+        """Every distinct failure once with how often it happened. Empty if
+        nothing failed
+        """
+        groups = self.groups
+        if not groups:
+            return ''
+        sections = ['%d distinct failures out of %d' % (len(groups),
+            sum(group.count for group in groups))]
+        for group in groups:
+            sections.append(group.format())
+        return '\n\n'.join(sections) + '\n'
+
+
+# Failures of this process
+failure_collector = FailureCollector()
+
+
+def record_failure(exception_info, source=None):
+    """Records a failure in ``failure_collector``"""
+    return failure_collector.add(exception_info, source)
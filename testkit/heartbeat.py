@@ -0,0 +1,140 @@
+"""
+testkit.heartbeat
+~~~~~~~~~~~~~~~~~
+
+Heartbeats let the ProcessManager notice a hung wrapper long before the
+test's runtime limit. A background thread in the wrapper's process sends the
+phase the wrapper is in and how many progress marks it has made. The manager
+fails the test as soon as the heartbeats stop or, during ``run``, the marks
+stop advancing.
+"""
+import time
+import threading
+from .timeouts import TimeoutError
+
+# Heartbeats that may be missed before a wrapper counts as stalled
+HEARTBEAT_MISSES = 3
+
+
+class ProcessStalled(TimeoutError):
+    pass
+
+
+class Heartbeat(object):
+    """The wrapper's side. ``current_phase`` is called for the phase to
+    report
+    """
+    def __init__(self, send_message, current_phase, interval):
+        self._send_message = send_message
+        self._current_phase = current_phase
+        self._interval = interval
+        self.marks = 0
+        self.last_mark = None
+        # Set while a forked child beats for this process
+        self.paused = False
+
+    def mark(self, label=None):
+        """Records progress. Marks are cheap and only sent with the next
+        heartbeat
+        """
+        self.marks += 1
+        self.last_mark = label
+
+    def start(self):
+        if not self._interval:
+            return
+        thread = threading.Thread(target=self._beat)
+        thread.daemon = True
+        thread.start()
+
+    def _beat(self):
+        while True:
+            if not self.paused:
+                try:
+                    self._send_message('heartbeat', (self._current_phase(),
+                        self.marks, self.last_mark))
+                except (IOError, OSError):
+                    # The parent has stopped listening
+                    return
+            time.sleep(self._interval)
+
+
+class HeartbeatMonitor(object):
+    """The manager's side. Tracks one wrapper's heartbeats"""
+    def __init__(self, name, interval, progress_timeout=None):
+        self._name = name
+        self._interval = interval
+        self._progress_timeout = progress_timeout
+        now = time.time()
+        self._last_beat = now
+        self._phase = None
+        self._marks = 0
+        self._last_mark = None
+        self._last_progress = now
+        self._running = False
+
+    def beat(self, phase, marks, last_mark):
+        now = time.time()
+        self._last_beat = now
+        self._phase = phase
+        if marks != self._marks:
+            self._marks = marks
+            self._last_mark = last_mark
+            self._last_progress = now
+
+    def run_started(self):
+        self._running = True
+        self._last_progress = time.time()
+
+    def run_finished(self):
+        self._running = False
+
+    def check(self):
+        """Raises ProcessStalled if the wrapper has stopped beating or making
+        progress
+        """
+        now = time.time()
+        if self._interval and (now - self._last_beat >
+                self._interval * HEARTBEAT_MISSES):
+            self._stalled('no heartbeat for %.1f seconds' %
+                    (now - self._last_beat))
+        if (self._progress_timeout and self._running and
+                now - self._last_progress > self._progress_timeout):
+            self._stalled('no progress for %.1f seconds' %
+                    (now - self._last_progress))
+
+    def _stalled(self, reason):
+        message = 'Wrapper "%s" stalled in phase "%s", %s' % (self._name,
+                self._phase, reason)
+        if self._marks:
+            message += ' (%d progress marks, last "%s")' % (self._marks,
+                    self._last_mark)
+        raise ProcessStalled(message)
+
+
+# The heartbeat of the wrapper running in this process
+_heartbeat = None
+
+
+def set_heartbeat(heartbeat):
+    global _heartbeat
+    _heartbeat = heartbeat
+
+
+def mark_progress(label=None):
+    """Records progress of the wrapper running in this process. Does nothing
+    outside of wrapper processes
+    """
+    if _heartbeat is not None:
+        _heartbeat.mark(label)
+
+
+def effective_interval(interval, progress_timeout):
+    """The heartbeat interval a wrapper uses. Progress marks travel with
+    heartbeats so a progress timeout implies heartbeats
+    """
+    if interval:
+        return interval
+    if progress_timeout:
+        return progress_timeout / float(HEARTBEAT_MISSES + 1)
+    return None
@@ -0,0 +1,293 @@
+"""
+testkit.loadgen
+~~~~~~~~~~~~~~~
+
+Load generating wrappers. Each LoadGenerator process calls ``call`` at a
+target rate or concurrency, records latencies in a LatencyHistogram and
+publishes its results on the message bus. The test body gets the merged
+results with ``wait_for_load`` and the manager with
+``ProcessManager.load_report``::
+
+    class Clients(LoadGenerator):
+        rate = 200
+        duration = 2.0
+
+        def call(self):
+            urllib2.urlopen(self.initial_options['url']).read()
+
+    @multiprocess([ServerProcess, (Clients, 4)])
+    def test_latency(initial, shared):
+        report = wait_for_load(timeout=10)
+        assert report.p99 < 0.020
+"""
+import time
+import threading
+from .bus import LOAD_GENERATORS_TOPIC, LOAD_RESULTS_TOPIC, bus_wait
+from .processes import ProcessWrapper
+
+
+class LatencyHistogram(object):
+    """A log-linear histogram of latencies in the style of HdrHistogram.
+
+    Latencies are kept as whole microseconds. Values below
+    ``2 ** precision`` are exact. Above that every power of two is split into
+    ``2 ** (precision - 1)`` buckets, so values are off by less than
+    ``2 ** (1 - precision)``. Histograms with the same precision can be
+    merged by adding bucket counts.
+    """
+    def __init__(self, precision=8):
+        self.precision = precision
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, micros):
+        exact = 1 << self.precision
+        if micros < exact:
+            return micros
+        half = exact >> 1
+        shift = micros.bit_length() - self.precision
+        return exact + (shift - 1) * half + (micros >> shift) - half
+
+    def _value(self, index):
+        """The middle of a bucket in microseconds"""
+        exact = 1 << self.precision
+        if index < exact:
+            return index
+        half = exact >> 1
+        shift, offset = divmod(index - exact, half)
+        shift += 1
+        return ((offset + half) << shift) + ((1 << shift) - 1) / 2.0
+
+    def record(self, latency):
+        """Records a latency given in seconds"""
+        micros = max(int(latency * 1000000 + 0.5), 0)
+        index = self._index(micros)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += micros
+        if self.min is None or micros < self.min:
+            self.min = micros
+        if self.max is None or micros > self.max:
+            self.max = micros
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError('Cannot merge histograms with precisions %d '
+                    'and %d' % (self.precision, other.precision))
+        for index, count in other.counts.iteritems():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or
+                other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or
+                other.max > self.max):
+            self.max = other.max
+
+    def percentile(self, percent):
+        """The latency in seconds that percent of the calls didn't exceed"""
+        if not self.count:
+            return None
+        rank = max(int(-(-self.count * percent // 100)), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                micros = min(max(self._value(index), self.min), self.max)
+                return micros / 1000000.0
+        return self.max / 1000000.0
+
+    @property
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total / 1000000.0 / self.count
+
+
+class LoadReport(object):
+    """Latencies, errors and throughput of one or more load generators"""
+    def __init__(self, histogram, errors, duration):
+        self.histogram = histogram
+        self.errors = errors
+        self.duration = duration
+
+    @classmethod
+    def merge(cls, reports):
+        """Combines reports of generators that ran at the same time"""
+        histogram = LatencyHistogram()
+        if reports:
+            histogram = LatencyHistogram(reports[0].histogram.precision)
+        errors = 0
+        duration = 0.0
+        for report in reports:
+            histogram.merge(report.histogram)
+            errors += report.errors
+            duration = max(duration, report.duration)
+        return cls(histogram, errors, duration)
+
+    @property
+    def calls(self):
+        return self.histogram.count
+
+    @property
+    def throughput(self):
+        """Successful calls per second"""
+        if not self.duration:
+            return 0.0
+        return self.calls / self.duration
+
+    def percentile(self, percent):
+        return self.histogram.percentile(percent)
+
+    @property
+    def p50(self):
+        return self.percentile(50)
+
+    @property
+    def p99(self):
+        return self.percentile(99)
+
+    @property
+    def p999(self):
+        return self.percentile(99.9)
+
+    def __repr__(self):
+        if not self.calls:
+            return '<LoadReport no calls, %d errors>' % self.errors
+        return ('<LoadReport %d calls, %d errors, %.1f/s, p50 %.3f ms, '
+                'p99 %.3f ms, p999 %.3f ms>' % (self.calls, self.errors,
+                    self.throughput, self.p50 * 1000, self.p99 * 1000,
+                    self.p999 * 1000))
+
+
+class LoadSchedule(object):
+    """Hands out the start times of calls to a generator's threads.
+
+    With a rate, calls are scheduled at fixed intervals and latency is
+    measured from when a call should have started. A slow call then also
+    counts against the calls queued behind it instead of hiding them.
+    Without a rate every thread calls again as soon as its last call ends.
+    """
+    def __init__(self, rate, duration, requests):
+        self._lock = threading.Lock()
+        self._interval = None
+        if rate:
+            self._interval = 1.0 / rate
+        self._remaining = requests
+        self.start = time.time()
+        self._next = self.start
+        self._end = None
+        if duration is not None:
+            self._end = self.start + duration
+
+    def next_start(self):
+        """The time the next call should start or None when done"""
+        with self._lock:
+            if self._remaining is not None:
+                if self._remaining <= 0:
+                    return None
+                self._remaining -= 1
+            if self._interval is None:
+                start = time.time()
+            else:
+                start = self._next
+                self._next += self._interval
+            if self._end is not None and start >= self._end:
+                return None
+            return start
+
+
+def generate_load(call, rate=None, concurrency=1, duration=1.0,
+        requests=None, precision=8):
+    """Calls ``call`` until duration seconds passed or requests calls were
+    made, from concurrency threads at a total rate per second
+    """
+    if duration is None and requests is None:
+        raise ValueError('Load needs a duration or a number of requests')
+    schedule = LoadSchedule(rate, duration, requests)
+    histograms = [LatencyHistogram(precision) for i in xrange(concurrency)]
+    errors = [0] * concurrency
+
+    def make_calls(worker):
+        histogram = histograms[worker]
+        while True:
+            start = schedule.next_start()
+            if start is None:
+                return
+            delay = start - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                call()
+            except Exception:
+                errors[worker] += 1
+                continue
+            histogram.record(time.time() - start)
+
+    if concurrency == 1:
+        make_calls(0)
+    else:
+        threads = [threading.Thread(target=make_calls, args=(worker,))
+                for worker in xrange(concurrency)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+    histogram = LatencyHistogram(precision)
+    for thread_histogram in histograms:
+        histogram.merge(thread_histogram)
+    return LoadReport(histogram, sum(errors), time.time() - schedule.start)
+
+
+class LoadGenerator(ProcessWrapper):
+    """A wrapper that puts load on whatever the test runs.
+
+    Override ``call`` to make one request. ``rate`` is the calls per second
+    of this process across its ``concurrency`` threads. Leave it at None to
+    call as fast as possible. Load stops after ``duration`` seconds or
+    ``requests`` calls. Calls raising an exception count as errors.
+
+    Once done the generator publishes a LoadReport and, with ``linger``,
+    keeps running so that the test body decides when the test ends.
+    """
+    generates_load = True
+
+    rate = None
+    concurrency = 1
+    duration = 1.0
+    requests = None
+    precision = 8
+    linger = True
+
+    def call(self):
+        raise NotImplementedError()
+
+    def run(self):
+        report = generate_load(self.call, self.rate, self.concurrency,
+                self.duration, self.requests, self.precision)
+        self.publish(LOAD_RESULTS_TOPIC, report)
+        while self.linger:
+            time.sleep(1.0)
+
+
+def wait_for_load(timeout=None):
+    """Waits in the test body for every LoadGenerator of the test and
+    returns their merged LoadReport
+    """
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout
+
+    def remaining():
+        if deadline is None:
+            return None
+        return max(deadline - time.time(), 0)
+    generators = bus_wait(LOAD_GENERATORS_TOPIC, remaining())
+    reports = [bus_wait(LOAD_RESULTS_TOPIC, remaining())
+            for i in xrange(generators)]
+    return LoadReport.merge(reports)
@@ -0,0 +1,103 @@
+"""
+testkit.metrics
+~~~~~~~~~~~~~~~
+
+Counters and arrays of counters shared by every process of a multiprocess
+test. They live in one shared memory array allocated by the ProcessManager
+before any process is started. Each process has its own stripe of the array
+and is the only one writing to it, so updates need neither locks nor
+messages. Reads add up every stripe.
+"""
+import multiprocessing
+
+
+class SharedMetrics(object):
+    """Integer metrics declared as ``{name: size}``. A metric of size one is
+    a counter. Larger ones are arrays such as latency buckets.
+
+    Only the process owning a stripe may update it. Threads within one
+    process share its stripe and must guard their own updates.
+    """
+    def __init__(self, sizes, stripes, array=None, stripe=None):
+        self._sizes = dict(sizes)
+        self._stripes = stripes
+        self._offsets = {}
+        offset = 0
+        for name in sorted(self._sizes):
+            self._offsets[name] = offset
+            offset += self._sizes[name]
+        self._width = offset
+        if array is None and offset:
+            array = multiprocessing.RawArray('l', offset * stripes)
+        self._array = array
+        self._stripe = stripe
+
+    def for_stripe(self, stripe):
+        """The same metrics, updated through the given stripe"""
+        return type(self)(self._sizes, self._stripes, self._array, stripe)
+
+    @property
+    def names(self):
+        return sorted(self._sizes)
+
+    def _position(self, name, index):
+        if index >= self._sizes[name]:
+            raise IndexError('Metric "%s" has %d entries' % (name,
+                self._sizes[name]))
+        return self._stripe * self._width + self._offsets[name] + index
+
+    def add(self, name, value=1, index=0):
+        if self._stripe is None:
+            raise ValueError('Metrics can only be updated through a stripe')
+        self._array[self._position(name, index)] += value
+
+    def values(self, name):
+        """The totals of every entry of a metric across all stripes"""
+        size = self._sizes[name]
+        totals = [0] * size
+        offset = self._offsets[name]
+        for stripe in xrange(self._stripes):
+            start = stripe * self._width + offset
+            entries = self._array[start:start + size]
+            for index in xrange(size):
+                totals[index] += entries[index]
+        return totals
+
+    def value(self, name):
+        """The total of a counter across all stripes"""
+        return sum(self.values(name))
+
+    def snapshot(self):
+        return dict((name, self.values(name)) for name in self._sizes)
+
+    def clear(self):
+        for position in xrange(self._width * self._stripes):
+            self._array[position] = 0
+
+
+def merge_metric_sizes(wrapper_classes):
+    """Combines the ``metric_sizes`` declared by each wrapper class"""
+    sizes = {}
+    for wrapper_cls in wrapper_classes:
+        for name, size in wrapper_cls.metric_sizes.iteritems():
+            if sizes.setdefault(name, size) != size:
+                raise ValueError('Metric "%s" is declared with sizes %d and '
+                        '%d' % (name, sizes[name], size))
+    return sizes
+
+
+# The metrics of the wrapper running in this process
+_metrics = None
+
+
+def set_current_metrics(metrics):
+    global _metrics
+    _metrics = metrics
+
+
+def current_metrics():
+    """The shared metrics of the test running in this process"""
+    if _metrics is None:
+        raise ValueError('Shared metrics are only available in a wrapper '
+                'process')
+    return _metrics
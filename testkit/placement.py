@@ -0,0 +1,100 @@
+"""
+testkit.placement
+~~~~~~~~~~~~~~~~~
+
+CPU affinity and niceness of wrapper processes. Affinity uses
+``os.sched_setaffinity`` where it exists and calls the C library directly
+otherwise. It is only supported on Linux.
+"""
+import os
+import errno
+import ctypes
+import ctypes.util
+
+# Size of the C library's cpu_set_t
+CPU_SETSIZE = 1024
+_MASK_BITS = 8 * ctypes.sizeof(ctypes.c_ulong)
+
+
+class CPUSet(ctypes.Structure):
+    _fields_ = [('bits', ctypes.c_ulong * (CPU_SETSIZE // _MASK_BITS))]
+
+
+def _load_libc():
+    if not os.uname()[0] == 'Linux':
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.sched_setaffinity
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+_libc = _load_libc()
+
+
+def affinity_supported():
+    return hasattr(os, 'sched_setaffinity') or _libc is not None
+
+
+def parse_cpu_list(cpus):
+    """Parses a Linux style CPU list such as ``'0-1,4'``. Iterables of CPU
+    numbers are returned sorted
+    """
+    if not isinstance(cpus, basestring):
+        return sorted(set(cpus))
+    parsed = set()
+    for part in cpus.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            parsed.update(range(int(first), int(last) + 1))
+        else:
+            parsed.add(int(part))
+    return sorted(parsed)
+
+
+def set_cpu_affinity(cpus, pid=0):
+    """Restricts a process, this one by default, to the given CPUs"""
+    cpus = parse_cpu_list(cpus)
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(pid, cpus)
+        return
+    if _libc is None:
+        raise OSError(errno.ENOSYS, 'CPU affinity is not supported here')
+    cpu_set = CPUSet()
+    for cpu in cpus:
+        if not 0 <= cpu < CPU_SETSIZE:
+            raise ValueError('Invalid CPU %d' % cpu)
+        cpu_set.bits[cpu // _MASK_BITS] |= 1 << (cpu % _MASK_BITS)
+    if _libc.sched_setaffinity(pid, ctypes.sizeof(cpu_set),
+            ctypes.byref(cpu_set)) != 0:
+        error_code = ctypes.get_errno()
+        raise OSError(error_code, os.strerror(error_code))
+
+
+def get_cpu_affinity(pid=0):
+    """The CPUs a process may run on or None if that can't be found out"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(pid))
+    if _libc is None:
+        return None
+    cpu_set = CPUSet()
+    if _libc.sched_getaffinity(pid, ctypes.sizeof(cpu_set),
+            ctypes.byref(cpu_set)) != 0:
+        error_code = ctypes.get_errno()
+        raise OSError(error_code, os.strerror(error_code))
+    return [cpu for cpu in xrange(CPU_SETSIZE)
+            if cpu_set.bits[cpu // _MASK_BITS] & (1 << (cpu % _MASK_BITS))]
+
+
+def apply_placement(cpus=None, nice=None):
+    """Sets this process's CPU affinity and raises its niceness by nice.
+    Returns the placement in effect afterwards
+    """
+    if cpus is not None:
+        set_cpu_affinity(cpus)
+    niceness = os.nice(nice or 0)
+    return {'cpus': get_cpu_affinity(), 'nice': niceness}
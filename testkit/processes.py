@@ -10,34 +10,174 @@ errors between the processees. A test has four stages:
     3. Run Test
     4. Teardown
 """
+import os
+import sys
+import atexit
+import signal
 import multiprocessing
-import Queue
 import time
 import gc
 import inspect
+import select
+import errno
+import fcntl
+import cPickle
+import threading
+from contextlib import contextmanager
 from functools import wraps, partial
 from .exceptionutils import PicklableExceptionInfo
-from .timeouts import TimeoutError
+from .timeouts import (TimeoutError, ProcessGroupLeader, terminate_process,
+        terminate_processes, attach_stacks, in_main_thread)
+from .stacks import (prepare_stack_dumps, start_stack_dumper,
+        remove_stack_dumper, collect_stacks)
+from .telemetry import PhaseRecorder, TelemetryReport
+from .sharedmem import shared_buffer, iter_shared_data, map_shared_values
+from .bus import (MessageBus, BusClient, BUS_MESSAGE_KINDS, set_bus_client,
+        bus_publish, bus_wait, MessageBusError, MessageBusOverflow,
+        LOAD_GENERATORS_TOPIC, LOAD_RESULTS_TOPIC)
+from .metrics import (SharedMetrics, merge_metric_sizes, set_current_metrics,
+        current_metrics)
+from .placement import apply_placement
+from .startmethod import check_start_method, preload_modules
+from .heartbeat import (Heartbeat, HeartbeatMonitor, ProcessStalled,
+        set_heartbeat, mark_progress, effective_interval)
+from .profiling import (check_profiler, check_profile_dir, new_profiler,
+        ProfileCollector)
+from .failures import record_failure
 
 
 class ProcessTimedOut(Exception):
     pass
 
 
+def wait_for_any(waitables, timeout=None):
+    """Waits until any of the objects is readable or closed and returns the
+    ready ones. Objects need a ``fileno`` method. This is a stand in for
+    ``multiprocessing.connection.wait`` which Python 2 does not have. It uses
+    poll so that it isn't limited by FD_SETSIZE.
+    """
+    by_fileno = {}
+    poller = select.poll()
+    for waitable in waitables:
+        fileno = waitable.fileno()
+        by_fileno[fileno] = waitable
+        poller.register(fileno, select.POLLIN)
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout
+    while True:
+        poll_timeout = None
+        if deadline is not None:
+            poll_timeout = max(deadline - time.time(), 0) * 1000
+        try:
+            events = poller.poll(poll_timeout)
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+        return [by_fileno[fileno] for fileno, event in events]
+
+
+def wait_for_pid(pid):
+    """Waits for a child process and returns its status"""
+    while True:
+        try:
+            return os.waitpid(pid, 0)[1]
+        except OSError, e:
+            if e.errno != errno.EINTR:
+                raise
+
+
+def exit_code_from_status(status):
+    """Converts a wait status to an exit code like Process.exitcode"""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def set_close_on_exec(fileno):
+    flags = fcntl.fcntl(fileno, fcntl.F_GETFD)
+    fcntl.fcntl(fileno, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+
+def flush_standard_streams():
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.flush()
+        except (IOError, ValueError):
+            # Closed or broken streams have nothing left to write
+            pass
+
+
+def pickle_message(kind, payload=None):
+    """Pickles a message once so it can be sent to many processes. The
+    result is read with ``Connection.recv`` like any other message
+    """
+    return cPickle.dumps((kind, payload), cPickle.HIGHEST_PROTOCOL)
+
+
+class RunInterrupted(BaseException):
+    """Raised inside a persistent wrapper's ``run`` when the test it was
+    running for has finished. It derives from BaseException so that
+    ``except Exception`` blocks don't swallow it.
+    """
+
+
 class ProcessWrapper(object):
-    def __init__(self, initial_options, options_queue, exception_queue,
-            shared_options_queue, process_ready_event, run_event):
+    # When True a persistent wrapper forks a new child for every run. The
+    # run can't change this process so every run starts from the state left
+    # by setup. Teardown only runs once, in this process
+    snapshot = False
+    # Shared counters this wrapper uses as ``{name: size}``. They are
+    # available as ``self.metrics`` in every wrapper of the test
+    metric_sizes = {}
+    # Set by LoadGenerator. The manager tells the test how many there are
+    generates_load = False
+    # CPUs this wrapper may run on as a list or a string like "0-1,4", or a
+    # method returning either. Applied with ``nice`` before anything else
+    cpu_affinity = None
+    # Increment to the process's niceness
+    nice = None
+    # Seconds between heartbeats. The manager fails the test when several are
+    # missed in a row
+    heartbeat_interval = None
+    # Seconds ``run`` may go without calling ``mark_progress``
+    progress_timeout = None
+
+    def __init__(self, initial_options, connection, start_barrier=None,
+            replica_index=0, replica_count=1):
         self.initial_options = initial_options
-        self._options_queue = options_queue
-        self._exception_queue = exception_queue
-        self._shared_options_queue = shared_options_queue
-        self._process_ready_event = process_ready_event
-        self._run_event = run_event
+        self.run_options = None
+        self.replica_index = replica_index
+        self.replica_count = replica_count
+        self.metrics = None
+        # Set by the manager when the test is profiled
+        self._profiler = None
+        self._connection = connection
+        self._start_barrier = start_barrier
+        self._running = False
+        # Set when a profiled run gets SIGTERM
+        self._terminated = False
+        # Interrupts that arrive while sending wait for the send to finish
+        self._deferring_interrupts = False
+        self._interrupt_pending = False
+        # The heartbeat thread sends too
+        self._send_lock = threading.Lock()
+        phase_recorder = PhaseRecorder(self._send_phase)
+        self._phase = phase_recorder.phase
+        self._bus = BusClient(self._send_message, connection)
+        self._heartbeat = Heartbeat(self._send_message,
+                lambda: phase_recorder.current,
+                effective_interval(self.heartbeat_interval,
+                    self.progress_timeout))
 
     def shared_options(self):
         """Override and return a dictionary containing data that you'd like to
         share among other wrappers
 
+        Wrap large buffers with ``shared_buffer`` to place them in shared
+        memory. Every wrapper then receives a read-only ``mmap`` of the one
+        segment instead of a pickled copy.
         """
         return {}
 
@@ -45,35 +185,259 @@ class ProcessWrapper(object):
         """Setup method"""
         pass
 
-    def run_process(self):
-        """Run the processes three stages"""
+    def publish(self, topic, payload=None):
+        """Publishes a message to every wrapper of the running test"""
+        self._bus.publish(topic, payload)
+
+    def wait_for_message(self, topic, timeout=None):
+        """Waits for the next message published on topic during this run.
+        Raises TimeoutError if none arrives within timeout seconds
+        """
+        return self._bus.wait(topic, timeout)
+
+    def mark_progress(self, label=None):
+        """Tells the manager that ``run`` is making progress. Needed at least
+        every ``progress_timeout`` seconds when that is set
+        """
+        self._heartbeat.mark(label)
+
+    def _send_message(self, kind, payload=None):
+        with self._interrupts_deferred():
+            with self._send_lock:
+                self._connection.send((kind, payload))
+
+    @contextmanager
+    def _interrupts_deferred(self):
+        """Holds back RunInterrupted until the block is done so that it can't
+        cut a message in half. Signals are only handled in the main thread so
+        other threads have nothing to defer
+        """
+        if not in_main_thread() or self._deferring_interrupts:
+            yield
+            return
+        self._deferring_interrupts = True
+        try:
+            yield
+        finally:
+            self._deferring_interrupts = False
+        if self._interrupt_pending:
+            self._interrupt_pending = False
+            self._running = False
+            raise RunInterrupted()
+
+    def _receive_message(self, expected_kind):
+        kind, payload = self._connection.recv()
+        if kind != expected_kind:
+            raise ProcessError('Expected a "%s" message but received "%s"' %
+                    (expected_kind, kind))
+        return payload
+
+    def _send_phase(self, record):
+        try:
+            self._send_message('phase', record)
+        except IOError:
+            # The parent has stopped listening
+            pass
+
+    def _send_profile(self, profile):
+        try:
+            self._send_message('profile', profile)
+        except IOError:
+            pass
+
+    def _call_run(self):
+        """Calls run, under the profiler if the test is profiled"""
+        profiler = new_profiler(self._profiler)
+        if profiler is None:
+            self.run()
+            return
+        # Wrappers that are still running when the test ends are terminated.
+        # Let them send what they have first
+        self._terminated = False
+        previous_handler = signal.signal(signal.SIGTERM, self._terminate_run)
         try:
+            self._running = True
+            try:
+                profiler.call(self.run)
+            finally:
+                # An interrupt here ends the run early but can't skip the
+                # cleanup below
+                self._running = False
+        finally:
+            signal.signal(signal.SIGTERM, previous_handler)
+            self._send_profile(profiler.profile)
+            if self._terminated:
+                # Exit the way an unprofiled run would have
+                os.kill(os.getpid(), signal.SIGTERM)
+
+    def _place_process(self):
+        cpus = self.cpu_affinity
+        if callable(cpus):
+            cpus = cpus()
+        if cpus is None and self.nice is None:
+            return
+        self._send_message('placement', apply_placement(cpus, self.nice))
+
+    def _setup_process(self):
+        with self._phase('shared_options'):
             options = self.shared_options()
             options_copy = options.copy()
-            self._options_queue.put(options_copy)
-            shared_options = self._shared_options_queue.get()
+            self._send_message('options', options_copy)
+            shared_options = map_shared_values(
+                    self._receive_message('shared_options'))
+        with self._phase('setup'):
             self.setup(shared_options)
-            self._process_ready_event.set()
-            self._run_event.wait()
-            self.run()
+        self._send_message('ready')
+
+    def run_process(self):
+        """Run the processes three stages"""
+        try:
+            self._setup_process()
+            with self._phase('barrier'):
+                self.run_options = self._receive_message('run')
+                if self._start_barrier is not None:
+                    self._start_barrier.wait()
+            with self._phase('run'):
+                self._call_run()
+        except:
+            exc_info = PicklableExceptionInfo.exc_info()
+            self._send_message('exception', exc_info)
+        finally:
+            with self._phase('teardown'):
+                self.teardown()
+
+    def run_persistent_process(self):
+        """Sets up once and then runs every time the parent asks until it is
+        told to stop. Used by ``ProcessFleet``
+        """
+        signal.signal(signal.SIGUSR1, self._interrupt_run)
+        try:
+            self._setup_process()
+            while True:
+                kind, payload = self._connection.recv()
+                if kind == 'stop':
+                    break
+                elif kind == 'reset':
+                    with self._phase('reset'):
+                        self.reset()
+                    self._send_message('ready')
+                elif kind in BUS_MESSAGE_KINDS:
+                    # Answers a wait that was cancelled at the end of a run
+                    pass
+                elif kind == 'run':
+                    self.run_options = payload
+                    if self.snapshot:
+                        self._run_forked()
+                    else:
+                        with self._phase('run'):
+                            self._run_interruptibly()
+                        self._send_message('done')
+                else:
+                    raise ProcessError('Unexpected "%s" message' % kind)
         except:
             exc_info = PicklableExceptionInfo.exc_info()
-            self._exception_queue.put(exc_info)
+            self._send_message('exception', exc_info)
         finally:
-            self.teardown()
+            with self._phase('teardown'):
+                self.teardown()
+
+    def _run_interruptibly(self):
+        self._interrupt_pending = False
+        try:
+            self._running = True
+            try:
+                self._call_run()
+            finally:
+                self._running = False
+        except RunInterrupted:
+            pass
+
+    def _run_forked(self):
+        # The child beats for this process while it runs
+        self._heartbeat.paused = True
+        # A beat being sent while forking would leave the child with a held
+        # lock and half a message. Both processes release their copy
+        self._send_lock.acquire()
+        try:
+            pid = os.fork()
+        finally:
+            self._send_lock.release()
+        if pid == 0:
+            exit_code = 0
+            try:
+                try:
+                    self._heartbeat.paused = False
+                    self._heartbeat.start()
+                    start_stack_dumper()
+                    self._send_message('forked', os.getpid())
+                    with self._phase('run'):
+                        self._call_run()
+                except:
+                    exit_code = 1
+                    exc_info = PicklableExceptionInfo.exc_info()
+                    self._send_message('exception', exc_info)
+            finally:
+                # os._exit skips flushing, so output of the run would be lost
+                flush_standard_streams()
+                remove_stack_dumper()
+                # Skip the cleanup that belongs to this process's parent
+                os._exit(exit_code)
+        status = wait_for_pid(pid)
+        self._heartbeat.paused = False
+        self._send_message('done', exit_code_from_status(status))
+
+    def _terminate_run(self, signum, frame):
+        self._terminated = True
+        self._interrupt_run(signum, frame)
+
+    def _interrupt_run(self, signum, frame):
+        if not self._running:
+            return
+        if self._deferring_interrupts:
+            self._interrupt_pending = True
+            return
+        # Only interrupt once, the cleanup after run must go through
+        self._running = False
+        raise RunInterrupted()
 
     def run(self):
         """The only required method to define in a subclass"""
         raise NotImplementedError()
 
+    def reset(self):
+        """Called between runs of a persistent wrapper"""
+        pass
+
     def teardown(self):
         """Teardown method"""
         pass
 
 
-def start_process(wrapper_cls, *args, **kwargs):
-    wrapper = wrapper_cls(*args, **kwargs)
-    wrapper.run_process()
+def start_process(wrapper_cls, initial_options, connection,
+        persistent=False, start_barrier=None, replica_index=0,
+        replica_count=1, metrics=None, profiler=None):
+    # Programs started by the wrapper must not keep the connection open. The
+    # parent relies on it closing when this process exits
+    set_close_on_exec(connection.fileno())
+    wrapper = wrapper_cls(initial_options, connection, start_barrier,
+            replica_index, replica_count)
+    set_bus_client(wrapper._bus)
+    wrapper.metrics = metrics
+    wrapper._profiler = profiler
+    set_current_metrics(metrics)
+    set_heartbeat(wrapper._heartbeat)
+    try:
+        # Threads only take the placement in effect when they start
+        wrapper._place_process()
+    except:
+        wrapper._send_message('exception', PicklableExceptionInfo.exc_info())
+        return
+    wrapper._heartbeat.start()
+    start_stack_dumper()
+    if persistent:
+        wrapper.run_persistent_process()
+    else:
+        wrapper.run_process()
 
 
 class ProcessError(Exception):
@@ -81,69 +445,267 @@ class ProcessError(Exception):
 
 
 class ProcessMonitor(object):
+    """Watches a wrapper's process from the parent.
+
+    All communication with the process goes over a single duplex pipe as
+    ``(kind, payload)`` messages. The process sends ``options``, ``ready``,
+    ``done`` and ``exception`` messages. The parent sends ``shared_options``,
+    ``run``, ``reset`` and ``stop``. The last two and ``done`` are only used
+    by persistent processes. Snapshot wrappers also send ``forked`` with the
+    pid of the child running the current run, so that the run itself can be
+    killed.
+
+    Wrappers with heartbeats send ``heartbeat`` with their current phase and
+    progress marks from a background thread. Profiled wrappers send
+    ``profile`` after every run.
+
+    Wrappers also send ``bus_publish``, ``bus_wait`` and ``bus_cancel`` to
+    use the manager's message bus and receive ``bus_message`` or
+    ``bus_overflow`` in answer to their waits.
+    """
     @classmethod
-    def new_process(cls, wrapper_cls, initial_options, timeout=5):
-        options_queue = multiprocessing.Queue()
-        exception_queue = multiprocessing.Queue()
-        shared_options_queue = multiprocessing.Queue()
-        process_ready_event = multiprocessing.Event()
-        run_event = multiprocessing.Event()
-        process = multiprocessing.Process(target=start_process,
-            args=(wrapper_cls, initial_options, options_queue,
-                exception_queue, shared_options_queue, process_ready_event,
-                run_event))
+    def new_process(cls, wrapper_cls, initial_options, timeout=5,
+            process_group=False, persistent=False, start_barrier=None,
+            replica_index=0, replica_count=1, bus=None, metrics=None,
+            profiler=None):
+        prepare_stack_dumps()
+        connection, child_connection = multiprocessing.Pipe()
+        process_cls = multiprocessing.Process
+        if process_group:
+            process_cls = ProcessGroupLeader
+        process = process_cls(target=start_process,
+            args=(wrapper_cls, initial_options, child_connection,
+                persistent, start_barrier, replica_index, replica_count,
+                metrics, profiler))
         process.start()
+        # Only the child may hold its end. Otherwise the parent won't see the
+        # end of the file when the child exits
+        child_connection.close()
         name = wrapper_cls.__name__
-        return cls(name, process, options_queue, exception_queue,
-                shared_options_queue, process_ready_event, run_event,
-                timeout)
-
-    def __init__(self, name, process, options_queue, exception_queue,
-            shared_options_queue, process_ready_event, run_event,
-            timeout):
+        if replica_count > 1:
+            name = '%s[%d]' % (name, replica_index)
+        heartbeat = None
+        interval = effective_interval(wrapper_cls.heartbeat_interval,
+                wrapper_cls.progress_timeout)
+        if interval:
+            heartbeat = HeartbeatMonitor(name, interval,
+                    wrapper_cls.progress_timeout)
+        return cls(name, process, connection, timeout, bus, heartbeat)
+
+    def __init__(self, name, process, connection, timeout, bus=None,
+            heartbeat=None):
         self._name = name
+        self._heartbeat = heartbeat
+        self._bus = bus
         self._process = process
-        self._options_queue = options_queue
-        self._exception_queue = exception_queue
-        self._shared_options_queue = shared_options_queue
-        self._process_ready_event = process_ready_event
-        self._run_event = run_event
+        self._connection = connection
         self._timeout = timeout
+        self._options = None
+        self._exception_info = None
+        self._exception_recorded = False
+        self._ready = False
+        self._done = False
+        self._exited = False
+        self._run_pid = None
+        self._interrupted = False
+        self._phases = []
+        self._placement = None
+        self._profiles = []
 
     @property
     def name(self):
         return self._name
 
-    def _send_to_queue(self, queue, data, error=None):
-        error = 'Timed out waiting for process "%s"' % self._name
-        try:
-            queue.put(data, timeout=self._timeout)
-        except Queue.Full:
-            print self.is_alive()
-            self.check_for_exceptions()
-            raise ProcessTimedOut(error)
+    @property
+    def process(self):
+        return self._process
+
+    @property
+    def placement(self):
+        """The CPUs and niceness the process ended up with, if it was told
+        to change them
+        """
+        return self._placement
 
-    def _receive_from_queue(self, queue):
-        error = 'Timed out waiting for process "%s"' % self._name
+    @property
+    def phases(self):
+        """Telemetry records of every phase the process has finished"""
+        return self._phases
+
+    @property
+    def profiles(self):
+        """Profiles of every run the process has finished, if profiled"""
+        return self._profiles
+
+    def _send_message(self, kind, payload=None):
         try:
-            data = queue.get(timeout=self._timeout)
-        except Queue.Empty:
-            print self.is_alive()
-            self.check_for_exceptions()
-            raise ProcessTimedOut(error)
-        return data
+            self._connection.send((kind, payload))
+        except IOError:
+            # The process is gone. That is reported once it is waited on
+            pass
 
     def get_process_options(self):
-        return self._receive_from_queue(self._options_queue)
+        deadline = time.time() + self._timeout
+        while self._options is None:
+            remaining = deadline - time.time()
+            if (self._exited or remaining <= 0 or
+                    not self._connection.poll(remaining)):
+                self.check_for_exceptions()
+                try:
+                    raise ProcessTimedOut('Timed out waiting for process '
+                            '"%s"' % self._name)
+                except ProcessTimedOut:
+                    exception_info = PicklableExceptionInfo.exc_info()
+                    exception_info.set_location(self._name)
+                    self._record_failure(exception_info)
+                    raise
+            self.update_status()
+        return self._options
 
     def send_shared_options(self, shared_options):
-        self._send_to_queue(self._shared_options_queue, shared_options)
+        self._send_message('shared_options', shared_options)
+
+    def send_pickled_message(self, message):
+        """Sends a message already pickled with ``pickle_message``"""
+        try:
+            self._connection.send_bytes(message)
+        except IOError:
+            # The process is gone. That is reported once it is waited on
+            pass
+
+    def fileno(self):
+        """Monitors can be passed to ``wait_for_any``. They become readable
+        when the process sends a message or exits
+        """
+        return self._connection.fileno()
+
+    def update_status(self):
+        """Reads a message from the process. Only call this when the monitor
+        is readable
+        """
+        try:
+            kind, payload = self._connection.recv()
+        except EOFError:
+            # The process has exited or is exiting
+            self._exited = True
+            self._process.join(self._timeout)
+            return
+        if kind == 'options':
+            self._options = payload
+        elif kind == 'ready':
+            self._ready = True
+        elif kind == 'done':
+            self._done = True
+            self._run_pid = None
+            if self._heartbeat is not None:
+                self._heartbeat.run_finished()
+            self._check_run_exit_code(payload)
+        elif kind == 'forked':
+            self._run_pid = payload
+            if self._interrupted:
+                # The run was interrupted before its pid was known
+                self.kill_run()
+        elif kind == 'phase':
+            self._phases.append(payload)
+        elif kind == 'placement':
+            self._placement = payload
+        elif kind == 'profile':
+            self._profiles.append(payload)
+        elif kind == 'heartbeat' and self._heartbeat is not None:
+            self._heartbeat.beat(*payload)
+        elif kind == 'bus_publish' and self._bus is not None:
+            self._send_bus_replies(self._bus.publish(*payload))
+        elif kind == 'bus_wait' and self._bus is not None:
+            self._send_bus_replies(self._bus.wait(self, *payload))
+        elif kind == 'bus_cancel' and self._bus is not None:
+            self._bus.cancel(self, *payload)
+        elif kind == 'exception' and self._exception_info is None:
+            self._exception_info = payload
+
+    def _send_bus_replies(self, replies):
+        for monitor, kind, payload in replies:
+            monitor._send_message(kind, payload)
+
+    def _check_run_exit_code(self, exit_code):
+        """Records an error for forked runs that died without reporting"""
+        if (not exit_code or self._interrupted or
+                self._exception_info is not None):
+            return
+        try:
+            raise ProcessError('Run of process "%s" exited with error code '
+                    '"%d"' % (self._name, exit_code))
+        except ProcessError:
+            self._exception_info = PicklableExceptionInfo.exc_info()
+
+    @property
+    def has_exited(self):
+        return self._exited
+
+    @property
+    def is_done(self):
+        """Whether a persistent process has finished its current run"""
+        return self._done
 
     def is_process_ready(self):
-        return self._process_ready_event.wait(0.5)
+        while (not self._ready and not self._exited and
+                self._connection.poll(0)):
+            self.update_status()
+        return self._ready
+
+    def run(self, run_options=None):
+        self._done = False
+        self._interrupted = False
+        if self._heartbeat is not None:
+            self._heartbeat.run_started()
+        self._send_message('run', run_options)
+
+    def check_heartbeat(self):
+        """Raises ProcessStalled if the process has stopped sending
+        heartbeats or making progress
+        """
+        if self._heartbeat is not None and not self._exited:
+            self._heartbeat.check()
 
-    def run(self):
-        self._run_event.set()
+    def interrupt(self):
+        """Interrupts the current run of a persistent process. Forked runs
+        of snapshot wrappers are simply killed
+        """
+        self._interrupted = True
+        if self._run_pid is not None:
+            self.kill_run()
+            return
+        try:
+            os.kill(self._process.pid, signal.SIGUSR1)
+        except OSError:
+            pass
+
+    def stack_pids(self):
+        """The ``{name: pid}`` of the process and of its run, if forked, for
+        collecting stacks
+        """
+        pids = {}
+        if not self._exited and self._process.is_alive():
+            pids[self._name] = self._process.pid
+        if self._run_pid is not None:
+            pids['%s run' % self._name] = self._run_pid
+        return pids
+
+    def kill_run(self):
+        """Kills the forked child running a snapshot wrapper's run"""
+        if self._run_pid is None:
+            return
+        try:
+            os.kill(self._run_pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    def reset(self):
+        self._ready = False
+        self._send_message('reset')
+
+    def stop(self):
+        """Asks a persistent process to tear down and exit"""
+        self._send_message('stop')
 
     def join(self, timeout):
         process = self._process
@@ -152,17 +714,36 @@ class ProcessMonitor(object):
             # Check for any exceptions if the process is no longer alive
             self.check_for_exceptions()
 
-    def check_for_exceptions(self):
+    def read_pending(self):
+        """Reads anything the process sent before it stopped"""
         try:
-            exception_info = self._exception_queue.get(block=False)
-        except Queue.Empty:
-            # Check for any non-zero exit codes
-            exit_code = self.exitcode
-            if exit_code != 0:
+            while not self._exited and self._connection.poll(0):
+                self.update_status()
+        except IOError:
+            # A killed process can leave the pipe in an error state
+            self._exited = True
+
+    def check_for_exceptions(self):
+        self.read_pending()
+        exception_info = self._exception_info
+        if exception_info is not None:
+            self._record_failure(exception_info)
+            exception_info.reraise()
+        # Check for any non-zero exit codes
+        exit_code = self.exitcode
+        if exit_code is not None and exit_code != 0:
+            try:
                 raise ProcessError('Process "%s" exited with error '
                         'code "%d"' % (self.name, self.exitcode))
-        else:
-            exception_info.reraise()
+            except ProcessError:
+                self._record_failure(PicklableExceptionInfo.exc_info())
+                raise
+
+    def _record_failure(self, exception_info):
+        """Records the process's failure, once however often it is checked"""
+        if not self._exception_recorded:
+            self._exception_recorded = True
+            record_failure(exception_info, self._name)
 
     def is_alive(self):
         return self._process.is_alive()
@@ -172,28 +753,129 @@ class ProcessMonitor(object):
         return self._process.exitcode
 
     def terminate(self):
-        while self._process.is_alive():
-            self._process.terminate()
+        terminate_process(self._process)
 
 
 class ProcessManagerError(Exception):
     pass
 
 
+def expand_replicas(wrappers):
+    """Expands ``(wrapper_cls, count)`` entries into one
+    ``(wrapper_cls, replica_index, replica_count)`` tuple per process. Plain
+    wrapper classes have a replica_count of None
+    """
+    expanded = []
+    for wrapper in wrappers:
+        if isinstance(wrapper, tuple):
+            wrapper_cls, count = wrapper
+            for index in xrange(count):
+                expanded.append((wrapper_cls, index, count))
+        else:
+            expanded.append((wrapper, 0, None))
+    return expanded
+
+
+def check_replicated_names(wrappers):
+    """Replicated wrappers list their shared options under their class name,
+    so no two entries may replicate classes of the same name
+    """
+    names = set()
+    for wrapper in wrappers:
+        if not isinstance(wrapper, tuple):
+            continue
+        name = wrapper[0].__name__
+        if name in names:
+            raise ProcessManagerError('"%s" is replicated by more than one '
+                    'entry' % name)
+        names.add(name)
+
+
+def count_processes(wrappers):
+    """Number of processes a multiprocess test with these wrappers uses,
+    including the test's own process
+    """
+    return len(expand_replicas(wrappers)) + 1
+
+
 class ProcessManager(object):
+    """Runs a test's wrappers, each in its own process.
+
+    A wrapper can be given as ``(wrapper_cls, count)`` to run ``count``
+    replicas of it. Each replica has ``replica_index`` and ``replica_count``
+    attributes. Shared options from replicas are not merged. They are listed
+    by replica index under the wrapper class's name instead, so a class can
+    only be replicated by one entry. All processes
+    wait on one barrier once they are told to run, so they start together.
+
+    Every process reports wall time, CPU time, peak RSS and context switches
+    for each phase of its lifecycle. ``report`` collects them and, when
+    ``telemetry_file`` is given, the final report is appended to it as JSON.
+
+    While running, wrappers can talk to each other over a message bus that
+    the manager brokers. See ``ProcessWrapper.publish`` and
+    ``ProcessWrapper.wait_for_message``, or ``bus_publish`` and ``bus_wait``
+    from a test's body. Each topic keeps the last ``bus_queue_size``
+    messages of the run. A wrapper that falls further behind gets
+    ``MessageBusOverflow``.
+
+    Wrappers declare shared counters with ``metric_sizes``. Every process
+    gets ``metrics`` backed by one shared array, cleared at the start of
+    each run. The test body can use
+    ``current_metrics()`` and the parent ``ProcessManager.metrics``.
+
+    Processes are always forked. ``start_method`` only accepts ``'fork'``
+    as that's all this Python's ``multiprocessing`` supports. Modules named
+    in ``preload`` are imported before forking so that every process
+    inherits them instead of importing them itself.
+
+    Setting ``profiler`` to ``'cprofile'`` or ``'sampling'`` profiles each
+    wrapper's ``run``. Wrappers still running when the test ends send their
+    profile before they are terminated. ``profile`` merges the profiles of
+    every process. With ``profile_dir`` the merged profile is also written
+    to a file named after the manager once the processes are stopped. See
+    ``testkit.profiling``.
+    """
+    persistent = False
+    # Messages kept per topic of the message bus
+    bus_queue_size = 1024
+
     @classmethod
     def from_wrappers(cls, wrappers, initial_options, timeout=5,
-            wait_timeout=0.1, runtime_timeout=0):
+            wait_timeout=0.1, runtime_timeout=0, process_group=False,
+            name=None, telemetry_file=None, start_method=None, preload=None,
+            profiler=None, profile_dir=None):
         return cls(wrappers, initial_options, timeout, wait_timeout,
-                runtime_timeout)
+                runtime_timeout, process_group, name, telemetry_file,
+                start_method, preload, profiler, profile_dir)
 
     def __init__(self, wrappers, initial_options, timeout, wait_timeout,
-            runtime_timeout):
+            runtime_timeout, process_group=False, name=None,
+            telemetry_file=None, start_method=None, preload=None,
+            profiler=None, profile_dir=None):
+        check_start_method(start_method)
+        check_profiler(profiler)
+        self._profiler = profiler
+        self._profile_dir = profile_dir
+        self._profile = None
+        self._preload = preload
+        self._name = name
+        self._telemetry_file = telemetry_file
+        self._report = None
         self._wrappers = wrappers
         self._initial_options = initial_options
         self._timeout = timeout
         self._wait_timeout = wait_timeout
         self._runtime_timeout = runtime_timeout
+        self._process_group = process_group
+        check_replicated_names(wrappers)
+        self._replicas = expand_replicas(wrappers)
+        self._shared_data = []
+        # Load reports aren't limited by bus_queue_size
+        self._bus = MessageBus(self.bus_queue_size,
+                collected_topics=(LOAD_RESULTS_TOPIC,))
+        self._metrics = None
+        self._start_barrier = None
         self._monitors = None
 
     @property
@@ -201,33 +883,106 @@ class ProcessManager(object):
         monitors = self._monitors
         if monitors is None:
             monitors = []
+            if not self.persistent:
+                self._start_barrier = multiprocessing.Event()
+            preload_modules(self._preload)
+            # Allocated before forking so every process shares it
+            try:
+                sizes = merge_metric_sizes(
+                        [replica[0] for replica in self._replicas])
+            except ValueError, e:
+                raise ProcessManagerError(str(e))
+            self._metrics = SharedMetrics(sizes, len(self._replicas))
             # Instantiate all the wrapper classes
-            for wrapper_cls in self._wrappers:
+            for stripe, replica in enumerate(self._replicas):
+                wrapper_cls, index, count = replica
                 monitor = ProcessMonitor.new_process(wrapper_cls,
-                    self._initial_options, timeout=self._timeout)
+                    self._initial_options, timeout=self._timeout,
+                    process_group=self._process_group,
+                    persistent=self.persistent,
+                    start_barrier=self._start_barrier,
+                    replica_index=index, replica_count=count or 1,
+                    bus=self._bus,
+                    metrics=self._metrics.for_stripe(stripe),
+                    profiler=self._profiler)
                 monitors.append(monitor)
             self._monitors = monitors
         return monitors
 
+    @property
+    def metrics(self):
+        """The test's SharedMetrics. Reads are live while processes run"""
+        self.monitors
+        return self._metrics
+
+    @property
+    def load_report(self):
+        """The merged LoadReport of the last run's LoadGenerators or None if
+        there were none
+        """
+        reports = self._bus.collected(LOAD_RESULTS_TOPIC)
+        if not reports:
+            return None
+        return type(reports[0]).merge(reports)
+
+    @property
+    def report(self):
+        """A TelemetryReport of every phase each process has finished. Once
+        the processes are stopped this is the final report
+        """
+        if self._report is not None:
+            return self._report
+        monitors = self._monitors
+        if not isinstance(monitors, list):
+            monitors = []
+        return TelemetryReport.from_monitors(self._name, monitors)
+
+    @property
+    def profile(self):
+        """The merged profile of every process. A pstats.Stats with
+        ``'cprofile'`` and ``{collapsed stack: samples}`` with
+        ``'sampling'``. None if the test isn't profiled
+        """
+        if self._profile is not None:
+            return self._profile.merged
+        if self._profiler is None:
+            return None
+        monitors = self._monitors
+        if not isinstance(monitors, list):
+            monitors = []
+        return self._collect_profiles(monitors).merged
+
+    def _collect_profiles(self, monitors):
+        collector = ProfileCollector(self._profiler)
+        for monitor in monitors:
+            for profile in monitor.profiles:
+                collector.add(profile)
+        return collector
+
     def run(self):
         try:
-            # Combine processes options into shared options
-            shared_options = self._get_shared_options()
-            self._check_processes_ok()
-            # Send shared options to all processes
-            self._send_shared_options(shared_options)
-            self._check_processes_ok()
-            # Wait till all processes are ready
-            self._wait_till_ready()
-            self._check_processes_ok()
+            self.start()
             # Start all processes
             self._start_processes()
-            self._check_processes_ok()
             # Wait for all processes
             self._wait()
         finally:
             self._stop_processes()
 
+    def start(self):
+        """Starts every process and waits until they are all set up"""
+        # Combine processes options into shared options
+        shared_options = self._get_shared_options()
+        self._check_processes_ok()
+        # Send shared options to all processes
+        self._send_shared_options(shared_options)
+        self._check_processes_ok()
+        # Wait till all processes are ready
+        self._wait_till_ready()
+        self._check_processes_ok()
+        # Every process has mapped the shared segments by now
+        self._unlink_shared_data()
+
     def _check_processes_ok(self):
         monitors = self.monitors
         for monitor in monitors:
@@ -240,51 +995,123 @@ class ProcessManager(object):
     def _get_shared_options(self):
         monitors = self.monitors
         shared_options = {}
-        for monitor in monitors:
+        for monitor, replica in zip(monitors, self._replicas):
             options = monitor.get_process_options()
-            shared_options.update(options)
+            # Track segments right away so they're removed even if start fails
+            self._shared_data.extend(iter_shared_data(options))
+            wrapper_cls, index, count = replica
+            if count is None:
+                shared_options.update(options)
+            else:
+                replica_options = shared_options.setdefault(
+                        wrapper_cls.__name__, [None] * count)
+                replica_options[index] = options
         return shared_options
 
     def _send_shared_options(self, shared_options):
+        # Pickle once no matter how many processes there are
+        message = pickle_message('shared_options', shared_options)
         monitors = self.monitors
         for monitor in monitors:
-            monitor.send_shared_options(shared_options)
+            monitor.send_pickled_message(message)
 
-    def _wait_till_ready(self):
-        monitors = self.monitors
-        not_ready = True
+    def _unlink_shared_data(self):
+        for shared_data in self._shared_data:
+            shared_data.unlink()
+        self._shared_data = []
 
-        while not_ready:
-            not_ready = False
-            for monitor in monitors:
+    def _wait_till_ready(self):
+        waiting = self.monitors[:]
+        while waiting:
+            # Any process reporting in or exiting wakes this up. The timeout
+            # only bounds how long a silent exit can go unnoticed
+            readable = wait_for_any(waiting, self._wait_timeout)
+            for monitor in readable:
+                monitor.update_status()
+            self._check_heartbeats(waiting)
+            # Checking every process is linear so only do it when something
+            # exited or nothing happened
+            exited = [monitor for monitor in readable if monitor.has_exited]
+            if exited or not readable:
                 self._check_processes_ok()
-                if not monitor.is_process_ready():
-                    not_ready = True
+            waiting = [monitor for monitor in waiting
+                    if not monitor.is_process_ready()]
 
-    def _start_processes(self):
+    def _check_heartbeats(self, monitors):
+        """Only pass monitors that are being read. Heartbeats of the others
+        are waiting in their pipes
+        """
+        try:
+            for monitor in monitors:
+                monitor.check_heartbeat()
+        except ProcessStalled, e:
+            raise attach_stacks(e, self._collect_stacks())
+
+    def _collect_stacks(self):
+        """Stacks of every live process, taken before they are killed"""
+        pids = {}
+        for monitor in self.monitors:
+            pids.update(monitor.stack_pids())
+        return collect_stacks(pids)
+
+    def _start_processes(self, run_options=None):
         monitors = self.monitors
+        # Every wrapper is idle so both start anew for this run
+        self._bus.reset()
+        self._metrics.clear()
+        load_generators = len([replica for replica in self._replicas
+                if replica[0].generates_load])
+        if load_generators:
+            self._bus.publish(LOAD_GENERATORS_TOPIC, load_generators)
         for monitor in monitors:
-            monitor.run()
+            monitor.run(run_options)
+        if self._start_barrier is not None:
+            self._start_barrier.set()
 
-    def _wait(self):
+    def _wait(self, runtime_timeout=None):
         monitors = self.monitors
-        runtime_timeout_ms = self._runtime_timeout * 1000
-        start_time = time.time() * 1000
+        if runtime_timeout is None:
+            runtime_timeout = self._runtime_timeout
+        deadline = None
+        if runtime_timeout:
+            deadline = time.time() + runtime_timeout
         while True:
-            if runtime_timeout_ms:
-                current_time = time.time() * 1000
-                time_diff = current_time - start_time
-                if time_diff >= runtime_timeout_ms:
-                    raise TimeoutError('Runtime for processes timed out')
+            wait_timeout = self._wait_timeout
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise attach_stacks(TimeoutError(
+                        'Runtime for processes timed out'),
+                        self._collect_stacks())
+                wait_timeout = min(wait_timeout, remaining)
+            for monitor in wait_for_any(monitors, wait_timeout):
+                monitor.update_status()
+            self._check_heartbeats(monitors)
             for monitor in monitors:
-                monitor.join(self._wait_timeout)
-                if not monitor.is_alive():
+                if monitor.is_done:
+                    return
+                if monitor.has_exited or not monitor.is_alive():
+                    monitor.join(self._timeout)
                     return
 
     def _stop_processes(self):
         monitors = self.monitors
         for monitor in monitors:
-            monitor.terminate()
+            monitor.kill_run()
+        # Terminate everything at once so shutdown takes at most one grace
+        # period no matter how many processes there are
+        terminate_processes([monitor.process for monitor in monitors])
+        self._unlink_shared_data()
+        for monitor in monitors:
+            monitor.read_pending()
+        self._report = TelemetryReport.from_monitors(self._name, monitors)
+        if self._telemetry_file is not None:
+            self._report.export_json(self._telemetry_file)
+        if self._profiler is not None:
+            self._profile = self._collect_profiles(monitors)
+            if self._profile_dir is not None:
+                self._profile.dump(self._profile_dir,
+                        self._name or 'processes')
         del self._monitors
 
         # Make it so monitors will return nothing
@@ -295,6 +1122,84 @@ class ProcessManager(object):
         gc.collect()
 
 
+class ProcessFleet(ProcessManager):
+    """A ProcessManager whose processes are reused for many runs.
+
+    Every wrapper is set up once. Each call to ``run_test`` then runs every
+    wrapper with ``run_options`` until one of them finishes. Wrappers that
+    are still running are interrupted with ``RunInterrupted`` and every
+    wrapper is ``reset`` before the next run. Any failure stops the fleet.
+    """
+    persistent = True
+
+    def __init__(self, *args, **kwargs):
+        super(ProcessFleet, self).__init__(*args, **kwargs)
+        self._started = False
+        self._stopped = False
+
+    def run_test(self, run_options=None, runtime_timeout=None):
+        if self._stopped:
+            raise ProcessManagerError('The fleet has been stopped')
+        try:
+            if not self._started:
+                self.start()
+                self._started = True
+            self._start_processes(run_options)
+            self._wait(runtime_timeout)
+            self._interrupt_processes()
+            for monitor in self.monitors:
+                monitor.check_for_exceptions()
+            self._reset_processes()
+        except:
+            self._stopped = True
+            self._stop_processes()
+            raise
+
+    def _interrupt_processes(self):
+        running = [monitor for monitor in self.monitors
+                if not monitor.is_done]
+        for monitor in running:
+            monitor.interrupt()
+        deadline = time.time() + self._timeout
+        while running:
+            self._check_processes_ok()
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                try:
+                    raise ProcessTimedOut('Timed out interrupting process '
+                            '"%s"' % running[0].name)
+                except ProcessTimedOut:
+                    exception_info = PicklableExceptionInfo.exc_info()
+                    exception_info.set_location(running[0].name)
+                    record_failure(exception_info, running[0].name)
+                    raise
+            for monitor in wait_for_any(running,
+                    min(self._wait_timeout, remaining)):
+                monitor.update_status()
+            self._check_heartbeats(running)
+            running = [monitor for monitor in running
+                    if not monitor.is_done]
+
+    def _reset_processes(self):
+        for monitor in self.monitors:
+            monitor.reset()
+        self._wait_till_ready()
+
+    def stop(self):
+        """Tears down every wrapper and stops the processes"""
+        if self._stopped:
+            return
+        self._stopped = True
+        monitors = self.monitors
+        if self._started:
+            for monitor in monitors:
+                monitor.stop()
+            deadline = time.time() + self._timeout
+            for monitor in monitors:
+                monitor.process.join(max(deadline - time.time(), 0))
+        self._stop_processes()
+
+
 def create_main_process_wrapper(f, args, kwargs):
     new_args = list(args)
 
@@ -325,8 +1230,22 @@ def create_process_wrapper(f, args, kwargs, shared_options=None,
 
 
 class MultiprocessDecorator(object):
-    def __init__(self, wrappers, initial_options=None, limit=30):
+    def __init__(self, wrappers, initial_options=None, limit=30,
+            process_group=False, telemetry_file=None, start_method=None,
+            preload=None, heartbeat_interval=None, progress_timeout=None,
+            profiler=None, profile_dir=None):
+        check_start_method(start_method)
+        check_profiler(profiler)
+        check_profile_dir(profiler, profile_dir)
+        self._profiler = profiler
+        self._profile_dir = profile_dir
+        self._heartbeat_interval = heartbeat_interval
+        self._progress_timeout = progress_timeout
+        self._start_method = start_method
+        self._preload = preload
         self._limit = limit
+        self._process_group = process_group
+        self._telemetry_file = telemetry_file
         self._wrappers = wrappers
         self.initial_options = initial_options or (lambda: {})
 
@@ -337,12 +1256,20 @@ class MultiprocessDecorator(object):
             new_args = list(args)
             new_args.append(initial_options)
             main_wrapper = create_main_process_wrapper(f, new_args, kwargs)
+            main_wrapper.heartbeat_interval = self._heartbeat_interval
+            main_wrapper.progress_timeout = self._progress_timeout
             wrappers_copy = self._wrappers[:]
             wrappers_copy.append(main_wrapper)
 
             manager = ProcessManager.from_wrappers(wrappers_copy,
-                    initial_options, runtime_timeout=self._limit)
+                    initial_options, runtime_timeout=self._limit,
+                    process_group=self._process_group, name=f.__name__,
+                    telemetry_file=self._telemetry_file,
+                    start_method=self._start_method, preload=self._preload,
+                    profiler=self._profiler, profile_dir=self._profile_dir)
             manager.run()
+        # Used by MultiprocessScheduler to budget processes
+        run_multiprocess_test.process_count = count_processes(self._wrappers)
         return run_multiprocess_test
 
 multiprocess = MultiprocessDecorator
@@ -359,6 +1286,7 @@ def _proxy_method(self):
 class MultiprocessTestMeta(type):
     def __init__(cls, name, bases, dct):
         super(MultiprocessTestMeta, cls).__init__(name, bases, dct)
+        check_profile_dir(cls.profiler, cls.profile_dir)
         new_bases = []
         for base in bases:
             # Skip all of the subclasses where this is the metaclass
@@ -374,7 +1302,8 @@ class MultiprocessTestMeta(type):
             new_dct[attr_name] = attr_value
         setattr(cls, '_ProxiedTestClass', type('%sProxiedTests' % name,
                 new_bases, new_dct))
-        setattr(cls, '_ignore_names', ['setup', 'teardown'])
+        setattr(cls, '_ignore_names', ['setup', 'teardown', 'reset',
+            'teardown_class'])
 
 
 def localattr(self, name):
@@ -406,9 +1335,58 @@ def create_multiprocess_wrapper(proxied_test, name, args, kwargs):
     return MultiprocessWrapper
 
 
+def create_fleet_wrapper(proxied_test, snapshot=False):
+    """Creates a persistent wrapper that runs whichever test method is named
+    in its run options
+    """
+    base_wrapper = create_multiprocess_wrapper(proxied_test, None, (), {})
+    snapshot_m = snapshot
+
+    class MultiprocessFleetWrapper(base_wrapper):
+        snapshot = snapshot_m
+
+        def reset(self):
+            self._proxied_test.reset()
+
+        def run(self):
+            name, args, kwargs = self.run_options
+            method = getattr(self._proxied_test, name)
+            method(*args, **kwargs)
+    return MultiprocessFleetWrapper
+
+
+# Running fleets keyed by MultiprocessTest class
+_fleets = {}
+
+
+def stop_fleet(test_cls):
+    fleet = _fleets.pop(test_cls, None)
+    if fleet is not None:
+        fleet.stop()
+
+
+def stop_all_fleets():
+    for test_cls in _fleets.keys():
+        stop_fleet(test_cls)
+
+atexit.register(stop_all_fleets)
+
+
 class MultiprocessTest(object):
     """Provides a simple definition for multiprocess tests.
 
+    Setting ``fleet = True`` starts the wrappers once for the whole class. The
+    test's ``setup`` and every wrapper's ``setup`` run once, each test method
+    then runs in the same processes and ``reset`` is called between tests.
+    Wrappers still in ``run`` when a test finishes are interrupted with
+    ``RunInterrupted``. Everything is torn down in ``teardown_class`` or as
+    soon as a test fails.
+
+    Setting ``snapshot = True`` also runs the test class as a fleet, but each
+    test method runs in a child forked from the fully set up test process.
+    Every test then starts from the state ``setup`` left behind and
+    ``reset`` isn't needed for the test itself.
+
     .. warning::
         This class's metaclass does not copy any attributes that begin with
         ``_`` so these attributes are not correctly passed on to the proxied
@@ -418,6 +1396,19 @@ class MultiprocessTest(object):
 
     wrappers = []
     timeout = 2.0
+    process_group = False
+    fleet = False
+    snapshot = False
+    telemetry_file = None
+    start_method = None
+    preload = ()
+    # Heartbeats of the process running the test itself. See ProcessWrapper
+    heartbeat_interval = None
+    progress_timeout = None
+    # See ProcessManager. Needs profile_dir. Fleets write one profile for
+    # the whole class
+    profiler = None
+    profile_dir = None
 
     def __init__(self):
         proxied_test_cls = self._ProxiedTestClass
@@ -436,29 +1427,73 @@ class MultiprocessTest(object):
 
             @wraps(proxied_value)
             def wrapped_func(self, *args, **kwargs):
+                if self.fleet or self.snapshot:
+                    self._run_in_fleet(name, args, kwargs, test_timeout)
+                    return
                 main_wrapper = create_multiprocess_wrapper(
                         proxied_test, name, args, kwargs)
+                main_wrapper.heartbeat_interval = self.heartbeat_interval
+                main_wrapper.progress_timeout = self.progress_timeout
                 wrappers = self.wrappers[:]
                 wrappers.append(main_wrapper)
 
                 initial_options = proxied_test.initial_options()
 
                 manager = ProcessManager.from_wrappers(wrappers,
-                    initial_options, runtime_timeout=test_timeout)
+                    initial_options, runtime_timeout=test_timeout,
+                    process_group=self.process_group,
+                    name='%s.%s' % (type(self).__name__, name),
+                    telemetry_file=self.telemetry_file,
+                    start_method=self.start_method, preload=self.preload,
+                    profiler=self.profiler, profile_dir=self.profile_dir)
                 manager.run()
             runtime_decorators = getattr(proxied_value, '_runtime_decorators',
                     [])
             for decorator in runtime_decorators:
                 wrapped_func = decorator(wrapped_func)
-            return partial(wrapped_func, self)
+            test_method = partial(wrapped_func, self)
+            test_method.process_count = count_processes(self.wrappers)
+            return test_method
         return proxied_value
 
+    def _run_in_fleet(self, name, args, kwargs, test_timeout):
+        test_cls = type(self)
+        fleet = _fleets.get(test_cls)
+        if fleet is None:
+            proxied_test = self._ProxiedTestClass()
+            wrappers = self.wrappers[:]
+            fleet_wrapper = create_fleet_wrapper(proxied_test, self.snapshot)
+            fleet_wrapper.heartbeat_interval = self.heartbeat_interval
+            fleet_wrapper.progress_timeout = self.progress_timeout
+            wrappers.append(fleet_wrapper)
+            fleet = ProcessFleet.from_wrappers(wrappers,
+                    proxied_test.initial_options(),
+                    process_group=self.process_group, name=test_cls.__name__,
+                    telemetry_file=self.telemetry_file,
+                    start_method=self.start_method, preload=self.preload,
+                    profiler=self.profiler, profile_dir=self.profile_dir)
+            _fleets[test_cls] = fleet
+        try:
+            fleet.run_test((name, args, kwargs), test_timeout)
+        except:
+            # The fleet stops itself on failures. Start anew next test
+            _fleets.pop(test_cls, None)
+            raise
+
+    @classmethod
+    def teardown_class(cls):
+        stop_fleet(cls)
+
     def shared_options(self):
         return {}
 
     def setup(self, shared_options):
         pass
 
+    def reset(self):
+        """Called between tests when running as a fleet"""
+        pass
+
     def teardown(self):
         pass
 
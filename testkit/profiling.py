@@ -0,0 +1,181 @@
+"""
+testkit.profiling
+~~~~~~~~~~~~~~~~~
+
+Profiles of code that runs in child processes. A wrapper's ``run``, or a
+function run by ``timeout``, is profiled in its own process. The results go
+back to the parent, which merges every process's profile into one file per
+test.
+
+There are two profilers. ``'cprofile'`` records every call with cProfile and
+merges into a pstats file for ``python -m pstats`` or snakeviz.
+``'sampling'`` takes the stack of the profiled thread every
+``SAMPLE_INTERVAL`` seconds from a background thread. It costs much less
+than cProfile in call heavy code. Its samples merge into a collapsed stacks
+file for flamegraph.pl or speedscope.
+"""
+import os
+import sys
+import time
+import pstats
+import tempfile
+import cProfile
+import threading
+
+PROFILERS = ('cprofile', 'sampling')
+PROFILE_EXTENSIONS = {'cprofile': '.pstats', 'sampling': '.collapsed'}
+# Seconds between the samples of the sampling profiler
+SAMPLE_INTERVAL = 0.005
+
+
+def check_profiler(profiler):
+    if profiler is not None and profiler not in PROFILERS:
+        raise ValueError('Unknown profiler "%s"' % profiler)
+
+
+def check_profile_dir(profiler, profile_dir):
+    """Profiles of decorated tests are only kept in files"""
+    if profiler is not None and profile_dir is None:
+        raise ValueError('Profiling needs a profile_dir')
+
+
+class CallProfiler(object):
+    """Profiles with cProfile. ``profile`` is the raw pstats dictionary"""
+    def __init__(self):
+        self.profile = None
+
+    def call(self, f, *args, **kwargs):
+        """Calls f under the profiler. ``profile`` is set afterwards even if
+        f raises
+        """
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(f, *args, **kwargs)
+        finally:
+            profiler.create_stats()
+            self.profile = profiler.stats
+
+
+def _call_sampled(f, args, kwargs):
+    # Samples are cut at this frame
+    return f(*args, **kwargs)
+
+
+def _frame_name(code):
+    return '%s (%s:%d)' % (code.co_name, code.co_filename,
+            code.co_firstlineno)
+
+
+class SamplingProfiler(object):
+    """Samples the calling thread's stack. ``profile`` maps collapsed stacks,
+    outermost frame first, to how often they were seen
+    """
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self._interval = interval
+        self.profile = None
+
+    def call(self, f, *args, **kwargs):
+        samples = {}
+        stopped = threading.Event()
+        sampler = threading.Thread(target=self._sample, args=(
+            threading.current_thread().ident, samples, stopped))
+        sampler.daemon = True
+        sampler.start()
+        try:
+            return _call_sampled(f, args, kwargs)
+        finally:
+            stopped.set()
+            sampler.join()
+            self.profile = samples
+
+    def _sample(self, thread_id, samples, stopped):
+        root = _call_sampled.func_code
+        while not stopped.is_set():
+            time.sleep(self._interval)
+            frame = sys._current_frames().get(thread_id)
+            names = []
+            # Only frames below the call are of interest
+            while frame is not None and frame.f_code is not root:
+                names.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            if frame is None or not names:
+                continue
+            stack = ';'.join(reversed(names))
+            samples[stack] = samples.get(stack, 0) + 1
+
+
+def new_profiler(profiler):
+    """A profiler of the given kind or None if profiling is off"""
+    check_profiler(profiler)
+    if profiler == 'cprofile':
+        return CallProfiler()
+    if profiler == 'sampling':
+        return SamplingProfiler()
+    return None
+
+
+class _StatsHolder(object):
+    """Looks enough like a profiler for pstats.Stats to load its stats"""
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class ProfileCollector(object):
+    """Merges the profiles that processes sent to the parent"""
+    def __init__(self, profiler):
+        check_profiler(profiler)
+        self.profiler = profiler
+        self._stats = None
+        self._samples = {}
+
+    def add(self, profile):
+        if not profile:
+            return
+        if self.profiler == 'sampling':
+            for stack, count in profile.iteritems():
+                self._samples[stack] = self._samples.get(stack, 0) + count
+            return
+        holder = _StatsHolder(profile)
+        if self._stats is None:
+            self._stats = pstats.Stats(holder)
+        else:
+            self._stats.add(holder)
+
+    @property
+    def merged(self):
+        """A pstats.Stats for cprofile, ``{stack: count}`` for sampling or
+        None if nothing was profiled
+        """
+        if self.profiler == 'sampling':
+            return self._samples or None
+        return self._stats
+
+    def dump(self, directory, name, unique=False):
+        """Writes the merged profile to ``directory/name`` with the
+        profiler's extension. With ``unique`` a random suffix is added to
+        name so that earlier files are kept. Returns the path or None if
+        there was nothing to write
+        """
+        merged = self.merged
+        if merged is None:
+            return None
+        extension = PROFILE_EXTENSIONS[self.profiler]
+        if unique:
+            fd, path = tempfile.mkstemp(suffix=extension, prefix=name + '-',
+                    dir=directory)
+            os.close(fd)
+        else:
+            path = os.path.join(directory, name + extension)
+        if self.profiler == 'cprofile':
+            merged.dump_stats(path)
+            return path
+        profile_file = open(path, 'w')
+        try:
+            for stack in sorted(merged):
+                profile_file.write('%s %d\n' % (stack, merged[stack]))
+        finally:
+            profile_file.close()
+        return path
@@ -0,0 +1,208 @@
+"""
+testkit.scheduler
+~~~~~~~~~~~~~~~~~
+
+Run independent multiprocess tests at the same time. Each test runs in its
+own runner process, which starts the test's ProcessManager as usual, and
+reports its outcome back to the scheduler. Runners lead their own process
+group so stopping one also stops the wrappers it started.
+"""
+import time
+import multiprocessing
+from collections import deque
+from .exceptionutils import PicklableExceptionInfo
+from .failures import record_failure
+from .timeouts import (monitoring_wrapper, terminate_process, TimeoutError,
+        ProcessGroupLeader)
+from .processes import wait_for_any, stop_all_fleets, ProcessError
+from .stacks import prepare_stack_dumps
+
+
+def run_scheduled(f, *args, **kwargs):
+    try:
+        return f(*args, **kwargs)
+    finally:
+        # Fleets started in the runner would otherwise keep it from exiting
+        stop_all_fleets()
+
+
+class ScheduledTest(object):
+    def __init__(self, name, f, args, kwargs, process_count):
+        self.name = name
+        self.f = f
+        self.args = args
+        self.kwargs = kwargs
+        self.process_count = process_count
+
+
+class ScheduledOutcome(object):
+    """The result of a scheduled test"""
+    def __init__(self, name, exception_info, duration):
+        self.name = name
+        self.exception_info = exception_info
+        self.duration = duration
+
+    @property
+    def passed(self):
+        return self.exception_info is None
+
+    def check(self):
+        """Raises the test's exception, if any"""
+        if self.exception_info is not None:
+            self.exception_info.reraise()
+
+    def __repr__(self):
+        return '<ScheduledOutcome %s passed=%s>' % (self.name, self.passed)
+
+
+class MultiprocessScheduler(object):
+    """Runs several multiprocess tests at once.
+
+    At most ``max_tests`` tests (the CPU count by default) run together, and
+    the processes they use may not exceed ``process_budget``. A test that
+    needs more than the budget runs on its own. Tests made with
+    ``multiprocess`` or ``MultiprocessTest`` know how many processes they
+    use. Other callables count as one.
+
+    Outcomes can be reported per test through a nose test generator::
+
+        def test_everything():
+            scheduler = MultiprocessScheduler()
+            scheduler.add_test_class(TestServer)
+            scheduler.add('test_client', test_client)
+            for outcome in scheduler.run():
+                yield outcome.check
+    """
+    def __init__(self, max_tests=None, process_budget=None, limit=None,
+            wait_timeout=0.1):
+        self._max_tests = max_tests or multiprocessing.cpu_count()
+        self._process_budget = process_budget
+        self._limit = limit
+        self._wait_timeout = wait_timeout
+        self._tests = []
+
+    def add(self, name, f, args=None, kwargs=None, process_count=None):
+        if process_count is None:
+            process_count = getattr(f, 'process_count', 1)
+        self._tests.append(ScheduledTest(name, f, args or (), kwargs or {},
+            process_count))
+
+    def add_test_class(self, test_cls):
+        """Adds every test method of a MultiprocessTest. Classes that run
+        as a fleet are added as a single test since their methods share
+        processes
+        """
+        test = test_cls()
+        names = [name for name in dir(test_cls) if name.startswith('test')]
+        if test_cls.fleet or test_cls.snapshot:
+            methods = [getattr(test, name) for name in names]
+            process_count = max([method.process_count
+                for method in methods] or [1])
+            self.add(test_cls.__name__, self._run_all, (test_cls, methods),
+                    process_count=process_count)
+            return
+        for name in names:
+            self.add('%s.%s' % (test_cls.__name__, name),
+                    getattr(test, name))
+
+    def _run_all(self, test_cls, methods):
+        try:
+            for method in methods:
+                method()
+        finally:
+            test_cls.teardown_class()
+
+    def _can_start(self, test, running):
+        if len(running) >= self._max_tests:
+            return False
+        if not running or self._process_budget is None:
+            return True
+        used = sum([scheduled.process_count
+            for scheduled, process, start in running.values()])
+        return used + test.process_count <= self._process_budget
+
+    def _start(self, test):
+        # Runners leave with os._exit so the directory is made here
+        prepare_stack_dumps()
+        reader, writer = multiprocessing.Pipe(duplex=False)
+        process = ProcessGroupLeader(target=monitoring_wrapper,
+                args=(writer, run_scheduled, (test.f,) + test.args,
+                    test.kwargs))
+        process.start()
+        writer.close()
+        return reader, process
+
+    def _finish(self, test, reader, process, start):
+        try:
+            exception_info, result, profile = reader.recv()
+        except EOFError:
+            exception_info = None
+        reader.close()
+        remaining = None
+        if self._limit:
+            remaining = max(start + self._limit - time.time(), 0)
+        # Children the test left behind can keep the runner from exiting
+        process.join(remaining)
+        overran = process.is_alive()
+        # Anything the runner left behind in its group goes with it
+        terminate_process(process)
+        if exception_info is None and overran:
+            exception_info = timed_out_exception_info(test.name)
+        elif exception_info is None and process.exitcode:
+            # The runner died without reporting
+            exception_info = exited_exception_info(test.name,
+                    process.exitcode)
+        return exception_info
+
+    def run(self):
+        """Runs every added test and returns their outcomes in the order the
+        tests were added
+        """
+        pending = deque(self._tests)
+        running = {}
+        outcomes = {}
+        while pending or running:
+            while pending and self._can_start(pending[0], running):
+                test = pending.popleft()
+                reader, process = self._start(test)
+                running[reader] = (test, process, time.time())
+            for reader in wait_for_any(running.keys(), self._wait_timeout):
+                test, process, start = running.pop(reader)
+                exception_info = self._finish(test, reader, process, start)
+                if exception_info is not None:
+                    record_failure(exception_info, test.name)
+                outcomes[test] = ScheduledOutcome(test.name, exception_info,
+                        time.time() - start)
+            if self._limit:
+                self._stop_overdue(running, outcomes)
+        return [outcomes[test] for test in self._tests]
+
+    def _stop_overdue(self, running, outcomes):
+        now = time.time()
+        for reader, (test, process, start) in running.items():
+            if now - start < self._limit:
+                continue
+            del running[reader]
+            terminate_process(process)
+            reader.close()
+            exception_info = timed_out_exception_info(test.name)
+            record_failure(exception_info, test.name)
+            outcomes[test] = ScheduledOutcome(test.name, exception_info,
+                    now - start)
+
+
+def timed_out_exception_info(name):
+    try:
+        raise TimeoutError('Scheduled test "%s" timed out' % name)
+    except TimeoutError:
+        exception_info = PicklableExceptionInfo.exc_info()
+        exception_info.set_location(name)
+        return exception_info
+
+
+def exited_exception_info(name, exit_code):
+    try:
+        raise ProcessError('Runner of scheduled test "%s" exited with code %d'
+                % (name, exit_code))
+    except ProcessError:
+        return PicklableExceptionInfo.exc_info()
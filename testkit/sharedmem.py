@@ -0,0 +1,183 @@
+"""
+testkit.sharedmem
+~~~~~~~~~~~~~~~~~
+
+Pass large buffers between processes through shared memory. Segments are
+files on a memory backed filesystem (``/dev/shm`` when it exists) so any
+process can open them by name and only a small handle has to be pickled.
+"""
+import os
+import mmap
+import glob
+import array
+import tempfile
+
+
+def _shared_memory_dir():
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+SHARED_MEMORY_DIR = _shared_memory_dir()
+
+# Buffers at least this large are worth moving through shared memory
+LARGE_DATA_SIZE = 1024 * 1024
+
+BUFFER_TYPES = (str, bytearray, array.array)
+
+
+def buffer_size(value):
+    """Size in bytes of a str, bytearray or array"""
+    if isinstance(value, array.array):
+        return len(value) * value.itemsize
+    return len(value)
+
+
+def is_large_buffer(value, size=LARGE_DATA_SIZE):
+    """Checks if a value is a buffer that should go through shared memory"""
+    if not isinstance(value, BUFFER_TYPES):
+        return False
+    return buffer_size(value) >= size
+
+
+def _segment_prefix(pid):
+    # Segments are named after their creator so a killed creator's segments
+    # can be found
+    return 'testkit-%d-' % pid
+
+
+class SharedData(object):
+    """A picklable handle to a buffer stored in a shared memory segment.
+
+    The creator writes the buffer once. Other processes either ``load`` a
+    private copy or ``map`` the segment read-only without copying.
+    """
+    @classmethod
+    def from_value(cls, value):
+        fd, path = tempfile.mkstemp(prefix=_segment_prefix(os.getpid()),
+                dir=SHARED_MEMORY_DIR)
+        try:
+            size = buffer_size(value)
+            written = 0
+            while written < size:
+                written += os.write(fd, buffer(value, written))
+        except:
+            os.unlink(path)
+            raise
+        finally:
+            os.close(fd)
+        typecode = None
+        if isinstance(value, array.array):
+            typecode = value.typecode
+        return cls(path, size, type(value).__name__, typecode)
+
+    def __init__(self, path, size, kind, typecode=None):
+        self.path = path
+        self.size = size
+        self.kind = kind
+        self.typecode = typecode
+
+    def load(self):
+        """Returns a copy of the buffer as its original type"""
+        segment = open(self.path, 'rb')
+        try:
+            if self.kind == 'array':
+                value = array.array(self.typecode)
+                value.fromfile(segment, self.size // value.itemsize)
+            elif self.kind == 'bytearray':
+                value = bytearray(self.size)
+                segment.readinto(value)
+            else:
+                value = segment.read(self.size)
+        finally:
+            segment.close()
+        return value
+
+    def map(self):
+        """Maps the segment read-only. Empty segments map to an empty str"""
+        if not self.size:
+            return ''
+        segment = open(self.path, 'rb')
+        try:
+            return mmap.mmap(segment.fileno(), self.size,
+                    access=mmap.ACCESS_READ)
+        finally:
+            segment.close()
+
+    def unlink(self):
+        """Removes the segment. Existing maps stay valid"""
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def share_large_value(value, size=LARGE_DATA_SIZE):
+    """Moves large buffers into shared memory. Other values are returned
+    unchanged
+    """
+    if is_large_buffer(value, size):
+        return SharedData.from_value(value)
+    return value
+
+
+def unlink_segments(pid):
+    """Removes every segment created by a process. Used once the process was
+    killed, so segments it created but never handed over don't leak
+    """
+    pattern = os.path.join(SHARED_MEMORY_DIR, _segment_prefix(pid) + '*')
+    for path in glob.glob(pattern):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def load_shared_value(value):
+    """Reverses share_large_value and removes the segment"""
+    if isinstance(value, SharedData):
+        try:
+            return value.load()
+        finally:
+            value.unlink()
+    return value
+
+
+def shared_buffer(value):
+    """Marks a buffer returned from ``ProcessWrapper.shared_options`` to be
+    shared through memory. Every wrapper's ``setup`` receives a read-only map
+    of the segment instead of its own copy
+    """
+    return SharedData.from_value(value)
+
+
+def iter_shared_data(value):
+    """Yields every SharedData handle within nested dicts, lists and
+    tuples
+    """
+    if isinstance(value, SharedData):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.itervalues():
+            for handle in iter_shared_data(item):
+                yield handle
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            for handle in iter_shared_data(item):
+                yield handle
+
+
+def map_shared_values(value):
+    """Replaces SharedData handles within nested dicts, lists and tuples with
+    read-only maps of their segments
+    """
+    if isinstance(value, SharedData):
+        return value.map()
+    elif isinstance(value, dict):
+        return dict((key, map_shared_values(item))
+                for key, item in value.iteritems())
+    elif isinstance(value, list):
+        return [map_shared_values(item) for item in value]
+    elif isinstance(value, tuple):
+        return tuple(map_shared_values(item) for item in value)
+    return value
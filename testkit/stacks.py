@@ -0,0 +1,232 @@
+"""
+testkit.stacks
+~~~~~~~~~~~~~~
+
+Stacks of every thread of a child process, taken just before the child is
+killed for timing out.
+
+Each child runs a daemon thread that dumps the stacks of its other threads
+when the parent asks. A thread is used rather than a signal handler because
+Python only runs signal handlers in the main thread between bytecodes. A main
+thread that is blocked on a lock would never get to dump its stack. A child
+stuck in C code that holds the GIL can't dump either and shows up without
+stacks.
+
+Requests and dumps go through two named pipes per child in a private
+directory that the parent creates with ``prepare_stack_dumps`` before it
+starts children. The dumper thread sleeps in ``open`` on its request pipe
+until the parent opens it, so idle children do no work at all.
+"""
+import os
+import sys
+import time
+import stat
+import fcntl
+import errno
+import select
+import shutil
+import tempfile
+import threading
+import traceback
+import multiprocessing.util
+
+# How long the parent waits for dumps
+STACK_DUMP_TIMEOUT = 0.5
+
+# Created by prepare_stack_dumps and inherited by forked children
+_dump_dir = None
+_dump_dir_owner = None
+
+
+def prepare_stack_dumps():
+    """Creates the private directory of this process tree's stack dumps.
+    Children started afterwards can be asked for their stacks. Returns the
+    directory
+    """
+    global _dump_dir, _dump_dir_owner
+    if _dump_dir is None:
+        _dump_dir = tempfile.mkdtemp(prefix='testkit-stacks-')
+        _dump_dir_owner = os.getpid()
+        # Unlike atexit handlers, these also run when a multiprocessing
+        # child exits
+        multiprocessing.util.Finalize(None, _remove_dump_dir, exitpriority=0)
+    return _dump_dir
+
+
+def _remove_dump_dir():
+    # Forked children inherit the exit handlers of their parent
+    if os.getpid() == _dump_dir_owner:
+        shutil.rmtree(_dump_dir, ignore_errors=True)
+
+
+def _request_path(pid):
+    return os.path.join(_dump_dir, '%d.request' % pid)
+
+
+def _dump_path(pid):
+    return os.path.join(_dump_dir, '%d.stacks' % pid)
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def format_all_stacks():
+    """The stacks of every thread but the calling one"""
+    names = dict((thread.ident, thread.name)
+            for thread in threading.enumerate())
+    current = threading.current_thread().ident
+    sections = []
+    for thread_id, frame in sorted(sys._current_frames().items()):
+        if thread_id == current:
+            continue
+        sections.append('Thread "%s":\n%s' % (names.get(thread_id, thread_id),
+            ''.join(traceback.format_stack(frame))))
+    return '\n'.join(sections)
+
+
+def _set_blocking(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags & ~os.O_NONBLOCK)
+
+
+def write_stack_dump(pid):
+    """Writes the stacks to the parent if it is still reading"""
+    try:
+        fd = os.open(_dump_path(pid), os.O_WRONLY | os.O_NONBLOCK)
+    except OSError, e:
+        if e.errno == errno.ENXIO:
+            # The parent gave up on this dump
+            return
+        raise
+    try:
+        _set_blocking(fd)
+        dump = format_all_stacks()
+        written = 0
+        while written < len(dump):
+            written += os.write(fd, dump[written:])
+    finally:
+        os.close(fd)
+
+
+def _dump_when_requested(pid):
+    request_path = _request_path(pid)
+    while True:
+        # Blocks until the parent opens the other end
+        request = open(request_path, 'rb')
+        try:
+            request.read()
+        finally:
+            request.close()
+        try:
+            write_stack_dump(pid)
+        except (IOError, OSError):
+            # The parent stopped reading half way through
+            pass
+
+
+def _remove_stack_dumper(pid):
+    _unlink(_request_path(pid))
+    _unlink(_dump_path(pid))
+
+
+def start_stack_dumper():
+    """Starts this process's dumper thread. Forked children need their own.
+    Does nothing unless the parent called ``prepare_stack_dumps``
+    """
+    if _dump_dir is None:
+        return
+    pid = os.getpid()
+    for path in (_request_path(pid), _dump_path(pid)):
+        # Left by an earlier process with the same pid
+        _unlink(path)
+        os.mkfifo(path, stat.S_IRUSR | stat.S_IWUSR)
+    # Run when a multiprocessing child exits
+    multiprocessing.util.Finalize(None, _remove_stack_dumper, args=(pid,),
+            exitpriority=0)
+    thread = threading.Thread(target=_dump_when_requested, args=(pid,))
+    thread.daemon = True
+    thread.start()
+
+
+def remove_stack_dumper():
+    """Removes this process's pipes. For children that leave with
+    ``os._exit``
+    """
+    if _dump_dir is not None:
+        _remove_stack_dumper(os.getpid())
+
+
+def _request_dump(pid):
+    """Opens the dump for reading and asks for it. Returns the dump's file
+    descriptor or None if the process has no dumper waiting
+    """
+    try:
+        fd = os.open(_dump_path(pid), os.O_RDONLY | os.O_NONBLOCK)
+    except OSError:
+        return None
+    try:
+        request = os.open(_request_path(pid), os.O_WRONLY | os.O_NONBLOCK)
+    except OSError:
+        # Nothing is reading requests
+        os.close(fd)
+        return None
+    # Closing wakes the dumper up
+    os.close(request)
+    return fd
+
+
+def collect_stacks(processes, timeout=STACK_DUMP_TIMEOUT):
+    """Asks processes, given as ``{name: pid}``, for their stacks. Returns
+    ``{name: stacks}`` with None for processes that didn't answer in time.
+    The processes are about to be killed so their pipes are removed
+    """
+    stacks = dict((name, None) for name in processes)
+    if _dump_dir is None:
+        return stacks
+    pending = {}
+    chunks = {}
+    # Unlike select, poll takes descriptors above FD_SETSIZE
+    poller = select.poll()
+    try:
+        for name, pid in processes.iteritems():
+            fd = _request_dump(pid)
+            if fd is not None:
+                pending[fd] = name
+                chunks[name] = []
+                poller.register(fd, select.POLLIN)
+        deadline = time.time() + timeout
+        while pending:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            # Linux doesn't report a pipe as readable before its writer
+            # opened it
+            for fd, event in poller.poll(remaining * 1000):
+                chunk = os.read(fd, 65536)
+                if chunk:
+                    chunks[pending[fd]].append(chunk)
+                    continue
+                poller.unregister(fd)
+                name = pending.pop(fd)
+                os.close(fd)
+                stacks[name] = ''.join(chunks[name])
+    finally:
+        for fd in pending:
+            os.close(fd)
+        for pid in processes.itervalues():
+            _remove_stack_dumper(pid)
+    return stacks
+
+
+def format_stacks(stacks):
+    if not stacks:
+        return ''
+    sections = ['', '', 'Stacks before the processes were killed:']
+    for name in sorted(stacks):
+        sections.append('--- %s ---' % name)
+        sections.append(stacks[name] or 'No stacks were dumped')
+    return '\n'.join(sections)
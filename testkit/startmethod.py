@@ -0,0 +1,26 @@
+"""
+testkit.startmethod
+~~~~~~~~~~~~~~~~~~~
+
+How child processes are started. This Python's ``multiprocessing`` can only
+fork, so ``fork`` is the only start method there is. Heavy modules every
+child needs can be preloaded instead. They are imported by the parent right
+before it forks, so children inherit them rather than each importing them.
+"""
+
+START_METHODS = ('fork',)
+
+
+def check_start_method(start_method):
+    """Raises ValueError for start methods that are not available. None means
+    the default
+    """
+    if start_method is not None and start_method not in START_METHODS:
+        raise ValueError('Start method "%s" is not available. Use one of: %s'
+                % (start_method, ', '.join(START_METHODS)))
+
+
+def preload_modules(modules):
+    """Imports every module named so forked children inherit it"""
+    for name in modules or ():
+        __import__(name)
@@ -0,0 +1,103 @@
+"""
+testkit.telemetry
+~~~~~~~~~~~~~~~~~
+
+Timing and resource usage of each phase of a wrapper's lifecycle. Phases are
+measured in the wrapper's process and sent to its ProcessMonitor so that
+ProcessManager can report on every process of a test.
+"""
+import json
+import time
+import resource
+from contextlib import contextmanager
+
+
+def measure_phase(phase, start_time, start_usage):
+    """Builds a phase record from the time and rusage at its start"""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        'phase': phase,
+        'wall': time.time() - start_time,
+        'cpu': ((usage.ru_utime - start_usage.ru_utime) +
+            (usage.ru_stime - start_usage.ru_stime)),
+        'max_rss_kb': usage.ru_maxrss,
+        'voluntary_context_switches': usage.ru_nvcsw - start_usage.ru_nvcsw,
+        'involuntary_context_switches': (usage.ru_nivcsw -
+            start_usage.ru_nivcsw),
+    }
+
+
+class PhaseRecorder(object):
+    """Records phases in a wrapper's process and hands each record to
+    ``report`` as soon as the phase ends
+    """
+    def __init__(self, report):
+        self._report = report
+        # The phase in progress, if any
+        self.current = None
+
+    @contextmanager
+    def phase(self, name):
+        start_time = time.time()
+        start_usage = resource.getrusage(resource.RUSAGE_SELF)
+        previous, self.current = self.current, name
+        try:
+            yield
+        finally:
+            self.current = previous
+            self._report(measure_phase(name, start_time, start_usage))
+
+
+class TelemetryReport(object):
+    """Phase records for every process of a ProcessManager"""
+    def __init__(self, name, processes):
+        self.name = name
+        self.processes = processes
+
+    @classmethod
+    def from_monitors(cls, name, monitors):
+        processes = []
+        for monitor in monitors:
+            processes.append({
+                'wrapper': monitor.name,
+                'pid': monitor.process.pid,
+                'placement': monitor.placement,
+                'phases': list(monitor.phases),
+            })
+        return cls(name, processes)
+
+    def phases(self, phase=None):
+        """Yields ``(wrapper, record)`` for every record, optionally only for
+        one phase
+        """
+        for process in self.processes:
+            for record in process['phases']:
+                if phase is None or record['phase'] == phase:
+                    yield process['wrapper'], record
+
+    def slowest(self, count=5):
+        """The ``(wrapper, record)`` pairs with the longest wall time"""
+        records = sorted(self.phases(), key=lambda pair: pair[1]['wall'],
+                reverse=True)
+        return records[:count]
+
+    def to_dict(self):
+        return {'name': self.name, 'processes': self.processes}
+
+    def export_json(self, path):
+        """Appends the report to path as a single line of JSON"""
+        report_file = open(path, 'a')
+        try:
+            report_file.write(json.dumps(self.to_dict()) + '\n')
+        finally:
+            report_file.close()
+
+    def format(self):
+        lines = ['%-24s %-15s %9s %9s %10s %7s %7s' % ('wrapper', 'phase',
+            'wall', 'cpu', 'rss_kb', 'vcsw', 'ivcsw')]
+        for wrapper, record in self.phases():
+            lines.append('%-24s %-15s %9.4f %9.4f %10d %7d %7d' % (wrapper,
+                record['phase'], record['wall'], record['cpu'],
+                record['max_rss_kb'], record['voluntary_context_switches'],
+                record['involuntary_context_switches']))
+        return '\n'.join(lines)
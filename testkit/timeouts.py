@@ -1,22 +1,507 @@
+import os
+import time
+import atexit
 import multiprocessing
-import Queue
+import threading
+import signal
+import cPickle
 from functools import wraps
-from .exceptionutils import store_any_exception
+from .exceptionutils import PicklableExceptionInfo
+from .sharedmem import share_large_value, load_shared_value, unlink_segments
+from .startmethod import check_start_method, preload_modules
+from .stacks import (prepare_stack_dumps, start_stack_dumper, collect_stacks,
+        format_stacks)
+from .profiling import (check_profiler, check_profile_dir, new_profiler,
+        ProfileCollector)
+from .failures import record_failure
 
 
-def monitoring_wrapper(queue, monitored_func, args, kwargs):
-    exception_info = store_any_exception(monitored_func, args, kwargs)
+class CallTerminated(BaseException):
+    """Raised inside a profiled call when its process is terminated, so that
+    the profile is still sent to the parent
+    """
+
+
+def _terminate_call(signum, frame):
+    raise CallTerminated()
+
+
+def run_and_pack(f, args, kwargs, profiler=None):
+    """Calls a function and returns an ``(exception_info, result, profile)``
+    triple that can be sent to the parent. Large buffers are moved to shared
+    memory. The profile is None unless a profiler is named
+    """
+    profiler = new_profiler(profiler)
+    profile = None
+    try:
+        if profiler is None:
+            result = f(*args, **kwargs)
+        else:
+            # Timed out calls are terminated
+            previous_handler = signal.signal(signal.SIGTERM, _terminate_call)
+            try:
+                result = profiler.call(f, *args, **kwargs)
+            finally:
+                profile = profiler.profile
+                signal.signal(signal.SIGTERM, previous_handler)
+        result = share_large_value(result)
+    except:
+        return PicklableExceptionInfo.exc_info(), None, profile
+    return None, result, profile
+
+
+def send_outcome(connection, outcome):
+    try:
+        connection.send(outcome)
+    except:
+        # The outcome could not be pickled. Report why instead
+        connection.send((PicklableExceptionInfo.exc_info(), None, None))
+
+
+def record_timed_failure(f):
+    """Records the exception being handled as a failure of f. Time outs are
+    raised by testkit wherever f happened to be, so they are told apart by
+    f's name
+    """
+    exception_info = PicklableExceptionInfo.exc_info()
+    if issubclass(exception_info.exc_type, TimeoutError):
+        exception_info.set_location('%s.%s' % (f.__module__, f.__name__))
+    record_failure(exception_info, f.__name__)
+
+
+def unpack_outcome(outcome, source=None):
+    """Reraises the exception from a packed outcome or returns its result.
+    The exception is recorded as a failure of source first
+    """
+    exception_info, result, profile = outcome
     if exception_info:
-        queue.put(exception_info)
+        record_failure(exception_info, source)
+        # Raise the error inside the process
+        raise exception_info.reraise()
+    return load_shared_value(result)
+
+
+def monitoring_wrapper(connection, monitored_func, args, kwargs,
+        profiler=None):
+    start_stack_dumper()
+    send_outcome(connection, run_and_pack(monitored_func, args, kwargs,
+        profiler))
+
+
+# Seconds a process has to exit after SIGTERM before it is sent SIGKILL
+TERMINATE_GRACE_PERIOD = 1.0
+
+
+class ProcessGroupLeader(multiprocessing.Process):
+    """A process that starts a new process group. Terminating it also
+    terminates anything it started, such as servers run by a wrapper.
+    """
+    leads_process_group = True
+
+    def start(self):
+        super(ProcessGroupLeader, self).start()
+        # Also done in the parent so the group exists once start returns
+        try:
+            os.setpgid(self.pid, self.pid)
+        except OSError:
+            # The child already did it or has exited
+            pass
+
+    def run(self):
+        os.setpgid(0, 0)
+        super(ProcessGroupLeader, self).run()
+
+
+def signal_process(process, signum):
+    """Sends a signal to a process or to its group if it leads one. Processes
+    that were already reaped are skipped as their pid may have been reused.
+    The group of a reaped leader is still signalled: a pid isn't reused while
+    a group with that id exists.
+    """
+    leads_process_group = getattr(process, 'leads_process_group', False)
+    if process.exitcode is not None and not leads_process_group:
+        return
+    try:
+        if leads_process_group:
+            os.killpg(process.pid, signum)
+        else:
+            os.kill(process.pid, signum)
+    except OSError:
+        # Nothing left to signal
+        pass
+
+
+def terminate_processes(processes, grace_period=TERMINATE_GRACE_PERIOD):
+    """Sends SIGTERM to processes, waits up to grace_period for all of them
+    and then sends SIGKILL to anything left. Process group leaders always get
+    both signals so that the rest of their group is reaped.
+    """
+    processes = [process for process in processes
+            if process.pid is not None]
+    for process in processes:
+        signal_process(process, signal.SIGTERM)
+    deadline = time.time() + grace_period
+    for process in processes:
+        process.join(max(deadline - time.time(), 0))
+    for process in processes:
+        if (getattr(process, 'leads_process_group', False) or
+                process.is_alive()):
+            signal_process(process, signal.SIGKILL)
+            process.join()
 
 
-def terminate_process(process):
-    while process.is_alive():
-        process.terminate()
+def terminate_process(process, grace_period=TERMINATE_GRACE_PERIOD):
+    terminate_processes([process], grace_period)
+
+
+def terminate_profiled_call(process, connection,
+        grace_period=TERMINATE_GRACE_PERIOD):
+    """Terminates a process running a profiled call. The call sends its
+    outcome when it is terminated. Returns the profile in it or None
+    """
+    signal_process(process, signal.SIGTERM)
+    profile = None
+    try:
+        # Read while the process writes, the profile may not fit in the pipe
+        if connection.poll(grace_period):
+            profile = connection.recv()[2]
+    except (EOFError, IOError):
+        pass
+    terminate_process(process, grace_period)
+    return profile
 
 
 class TimeoutError(AssertionError):
-    pass
+    # Stacks of the processes killed for timing out, by name
+    stacks = None
+    # Profile of the timed out call when it was profiled
+    profile = None
+
+
+def attach_stacks(error, stacks):
+    """Adds the stacks of killed processes to a TimeoutError"""
+    error.stacks = stacks
+    if stacks:
+        error.args = (str(error) + format_stacks(stacks),)
+    return error
+
+
+# Functions that may be run by pooled workers. Workers are forked from the
+# parent so they can only run functions that were registered before they were
+# started. The registry's length is used as the worker's generation.
+_pooled_functions = []
+_pooled_keys = {}
+# Functions registered beyond this run in new processes instead. Functions
+# created anew for every test would otherwise grow the registry for good
+POOLED_FUNCTIONS_LIMIT = 1024
+
+
+class UnpicklableArguments(Exception):
+    """Raised when the arguments of a pooled call can't be sent to a worker"""
+
+
+def register_pooled_function(f):
+    """Registers a function for use in a worker pool and returns its key.
+    Returns None once the registry is full
+    """
+    key = _pooled_keys.get(f)
+    if key is None and len(_pooled_functions) < POOLED_FUNCTIONS_LIMIT:
+        _pooled_functions.append(f)
+        key = _pooled_keys[f] = len(_pooled_functions) - 1
+    return key
+
+
+def worker_loop(connection):
+    """Runs registered functions sent from the parent until told to stop"""
+    start_stack_dumper()
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        key, args, kwargs, profiler = message
+        send_outcome(connection, run_and_pack(_pooled_functions[key], args,
+            kwargs, profiler))
+
+
+class TimeoutWorker(object):
+    """A long lived process that runs timed functions on request"""
+    @classmethod
+    def start(cls):
+        prepare_stack_dumps()
+        parent_connection, child_connection = multiprocessing.Pipe()
+        process = ProcessGroupLeader(target=worker_loop,
+                args=(child_connection,))
+        process.daemon = True
+        process.start()
+        child_connection.close()
+        return cls(process, parent_connection, len(_pooled_functions))
+
+    def __init__(self, process, connection, generation):
+        self._process = process
+        self._connection = connection
+        self.generation = generation
+
+    def knows(self, key):
+        """Checks if the function was registered before this worker started"""
+        return key < self.generation
+
+    def send(self, key, args, kwargs, profiler=None):
+        # Pickled first so that only errors of pickling are told apart
+        try:
+            message = cPickle.dumps((key, args, kwargs, profiler),
+                    cPickle.HIGHEST_PROTOCOL)
+        except Exception, e:
+            raise UnpicklableArguments(str(e))
+        self._connection.send_bytes(message)
+
+    def poll(self, timeout):
+        return self._connection.poll(timeout)
+
+    @property
+    def pid(self):
+        return self._process.pid
+
+    def receive(self):
+        return self._connection.recv()
+
+    def stop(self):
+        try:
+            self._connection.send(None)
+        except IOError:
+            pass
+        self._process.join(0.1)
+        self.kill()
+
+    def kill(self):
+        terminate_process(self._process)
+        self._connection.close()
+
+    def kill_profiled(self):
+        """Kills a worker running a profiled call and returns the call's
+        profile
+        """
+        profile = terminate_profiled_call(self._process, self._connection)
+        self._connection.close()
+        return profile
+
+
+class TimeoutWorkerPool(object):
+    """A set of pre-forked workers used by ``timeout(limit, pooled=True)``.
+
+    Workers are only replaced when a function they are running times out or
+    when they were started before the requested function was defined.
+    """
+    def __init__(self, size=2):
+        self._size = size
+        self._lock = threading.Lock()
+        self._idle_workers = []
+        self.replenish()
+
+    def replenish(self):
+        """Starts workers until the pool has ``size`` idle workers"""
+        with self._lock:
+            while len(self._idle_workers) < self._size:
+                self._idle_workers.append(TimeoutWorker.start())
+
+    def _acquire(self, key):
+        with self._lock:
+            try:
+                worker = self._idle_workers.pop()
+            except IndexError:
+                worker = None
+        if worker is not None and not worker.knows(key):
+            worker.stop()
+            worker = None
+        if worker is None:
+            worker = TimeoutWorker.start()
+        return worker
+
+    def _release(self, worker):
+        with self._lock:
+            if len(self._idle_workers) < self._size:
+                self._idle_workers.append(worker)
+                return
+        worker.stop()
+
+    def run(self, key, args, kwargs, limit, profiler=None):
+        """Runs a registered function in a worker. Returns the packed
+        outcome of the run or raises a TimeoutError
+        """
+        worker = self._acquire(key)
+        try:
+            worker.send(key, args, kwargs, profiler)
+        except UnpicklableArguments:
+            # Nothing was sent so the worker can still be used
+            self._release(worker)
+            raise
+        except:
+            worker.kill()
+            raise
+        if not worker.poll(limit):
+            stacks = collect_stacks({_pooled_functions[key].__name__:
+                worker.pid})
+            profile = None
+            if profiler is None:
+                worker.kill()
+            else:
+                profile = worker.kill_profiled()
+            # The result may have been shared just before the worker died
+            unlink_segments(worker.pid)
+            self.replenish()
+            error = attach_stacks(TimeoutError('Test timed out'), stacks)
+            error.profile = profile
+            raise error
+        try:
+            outcome = worker.receive()
+        except EOFError:
+            # The worker died without reporting back
+            worker.kill()
+            unlink_segments(worker.pid)
+            self.replenish()
+            return None, None, None
+        except:
+            # The outcome was read but can't be loaded here
+            self._release(worker)
+            raise
+        self._release(worker)
+        return outcome
+
+    def shutdown(self):
+        with self._lock:
+            workers = self._idle_workers
+            self._idle_workers = []
+        for worker in workers:
+            worker.stop()
+
+
+_worker_pool = None
+
+
+def get_worker_pool():
+    """Returns the worker pool shared by all pooled timeouts"""
+    global _worker_pool
+    if _worker_pool is None:
+        _worker_pool = TimeoutWorkerPool()
+    return _worker_pool
+
+
+def shutdown_worker_pool():
+    global _worker_pool
+    if _worker_pool is not None:
+        _worker_pool.shutdown()
+        _worker_pool = None
+
+atexit.register(shutdown_worker_pool)
+
+
+def _async_raise_function():
+    try:
+        import ctypes
+        set_async_exc = ctypes.pythonapi.PyThreadState_SetAsyncExc
+    except (ImportError, AttributeError):
+        return None
+
+    def async_raise(thread_id, exc_type):
+        """Raises exc_type in a thread. None clears a pending exception"""
+        if exc_type is not None:
+            exc_type = ctypes.py_object(exc_type)
+        set_async_exc(ctypes.c_long(thread_id), exc_type)
+    return async_raise
+
+async_raise = _async_raise_function()
+
+
+def in_main_thread():
+    return isinstance(threading.current_thread(), threading._MainThread)
+
+
+def can_interrupt():
+    """Checks if the current thread can be interrupted in process. The main
+    thread uses SIGALRM, so an interval timer must not already be running.
+    Other threads need a way to raise exceptions asynchronously.
+    """
+    if in_main_thread():
+        if not hasattr(signal, 'setitimer'):
+            return False
+        return signal.getitimer(signal.ITIMER_REAL) == (0.0, 0.0)
+    return async_raise is not None
+
+
+class Watchdog(object):
+    """Raises a TimeoutError in a thread if it isn't stopped before limit"""
+    def __init__(self, thread_id, limit):
+        self._thread_id = thread_id
+        self._limit = limit
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._watch)
+        self._thread.daemon = True
+        self.fired = False
+
+    def start(self):
+        self._thread.start()
+
+    def _watch(self):
+        self._stopped.wait(self._limit)
+        with self._lock:
+            if not self._stopped.is_set():
+                async_raise(self._thread_id, TimeoutError)
+                self.fired = True
+
+    def stop(self):
+        with self._lock:
+            self._stopped.set()
+            if self.fired:
+                # Clear the exception if it hasn't been delivered yet
+                async_raise(self._thread_id, None)
+
+
+def run_with_alarm(f, args, kwargs, limit):
+    """Runs a function on the main thread and interrupts it with SIGALRM"""
+    def alarm_handler(signum, frame):
+        raise TimeoutError('Test timed out')
+    previous_handler = signal.signal(signal.SIGALRM, alarm_handler)
+    try:
+        try:
+            signal.setitimer(signal.ITIMER_REAL, limit)
+            return f(*args, **kwargs)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    finally:
+        signal.signal(signal.SIGALRM, previous_handler)
+
+
+def run_with_watchdog(f, args, kwargs, limit):
+    """Runs a function on the current thread and interrupts it from a
+    watchdog thread. The interruption is cooperative: a thread blocked inside
+    a C call only sees the TimeoutError once the call returns.
+    """
+    watchdog = Watchdog(threading.current_thread().ident, limit)
+    watchdog.start()
+    try:
+        try:
+            result = f(*args, **kwargs)
+        finally:
+            watchdog.stop()
+    except TimeoutError:
+        if not watchdog.fired:
+            raise
+    if watchdog.fired:
+        raise TimeoutError('Test timed out')
+    return result
+
+
+def run_in_process(f, args, kwargs, limit):
+    """Runs a function with a deadline in the current process"""
+    if in_main_thread():
+        return run_with_alarm(f, args, kwargs, limit)
+    return run_with_watchdog(f, args, kwargs, limit)
+
+
+TIMEOUT_ENGINES = ['process', 'inprocess']
 
 
 class TimeoutDecorator(object):
@@ -33,29 +518,128 @@ class TimeoutDecorator(object):
             # This test will fail
             time.sleep(0.2)
 
+    Passing ``pooled=True`` runs the function in one of a set of long lived
+    worker processes instead of starting a new process for every call. A
+    worker is only replaced when it times out. Arguments to the function must
+    be picklable. If they are not, a new process is used as usual. Since
+    workers are reused, global state changed by a test can be seen by later
+    tests.
+
+    Passing ``engine='inprocess'`` enforces the limit without leaving the
+    current process, so fixtures, mocks and coverage are shared with the
+    caller. The main thread is interrupted with SIGALRM and other threads by
+    a watchdog thread. If the current thread cannot be interrupted (for
+    instance an outer timeout already owns the interval timer) the process
+    engine is used instead.
+
+    Passing ``process_group=True`` runs a new process as the leader of its own
+    process group so anything it starts is killed along with it. Pooled
+    workers always lead their own process group.
+
+    ``preload`` names modules to import before forking so that new processes
+    and pool workers inherit them. ``start_method`` only accepts ``'fork'``
+    as that's all this Python's ``multiprocessing`` supports.
+
+    With the process engines, ``profiler`` profiles the function in its
+    process with ``'cprofile'`` or ``'sampling'``. ``profile_dir`` is then
+    required. Each call, including one that times out, writes its profile to
+    a new file in it named after the function. See ``testkit.profiling``.
+
+    When the limit is hit with the process engines, the stacks of every
+    thread of the child are attached to the TimeoutError as ``stacks`` and
+    added to its message before the child is killed.
+
+    The decorated function returns whatever the wrapped function returns.
+    With the process engines large ``str``, ``bytearray`` and ``array``
+    results are passed back through shared memory instead of being pickled.
     """
-    def __init__(self, limit):
+    def __init__(self, limit, pooled=False, engine='process',
+            process_group=False, start_method=None, preload=None,
+            profiler=None, profile_dir=None):
+        if engine not in TIMEOUT_ENGINES:
+            raise ValueError('Unknown timeout engine "%s"' % engine)
+        check_start_method(start_method)
+        check_profiler(profiler)
+        check_profile_dir(profiler, profile_dir)
+        self._profiler = profiler
+        self._profile_dir = profile_dir
+        self._preload = preload
         self._limit = limit
+        self._pooled = pooled
+        self._engine = engine
+        self._process_cls = multiprocessing.Process
+        if process_group:
+            self._process_cls = ProcessGroupLeader
 
     def __call__(self, f):
+        pool_key = None
+        if self._pooled:
+            pool_key = register_pooled_function(f)
+
         @wraps(f)
         def run_timed_test(*args, **kwargs):
-            queue = multiprocessing.Queue()
-            process = multiprocessing.Process(target=monitoring_wrapper,
-                    args=(queue, f, args, kwargs))
-            process.start()
-            process.join(self._limit)
-            if process.is_alive():
-                terminate_process(process)
-                raise TimeoutError('Test timed out')
+            if self._engine == 'inprocess' and can_interrupt():
+                try:
+                    return run_in_process(f, args, kwargs, self._limit)
+                except:
+                    record_timed_failure(f)
+                    raise
+            preload_modules(self._preload)
             try:
-                exception_info = queue.get(block=False)
-            except Queue.Empty:
-                # Everything is fine then
+                outcome = self._run_in_child(f, pool_key, args, kwargs)
+            except TimeoutError, e:
+                record_timed_failure(f)
+                self._dump_profile(f, e.profile)
+                raise
+            self._dump_profile(f, outcome[2])
+            return unpack_outcome(outcome, f.__name__)
+        return run_timed_test
+
+    def _run_in_child(self, f, pool_key, args, kwargs):
+        if pool_key is not None:
+            try:
+                return get_worker_pool().run(pool_key, args, kwargs,
+                        self._limit, self._profiler)
+            except UnpicklableArguments:
                 pass
+        return self._run_in_new_process(f, args, kwargs)
+
+    def _dump_profile(self, f, profile):
+        if self._profiler is None:
+            return
+        collector = ProfileCollector(self._profiler)
+        collector.add(profile)
+        collector.dump(self._profile_dir, f.__name__, unique=True)
+
+    def _run_in_new_process(self, f, args, kwargs):
+        prepare_stack_dumps()
+        reader, writer = multiprocessing.Pipe(duplex=False)
+        process = self._process_cls(target=monitoring_wrapper,
+                args=(writer, f, args, kwargs, self._profiler))
+        process.start()
+        # Only the child should hold the writer so reading fails if it dies
+        writer.close()
+        if not reader.poll(self._limit):
+            stacks = collect_stacks({f.__name__: process.pid})
+            profile = None
+            if self._profiler is None:
+                terminate_process(process)
             else:
-                # Raise the error inside the process
-                raise exception_info.reraise()
-        return run_timed_test
+                profile = terminate_profiled_call(process, reader)
+            # The result may have been shared just before the process died
+            unlink_segments(process.pid)
+            error = attach_stacks(TimeoutError('Test timed out'), stacks)
+            error.profile = profile
+            raise error
+        try:
+            outcome = reader.recv()
+        except EOFError:
+            # The process exited without reporting. Everything is fine then
+            outcome = (None, None, None)
+            unlink_segments(process.pid)
+        process.join(self._limit)
+        if process.is_alive() or self._process_cls is ProcessGroupLeader:
+            terminate_process(process)
+        return outcome
 
 timeout = TimeoutDecorator
@@ -0,0 +1,133 @@
+import time
+from nose.tools import raises, eq_
+from testkit.processes import *
+from testkit.bus import MessageBus, BusClient
+
+
+class PingProcess(ProcessWrapper):
+    def run(self):
+        count = self.wait_for_message('start', timeout=2.0)
+        for index in range(count):
+            self.publish('ping', index)
+        while True:
+            time.sleep(1.0)
+
+
+class LateProcess(ProcessWrapper):
+    def run(self):
+        self.publish('early', 'hello')
+        while True:
+            time.sleep(1.0)
+
+
+class SilentProcess(ProcessWrapper):
+    def run(self):
+        while True:
+            time.sleep(1.0)
+
+
+@multiprocess([PingProcess], limit=5.0)
+def test_wrappers_exchange_messages(initial, shared):
+    bus_publish('start', 3)
+    eq_([bus_wait('ping', timeout=2.0) for index in range(3)], [0, 1, 2])
+
+
+@multiprocess([LateProcess], limit=5.0)
+def test_late_waiters_see_earlier_messages(initial, shared):
+    time.sleep(0.2)
+    eq_(bus_wait('early', timeout=2.0), 'hello')
+
+
+@raises(TimeoutError)
+@multiprocess([SilentProcess], limit=5.0)
+def test_wait_times_out(initial, shared):
+    bus_wait('nothing', timeout=0.1)
+
+
+@raises(MessageBusError)
+def test_bus_is_unavailable_outside_wrappers():
+    bus_publish('topic')
+
+
+def test_bus_replies_to_waiters_in_order():
+    bus = MessageBus(queue_size=4)
+    eq_(bus.wait('a', 'topic'), [])
+    eq_(bus.publish('topic', 1), [('a', 'bus_message', ('topic', 1, None))])
+    bus.publish('topic', 2)
+    eq_(bus.wait('a', 'topic'), [('a', 'bus_message', ('topic', 2, None))])
+    eq_(bus.wait('b', 'topic'), [('b', 'bus_message', ('topic', 1, None))])
+
+
+def test_bus_reports_overflow():
+    bus = MessageBus(queue_size=2)
+    for index in range(5):
+        bus.publish('topic', index)
+    eq_(bus.wait('a', 'topic'), [('a', 'bus_overflow', ('topic', 3, None))])
+    eq_(bus.wait('a', 'topic'), [('a', 'bus_message', ('topic', 3, None))])
+
+
+def test_cancelled_waits_get_no_replies():
+    bus = MessageBus()
+    bus.wait('a', 'topic')
+    bus.cancel('a', 'topic')
+    eq_(bus.publish('topic', 1), [])
+
+
+def test_cancelled_answered_waits_are_answered_again():
+    bus = MessageBus()
+    bus.publish('topic', 1)
+    eq_(bus.wait('a', 'topic', 1), [('a', 'bus_message', ('topic', 1, 1))])
+    # The reply arrived after the wait timed out
+    bus.cancel('a', 'topic', 1)
+    eq_(bus.wait('a', 'topic', 2), [('a', 'bus_message', ('topic', 1, 2))])
+    bus.cancel('a', 'topic', 1)
+    eq_(bus.wait('a', 'topic', 3), [])
+
+
+class SlowConnection(object):
+    """Brokers a client's waits and delivers the replies only once
+    ``delayed`` is cleared
+    """
+    def __init__(self, bus):
+        self.bus = bus
+        self.replies = []
+        self.delayed = True
+
+    def send_message(self, kind, payload):
+        method = {'bus_wait': self.bus.wait, 'bus_cancel': self.bus.cancel}
+        for waiter, reply_kind, reply in method[kind]('a', *payload) or []:
+            self.replies.append((reply_kind, reply))
+
+    def poll(self, timeout):
+        return not self.delayed and bool(self.replies)
+
+    def recv(self):
+        return self.replies.pop(0)
+
+
+def test_replies_after_a_timeout_are_dropped():
+    bus = MessageBus()
+    connection = SlowConnection(bus)
+    client = BusClient(connection.send_message, connection)
+    bus.publish('topic', 'late')
+    try:
+        client.wait('topic', timeout=0.1)
+    except TimeoutError:
+        pass
+    else:
+        raise AssertionError('Did not time out')
+    connection.delayed = False
+    # The stale reply is skipped and the message is sent again
+    eq_(client.wait('topic', timeout=0.1), 'late')
+    eq_(connection.replies, [])
+
+
+def test_collected_topics_keep_every_message():
+    bus = MessageBus(queue_size=2, collected_topics=('collected',))
+    for index in range(5):
+        bus.publish('collected', index)
+        bus.publish('other', index)
+    eq_(bus.collected('collected'), range(5))
+    eq_(bus.collected('other'), [])
+    bus.reset()
+    eq_(bus.collected('collected'), [])
@@ -0,0 +1,166 @@
+import os
+import time
+import cPickle
+from nose.tools import eq_
+from testkit.exceptionutils import store_any_exception
+from testkit.failures import *
+from testkit.timeouts import timeout, TimeoutError
+from testkit.processes import (ProcessManager, ProcessWrapper, ProcessError,
+        ProcessTimedOut)
+
+
+class DependencyBroken(Exception):
+    pass
+
+
+def use_dependency(request_id):
+    raise DependencyBroken('request %d failed' % request_id)
+
+
+def use_dependency_elsewhere(request_id):
+    raise DependencyBroken('request %d failed' % request_id)
+
+
+def test_fingerprint_ignores_messages():
+    first = store_any_exception(use_dependency, (1,))
+    second = store_any_exception(use_dependency, (2,))
+    eq_(first.fingerprint, second.fingerprint)
+    pickled = cPickle.loads(cPickle.dumps(first, 2))
+    eq_(pickled.fingerprint, first.fingerprint)
+
+
+def test_fingerprint_differs_by_location():
+    first = store_any_exception(use_dependency, (1,))
+    other = store_any_exception(use_dependency_elsewhere, (1,))
+    assert first.fingerprint != other.fingerprint
+
+
+def test_collector_keeps_one_failure_per_group():
+    collector = FailureCollector()
+    for request_id in xrange(20):
+        collector.add(store_any_exception(use_dependency, (request_id,)),
+                'test_%d' % request_id)
+    collector.add(store_any_exception(use_dependency_elsewhere, (0,)))
+    eq_(len(collector), 2)
+    eq_(collector.total, 21)
+    group = collector.groups[0]
+    eq_(group.count, 20)
+    eq_(group.sources, ['test_%d' % index
+        for index in xrange(FAILURE_SOURCES)])
+    eq_(str(group.exception_info.exc_value), 'request 0 failed')
+    eq_(group.exception_info._traceback, None)
+    summary = collector.summary()
+    assert summary.startswith('2 distinct failures out of 21'), summary
+    assert summary.count('DependencyBroken: request') == 2, summary
+    collector.clear()
+    eq_(collector.summary(), '')
+
+
+def test_timeout_records_failures():
+    failure_collector.clear()
+    timed = timeout(2.0)(use_dependency)
+    for request_id in xrange(3):
+        try:
+            timed(request_id)
+        except DependencyBroken:
+            pass
+    group, = failure_collector.groups
+    eq_(group.count, 3)
+    eq_(group.sources, ['use_dependency'] * 3)
+    failure_collector.clear()
+
+
+def check_records_one_failure(f, exception_type, source):
+    failure_collector.clear()
+    try:
+        f()
+    except exception_type:
+        pass
+    else:
+        raise AssertionError('Did not fail')
+    group, = failure_collector.groups
+    eq_(group.exception_info._exc_type, exception_type)
+    eq_(group.sources, [source])
+    failure_collector.clear()
+
+
+def sleep_too_long():
+    time.sleep(1.0)
+
+
+def test_timeouts_record_time_outs():
+    for options in [{}, {'pooled': True}]:
+        yield (check_records_one_failure,
+                timeout(0.1, **options)(sleep_too_long), TimeoutError,
+                'sleep_too_long')
+
+
+def test_inprocess_timeouts_record_failures():
+    yield (check_records_one_failure,
+            timeout(0.1, engine='inprocess')(sleep_too_long), TimeoutError,
+            'sleep_too_long')
+    yield (check_records_one_failure,
+            lambda: timeout(1.0, engine='inprocess')(use_dependency)(0),
+            DependencyBroken, 'use_dependency')
+
+
+def sleep_too_long_elsewhere():
+    time.sleep(1.0)
+
+
+def test_time_outs_are_grouped_by_function():
+    failure_collector.clear()
+    for f in [sleep_too_long, sleep_too_long_elsewhere, sleep_too_long]:
+        try:
+            timeout(0.1)(f)()
+        except TimeoutError:
+            pass
+    eq_([(group.count, group.sources) for group in failure_collector.groups],
+            [(2, ['sleep_too_long'] * 2), (1, ['sleep_too_long_elsewhere'])])
+    failure_collector.clear()
+
+
+class SlowOptionsProcess(ProcessWrapper):
+    def shared_options(self):
+        time.sleep(1.0)
+        return {}
+
+
+class ExitingProcess(ProcessWrapper):
+    def run(self):
+        os._exit(3)
+
+
+def run_manager(wrapper_cls):
+    ProcessManager.from_wrappers([wrapper_cls], {}, timeout=0.2,
+            runtime_timeout=3.0).run()
+
+
+def test_monitor_records_process_errors():
+    yield (check_records_one_failure,
+            lambda: run_manager(SlowOptionsProcess), ProcessTimedOut,
+            'SlowOptionsProcess')
+    yield (check_records_one_failure, lambda: run_manager(ExitingProcess),
+            ProcessError, 'ExitingProcess')
+
+
+class BrokenProcess(ProcessWrapper):
+    def run(self):
+        use_dependency(0)
+
+
+def test_monitor_records_failures_once():
+    failure_collector.clear()
+    for i in xrange(2):
+        manager = ProcessManager.from_wrappers([BrokenProcess], {},
+                runtime_timeout=3.0)
+        try:
+            manager.run()
+        except DependencyBroken:
+            pass
+        else:
+            raise AssertionError('Did not fail')
+    group, = failure_collector.groups
+    eq_(group.count, 2)
+    eq_(group.sources, ['BrokenProcess', 'BrokenProcess'])
+    failure_collector.clear()
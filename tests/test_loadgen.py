@@ -0,0 +1,93 @@
+import time
+from nose.tools import eq_
+from testkit.processes import *
+from testkit.loadgen import *
+
+
+class SleepyClients(LoadGenerator):
+    rate = 200
+    duration = 0.5
+    concurrency = 2
+
+    def call(self):
+        time.sleep(0.002)
+
+
+class CountedClients(LoadGenerator):
+    requests = 50
+    duration = None
+
+    def call(self):
+        if self.replica_index == 0:
+            raise ValueError('Failed call')
+
+
+@multiprocess([(SleepyClients, 2)], limit=10.0)
+def test_load_is_reported_to_the_test(initial, shared):
+    report = wait_for_load(timeout=5.0)
+    assert 150 <= report.calls <= 210, report
+    assert 0.002 <= report.p50 < 0.1, report
+    assert report.p50 <= report.p99 <= report.p999
+    eq_(report.errors, 0)
+
+
+class LoadWaiter(ProcessWrapper):
+    def run(self):
+        wait_for_load(timeout=5.0)
+
+
+def test_manager_merges_load_reports():
+    manager = ProcessManager.from_wrappers([(CountedClients, 3), LoadWaiter],
+            {}, runtime_timeout=5.0)
+    manager.run()
+    report = manager.load_report
+    eq_(report.calls, 100)
+    eq_(report.errors, 50)
+
+
+class SmallBusManager(ProcessManager):
+    bus_queue_size = 2
+
+
+class LoadSleeper(ProcessWrapper):
+    def run(self):
+        time.sleep(1.0)
+
+
+def test_manager_has_every_load_report():
+    manager = SmallBusManager.from_wrappers([(CountedClients, 4),
+        LoadSleeper], {}, runtime_timeout=5.0)
+    manager.run()
+    report = manager.load_report
+    eq_(report.calls, 150)
+    eq_(report.errors, 50)
+
+
+def test_histogram_percentiles():
+    histogram = LatencyHistogram()
+    for micros in range(1, 10001):
+        histogram.record(micros / 1000000.0)
+    eq_(histogram.count, 10000)
+    for percent, expected in [(50, 0.005), (99, 0.0099), (99.9, 0.00999)]:
+        value = histogram.percentile(percent)
+        assert abs(value - expected) / expected < 0.01, (percent, value)
+    eq_(histogram.percentile(100), 0.01)
+
+
+def test_histograms_merge():
+    first = LatencyHistogram()
+    second = LatencyHistogram()
+    for latency in [0.001, 0.002]:
+        first.record(latency)
+    second.record(0.5)
+    first.merge(second)
+    eq_(first.count, 3)
+    eq_(first.percentile(100), 0.5)
+    eq_(first.min, 1000)
+
+
+def test_rate_limits_calls():
+    calls = []
+    report = generate_load(lambda: calls.append(1), rate=100, duration=0.2)
+    assert 18 <= len(calls) <= 21, len(calls)
+    eq_(report.calls, len(calls))
@@ -5,7 +5,9 @@ tests.test_meta
 Tests for the metaclass of MultiprocessTest
 """
 from nose.tools import raises
+import os
 import time
+import tempfile
 from mock import patch
 from functools import wraps
 from testkit.processes import *
@@ -54,3 +56,123 @@ class TestOfTests(SomethingGeneric):
 
     def test_simple(self):
         assert 1 == 1
+
+
+# Created by setup_module
+FLEET_LOG = None
+SNAPSHOT_LOG = None
+
+
+def new_log(prefix):
+    fd, path = tempfile.mkstemp(prefix=prefix)
+    os.close(fd)
+    return path
+
+
+def setup_module():
+    global FLEET_LOG, SNAPSHOT_LOG
+    FLEET_LOG = new_log('testkit-fleet-')
+    SNAPSHOT_LOG = new_log('testkit-snapshot-')
+
+
+def teardown_module():
+    os.unlink(FLEET_LOG)
+    os.unlink(SNAPSHOT_LOG)
+
+
+def read_fleet_log():
+    return open(FLEET_LOG).read().split()
+
+
+class ServerThatRunsForever(ProcessWrapper):
+    def run(self):
+        while True:
+            time.sleep(1.0)
+
+
+class TestFleet(MultiprocessTest):
+    fleet = True
+    wrappers = [ServerThatRunsForever]
+
+    def setup(self, shared_options):
+        open(FLEET_LOG, 'a').write('setup-%d\n' % os.getpid())
+
+    def reset(self):
+        open(FLEET_LOG, 'a').write('reset-%d\n' % os.getpid())
+
+    def check_fleet(self):
+        open(FLEET_LOG, 'a').write('test-%d\n' % os.getpid())
+        log = read_fleet_log()
+        tests = [entry for entry in log if entry.startswith('test')]
+        resets = [entry for entry in log if entry.startswith('reset')]
+        assert log[0] == 'setup-%d' % os.getpid()
+        assert len([entry for entry in log if entry.startswith('setup')]) == 1
+        assert len(resets) == len(tests) - 1
+        assert set(tests) == set(['test-%d' % os.getpid()])
+
+    def test_first(self):
+        self.check_fleet()
+
+    def test_second(self):
+        self.check_fleet()
+
+    def test_third(self):
+        self.check_fleet()
+
+
+class TestFleetOfTests(SomethingGeneric):
+    fleet = True
+
+
+class CustomException(Exception):
+    pass
+
+
+class TestSnapshot(MultiprocessTest):
+    snapshot = True
+    timeout = 0.5
+    wrappers = [ServerThatRunsForever]
+
+    def setup(self, shared_options):
+        open(SNAPSHOT_LOG, 'a').write('setup-%d\n' % os.getpid())
+        self.setup_pid = os.getpid()
+        self.runs = []
+
+    def check_snapshot(self):
+        self.runs.append(os.getpid())
+        # Each run starts from the state setup left behind
+        assert len(self.runs) == 1
+        assert os.getpid() != self.setup_pid
+        assert open(SNAPSHOT_LOG).read().split() == [
+                'setup-%d' % self.setup_pid]
+
+    def test_first(self):
+        self.check_snapshot()
+
+    def test_second(self):
+        self.check_snapshot()
+
+    @mp_runtime(raises(CustomException))
+    def test_snapshot_exception(self):
+        raise CustomException('error')
+
+    @mp_runtime(raises(TimeoutError))
+    def test_snapshot_timeout(self):
+        while True:
+            pass
+
+
+class TestHeartbeats(MultiprocessTest):
+    snapshot = True
+    timeout = 5.0
+    progress_timeout = 0.3
+
+    def test_progress_in_snapshot(self):
+        for index in range(10):
+            mark_progress(index)
+            time.sleep(0.05)
+
+    @mp_runtime(raises(ProcessStalled))
+    def test_stall_in_snapshot(self):
+        mark_progress('sleeping')
+        time.sleep(3.0)
@@ -0,0 +1,53 @@
+import time
+from nose.tools import raises, eq_
+from testkit.processes import *
+from testkit.metrics import SharedMetrics
+
+
+class ClientProcess(ProcessWrapper):
+    metric_sizes = {'requests': 1, 'latency': 4}
+
+    def run(self):
+        for index in range(100):
+            self.metrics.add('requests')
+            self.metrics.add('latency', index=index % 4)
+        self.publish('finished')
+        while True:
+            time.sleep(1.0)
+
+
+@multiprocess([(ClientProcess, 3)], limit=5.0)
+def test_counts_from_every_wrapper(initial, shared):
+    for index in range(3):
+        bus_wait('finished', timeout=2.0)
+    metrics = current_metrics()
+    eq_(metrics.value('requests'), 300)
+    eq_(metrics.values('latency'), [75, 75, 75, 75])
+
+
+class OtherSizeProcess(ProcessWrapper):
+    metric_sizes = {'latency': 8}
+
+    def run(self):
+        pass
+
+
+@raises(ProcessManagerError)
+def test_conflicting_sizes():
+    ProcessManager.from_wrappers([ClientProcess, OtherSizeProcess], {},
+            runtime_timeout=5.0).run()
+
+
+def test_stripes_are_summed():
+    metrics = SharedMetrics({'a': 1, 'b': 2}, 2)
+    metrics.for_stripe(0).add('a', 2)
+    metrics.for_stripe(1).add('a', 3)
+    metrics.for_stripe(1).add('b', 4, index=1)
+    eq_(metrics.snapshot(), {'a': [5], 'b': [0, 4]})
+    metrics.clear()
+    eq_(metrics.value('a'), 0)
+
+
+@raises(ValueError)
+def test_updates_need_a_stripe():
+    SharedMetrics({'a': 1}, 1).add('a')
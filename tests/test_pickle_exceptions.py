@@ -1,5 +1,8 @@
+import sys
+import cPickle
+import traceback
 from mock import Mock
-from nose.tools import raises
+from nose.tools import raises, eq_
 from testkit.exceptionutils import *
 
 
@@ -26,3 +29,90 @@ def test_exception_raised_correctly_with_args():
 
 def a_function():
     raise CustomException('someexception')
+
+
+def reraised_traceback(exception_info):
+    try:
+        exception_info.reraise()
+    except CustomException:
+        return traceback.extract_tb(sys.exc_info()[2])
+
+
+def pickled_exception_info(f):
+    return cPickle.loads(cPickle.dumps(store_any_exception(f), 2))
+
+
+def test_fake_code_is_reused():
+    fake_code_cache.clear()
+    first = reraised_traceback(pickled_exception_info(a_function))
+    cached = len(fake_code_cache)
+    assert cached > 0
+    eq_(reraised_traceback(pickled_exception_info(a_function)), first)
+    eq_(len(fake_code_cache), cached)
+    eq_(first[-1][:2], (a_function.func_code.co_filename,
+        a_function.func_code.co_firstlineno + 1))
+
+
+def test_fake_code_cache_evicts_least_recently_used():
+    cache = FakeCodeCache(size=2)
+    first = cache.get('a.py', 10)
+    cache.get('b.py', 20)
+    assert cache.get('a.py', 10) is first
+    cache.get('c.py', 30)
+    eq_(len(cache), 2)
+    assert cache.get('a.py', 10) is first
+    assert cache.get('b.py', 20) is not None
+    eq_(len(cache), 2)
+
+
+def test_traceback_is_only_rebuilt_after_pickling():
+    before = PicklableExceptionInfo.reconstructions
+    exception_info = store_any_exception(a_function)
+    local_traceback = reraised_traceback(exception_info)
+    eq_(PicklableExceptionInfo.reconstructions, before)
+    exception_info = cPickle.loads(cPickle.dumps(exception_info, 2))
+    eq_(exception_info.exc_type, CustomException)
+    eq_(str(exception_info.exc_value), 'someexception')
+    eq_(PicklableExceptionInfo.reconstructions, before)
+    rebuilt_traceback = reraised_traceback(exception_info)
+    reraised_traceback(exception_info)
+    eq_(PicklableExceptionInfo.reconstructions, before + 1)
+    eq_([frame[:2] for frame in rebuilt_traceback],
+            [frame[:2] for frame in local_traceback])
+
+
+def test_format_matches_python():
+    exception_info = pickled_exception_info(a_function)
+    before = PicklableExceptionInfo.reconstructions
+    try:
+        a_function()
+    except CustomException:
+        expected = traceback.format_exc()
+    formatted = exception_info.format()
+    eq_(PicklableExceptionInfo.reconstructions, before)
+    eq_(formatted.splitlines()[-3:], expected.splitlines()[-3:])
+    eq_([frame[2] for frame in exception_info.frames],
+            ['store_any_exception', 'a_function'])
+
+
+def test_packed_frames_share_filenames():
+    frames = PackedFrames(['a.py', 'b.py'], [(0, 10, 'f'), (1, 20, 'g'),
+        (0, 30, 'f')])
+    decoded = PackedFrames.decode(frames.encode())
+    eq_(decoded.filenames, ['a.py', 'b.py'])
+    eq_(list(decoded), [('a.py', 10, 'f'), ('b.py', 20, 'g'),
+        ('a.py', 30, 'f')])
+    eq_(len(PackedFrames.decode(PackedFrames().encode())), 0)
+
+
+@raises(ValueError)
+def test_unknown_frames_encoding_is_rejected():
+    data = PackedFrames([], []).encode()
+    PackedFrames.decode(chr(FRAMES_ENCODING_VERSION + 1) + data[1:])
+
+
+def test_pickled_exception_info_keeps_frames():
+    exception_info = store_any_exception(a_function)
+    eq_(pickled_exception_info(a_function).frames, exception_info.frames)
+    filenames = [filename for filename, lineno, name in exception_info.frames]
+    eq_(exception_info._frames.filenames, filenames)
@@ -1,8 +1,24 @@
+import os
+import sys
+import errno
+import signal
+import threading
+import json
+import glob
+import pstats
+import mmap
 import time
+import multiprocessing
 import zmq
 from collections import deque
 from nose.tools import raises, eq_
 from testkit.processes import *
+from testkit.directory import temp_directory
+from testkit.sharedmem import SHARED_MEMORY_DIR
+import testkit.placement
+from testkit.placement import (parse_cpu_list, set_cpu_affinity,
+        get_cpu_affinity)
+from testkit.profiling import ProfileCollector
 
 
 class CustomException(Exception):
@@ -167,3 +183,493 @@ class TestWithMethodAsDescriptor(MultiprocessTest):
         while message_queue:
             expected = message_queue.popleft()
             eq_(self.socket.recv_multipart(), [msg_prefix, expected])
+
+
+class QuickProcess(ProcessWrapper):
+    def run(self):
+        pass
+
+
+def test_monitor_is_readable_on_status_changes():
+    monitor = ProcessMonitor.new_process(QuickProcess, {})
+    try:
+        eq_(monitor.get_process_options(), {})
+        monitor.send_shared_options({})
+        while not monitor.is_process_ready():
+            eq_(wait_for_any([monitor], 5.0), [monitor])
+            monitor.update_status()
+        monitor.run()
+        # Phase telemetry arrives before the process exits
+        while not monitor.has_exited:
+            eq_(wait_for_any([monitor], 5.0), [monitor])
+            monitor.update_status()
+        eq_([record['phase'] for record in monitor.phases],
+                ['shared_options', 'setup', 'barrier', 'run', 'teardown'])
+        eq_(monitor.exitcode, 0)
+    finally:
+        monitor.terminate()
+
+
+def test_wait_for_any_times_out():
+    monitor = ProcessMonitor.new_process(SomeProcess, {})
+    try:
+        monitor.get_process_options()
+        eq_(wait_for_any([monitor], 0.05), [])
+    finally:
+        monitor.terminate()
+
+
+@multiprocess([QuickProcess], limit=3.0)
+def test_process_exiting_right_after_start(initial, shared):
+    time.sleep(0.5)
+
+
+class BadOptionsProcess(ProcessWrapper):
+    def shared_options(self):
+        raise CustomException('Exception')
+
+    def run(self):
+        pass
+
+
+@raises(CustomException)
+@multiprocess([BadOptionsProcess], limit=3.0)
+def test_exception_in_shared_options(initial, shared):
+    pass
+
+
+class ReplicaProcess(ProcessWrapper):
+    def shared_options(self):
+        return {'index': self.replica_index, 'count': self.replica_count}
+
+    def run(self):
+        while True:
+            time.sleep(1.0)
+
+
+@multiprocess([SomeProcess, (ReplicaProcess, 5)], limit=3.0)
+def test_replicas_have_their_own_options(initial, shared):
+    eq_(shared['someproc'], 'hello')
+    eq_(shared['ReplicaProcess'],
+            [{'index': index, 'count': 5} for index in range(5)])
+
+
+@raises(ProcessManagerError)
+def test_replicating_a_class_twice_fails():
+    ProcessManager.from_wrappers([(ReplicaProcess, 2), (ReplicaProcess, 3)],
+            {})
+
+
+def test_expand_replicas():
+    eq_(expand_replicas([SomeProcess, (ReplicaProcess, 2)]), [
+        (SomeProcess, 0, None),
+        (ReplicaProcess, 0, 2),
+        (ReplicaProcess, 1, 2),
+    ])
+
+
+def test_telemetry_report_has_every_phase():
+    with temp_directory() as temp_dir:
+        path = os.path.join(temp_dir, 'telemetry.json')
+        manager = ProcessManager.from_wrappers([QuickProcess], {},
+                runtime_timeout=3.0, name='quick', telemetry_file=path)
+        manager.run()
+        report = manager.report
+        eq_(report.name, 'quick')
+        phases = [record['phase'] for record in report.processes[0]['phases']]
+        eq_(phases, ['shared_options', 'setup', 'barrier', 'run',
+            'teardown'])
+        for wrapper, record in report.phases():
+            eq_(wrapper, 'QuickProcess')
+            assert record['wall'] >= 0
+            assert record['max_rss_kb'] > 0
+        exported = json.loads(open(path).read())
+        eq_(exported, report.to_dict())
+
+
+LARGE_FIXTURE = 'x' * (2 * 1024 * 1024)
+
+
+class LargeFixtureProcess(ProcessWrapper):
+    def shared_options(self):
+        return {'fixture': shared_buffer(LARGE_FIXTURE)}
+
+    def setup(self, shared_options):
+        self.fixture = shared_options['fixture']
+
+    def run(self):
+        assert self.fixture[:] == LARGE_FIXTURE
+
+
+@multiprocess([LargeFixtureProcess, (LargeFixtureProcess, 2)], limit=5.0)
+def test_large_shared_options_are_mapped(initial, shared):
+    fixture = shared['fixture']
+    assert isinstance(fixture, mmap.mmap)
+    eq_(fixture[:], LARGE_FIXTURE)
+    replica_fixture = shared['LargeFixtureProcess'][1]['fixture']
+    eq_(len(replica_fixture), len(LARGE_FIXTURE))
+
+
+def shared_segments():
+    return set(name for name in os.listdir(SHARED_MEMORY_DIR)
+            if name.startswith('testkit-'))
+
+
+def test_shared_segments_are_removed():
+    before = shared_segments()
+    manager = ProcessManager.from_wrappers([LargeFixtureProcess,
+        LargeFixtureProcess], {}, runtime_timeout=5.0)
+    manager.run()
+    eq_(shared_segments(), before)
+
+
+class PinnedProcess(ProcessWrapper):
+    cpu_affinity = '0'
+    nice = 1
+
+    def run(self):
+        pass
+
+
+def test_placement_is_recorded():
+    manager = ProcessManager.from_wrappers([PinnedProcess], {},
+            runtime_timeout=3.0)
+    manager.run()
+    placement = manager.report.processes[0]['placement']
+    eq_(placement['cpus'], [0])
+    eq_(placement['nice'], os.nice(0) + 1)
+
+
+def thread_niceness(task_dir):
+    with open(os.path.join(task_dir, 'stat')) as f:
+        # The command name may hold spaces but not the fields after it
+        fields = f.read().rsplit(')', 1)[1].split()
+    return int(fields[16])
+
+
+class PinnedThreadsProcess(PinnedProcess):
+    heartbeat_interval = 0.1
+
+    def run(self):
+        tasks = glob.glob('/proc/self/task/*')
+        # The heartbeat and the stack dumper run beside the main thread
+        assert len(tasks) > 1, tasks
+        for task_dir in tasks:
+            eq_(thread_niceness(task_dir), self.placement_nice)
+            eq_(get_cpu_affinity(int(os.path.basename(task_dir))), [0])
+
+    def setup(self, shared_options):
+        self.placement_nice = os.nice(0)
+
+
+def test_placement_covers_helper_threads():
+    manager = ProcessManager.from_wrappers([PinnedThreadsProcess], {},
+            runtime_timeout=3.0)
+    manager.run()
+    eq_(manager.report.processes[0]['placement']['nice'], os.nice(0) + 1)
+
+
+class ReplicaPinnedProcess(ProcessWrapper):
+    def cpu_affinity(self):
+        # No machine has these CPUs
+        return [1000 + self.replica_index]
+
+    def run(self):
+        pass
+
+
+@raises(OSError)
+def test_placement_on_missing_cpus_fails():
+    ProcessManager.from_wrappers([(ReplicaPinnedProcess, 2)], {},
+            runtime_timeout=3.0).run()
+
+
+def test_unsupported_affinity_raises_enosys():
+    libc = testkit.placement._libc
+    testkit.placement._libc = None
+    try:
+        set_cpu_affinity([0])
+    except OSError, e:
+        eq_(e.errno, errno.ENOSYS)
+    else:
+        raise AssertionError('Affinity was set')
+    finally:
+        testkit.placement._libc = libc
+
+
+def test_parse_cpu_list():
+    eq_(parse_cpu_list('0-2,5, 7'), [0, 1, 2, 5, 7])
+    eq_(parse_cpu_list(set([3, 1])), [1, 3])
+
+
+class PreloadCheckProcess(ProcessWrapper):
+    def run(self):
+        assert 'colorsys' in sys.modules
+
+
+@multiprocess([PreloadCheckProcess], limit=3.0, preload=['colorsys'])
+def test_preloaded_modules_are_inherited(initial, shared):
+    assert 'colorsys' in sys.modules
+
+
+@raises(ValueError)
+def test_unavailable_start_method():
+    multiprocess([QuickProcess], start_method='spawn')
+
+
+class DeadlockedProcess(ProcessWrapper):
+    heartbeat_interval = 0.05
+    progress_timeout = 0.3
+
+    def run(self):
+        self.mark_progress('started')
+        lock = threading.Lock()
+        lock.acquire()
+        lock.acquire()
+
+
+class ProgressingProcess(ProcessWrapper):
+    progress_timeout = 0.3
+
+    def run(self):
+        for index in range(10):
+            self.mark_progress(index)
+            time.sleep(0.05)
+
+
+def test_stalled_wrapper_fails_fast():
+    manager = ProcessManager.from_wrappers([DeadlockedProcess], {},
+            runtime_timeout=10.0)
+    start = time.time()
+    try:
+        manager.run()
+    except ProcessStalled, e:
+        assert 'DeadlockedProcess' in str(e)
+        assert 'phase "run"' in str(e)
+        assert '"started"' in str(e)
+    else:
+        raise AssertionError('The stall was not detected')
+    assert time.time() - start < 3.0
+
+
+def test_progressing_wrapper_is_not_stalled():
+    ProcessManager.from_wrappers([ProgressingProcess], {},
+            runtime_timeout=5.0).run()
+
+
+class FrozenProcess(ProcessWrapper):
+    heartbeat_interval = 0.05
+
+    def run(self):
+        os.kill(os.getpid(), signal.SIGSTOP)
+
+
+@raises(ProcessStalled)
+def test_frozen_wrapper_stops_beating():
+    ProcessManager.from_wrappers([FrozenProcess], {},
+            runtime_timeout=10.0).run()
+
+
+class SnapshotPrintingProcess(ProcessWrapper):
+    snapshot = True
+
+    def setup(self, shared_options):
+        sys.stdout = open(self.initial_options['output'], 'w')
+
+    def run(self):
+        print 'printed by %d' % os.getpid()
+
+
+def test_snapshot_output_is_flushed():
+    with temp_directory() as temp_dir:
+        path = os.path.join(temp_dir, 'output')
+        fleet = ProcessFleet.from_wrappers([SnapshotPrintingProcess],
+                {'output': path}, runtime_timeout=5.0)
+        try:
+            fleet.run_test()
+        finally:
+            fleet.stop()
+        assert open(path).read().startswith('printed by '), open(path).read()
+
+
+class SnapshotServer(ProcessWrapper):
+    snapshot = True
+
+    def run(self):
+        while True:
+            time.sleep(1.0)
+
+
+def test_snapshot_runs_interrupted_before_forking_are_killed():
+    # The quick run ends before the server's forked run reports its pid
+    fleet = ProcessFleet.from_wrappers([SnapshotServer, QuickProcess], {},
+            runtime_timeout=5.0)
+    try:
+        for i in xrange(3):
+            start = time.time()
+            fleet.run_test()
+            assert time.time() - start < 2.0
+    finally:
+        fleet.stop()
+
+
+def test_send_lock_is_held_while_forking_snapshots():
+    wrapper = SnapshotPrintingProcess({}, None)
+    held = []
+
+    def failing_fork():
+        held.append(wrapper._send_lock.locked())
+        raise OSError(errno.EAGAIN, 'No more processes')
+    fork = os.fork
+    os.fork = failing_fork
+    try:
+        wrapper._run_forked()
+    except OSError:
+        pass
+    finally:
+        os.fork = fork
+    eq_(held, [True])
+    assert not wrapper._send_lock.locked()
+
+
+class InterruptingConnection(object):
+    """Interrupts the wrapper's run in the middle of every send"""
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+        self.sent = []
+
+    def send(self, message):
+        self.wrapper._interrupt_run(signal.SIGUSR1, None)
+        self.sent.append(message)
+
+
+@raises(RunInterrupted)
+def test_interrupts_wait_for_sends_to_finish():
+    wrapper = QuickProcess({}, None)
+    connection = InterruptingConnection(wrapper)
+    wrapper._connection = connection
+    wrapper._running = True
+    try:
+        wrapper.publish('topic', 'payload')
+    finally:
+        eq_(len(connection.sent), 1)
+        assert not wrapper._running
+
+
+class HungServerProcess(ProcessWrapper):
+    def run(self):
+        threading.Event().wait()
+
+
+def test_runtime_timeout_has_stacks_of_every_process():
+    manager = ProcessManager.from_wrappers([HungServerProcess, SomeProcess],
+            {}, runtime_timeout=0.3)
+    try:
+        manager.run()
+    except TimeoutError, e:
+        eq_(sorted(e.stacks), ['HungServerProcess', 'SomeProcess'])
+        assert 'threading.Event().wait()' in e.stacks['HungServerProcess']
+    else:
+        raise AssertionError('Did not time out')
+
+
+def busy_work():
+    return sum(xrange(10000))
+
+
+class ProfiledServerProcess(ProcessWrapper):
+    def run(self):
+        while True:
+            busy_work()
+            time.sleep(0.01)
+
+
+class ProfiledClientProcess(ProcessWrapper):
+    def run(self):
+        for i in xrange(3):
+            busy_work()
+        time.sleep(0.2)
+
+
+def calls_of(stats, function_name):
+    return sum(stat[1] for key, stat in stats.stats.iteritems()
+            if key[2] == function_name)
+
+
+def test_profiles_of_every_wrapper_are_merged():
+    with temp_directory() as temp_dir:
+        manager = ProcessManager.from_wrappers([ProfiledServerProcess,
+            (ProfiledClientProcess, 2)], {}, runtime_timeout=5.0,
+            name='profiled', profiler='cprofile', profile_dir=temp_dir)
+        manager.run()
+        # The server was terminated and still sent its profile
+        assert calls_of(manager.profile, 'busy_work') > 6
+        eq_(calls_of(manager.profile, 'run'), 3)
+        path = os.path.join(temp_dir, 'profiled.pstats')
+        eq_(calls_of(pstats.Stats(path), 'busy_work'),
+                calls_of(manager.profile, 'busy_work'))
+
+
+def call_profiled_run(connection):
+    wrapper = ProfiledServerProcess({}, connection)
+    wrapper._profiler = 'cprofile'
+    wrapper._call_run()
+
+
+def test_terminated_profiled_runs_exit_as_terminated():
+    connection, child_connection = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=call_profiled_run,
+            args=(child_connection,))
+    process.start()
+    child_connection.close()
+    time.sleep(0.3)
+    os.kill(process.pid, signal.SIGTERM)
+    kind, profile = connection.recv()
+    process.join()
+    eq_(kind, 'profile')
+    collector = ProfileCollector('cprofile')
+    collector.add(profile)
+    assert calls_of(collector.merged, 'busy_work')
+    eq_(process.exitcode, -signal.SIGTERM)
+
+
+def spin():
+    end = time.time() + 0.3
+    while time.time() < end:
+        pass
+
+
+class SpinningProcess(ProcessWrapper):
+    def run(self):
+        spin()
+
+
+def test_sampled_profile_is_collapsed():
+    with temp_directory() as temp_dir:
+        manager = ProcessManager.from_wrappers([SpinningProcess], {},
+                runtime_timeout=5.0, name='sampled', profiler='sampling',
+                profile_dir=temp_dir)
+        manager.run()
+        stacks = manager.profile
+        assert any(stack.startswith('run (') and 'spin (' in stack
+            for stack in stacks), stacks
+        lines = open(os.path.join(temp_dir, 'sampled.collapsed')).readlines()
+        eq_(len(lines), len(stacks))
+
+
+def test_unprofiled_manager_has_no_profile():
+    manager = ProcessManager.from_wrappers([QuickProcess], {},
+            runtime_timeout=3.0)
+    manager.run()
+    eq_(manager.profile, None)
+
+
+@raises(ValueError)
+def test_profiled_multiprocess_needs_a_profile_dir():
+    multiprocess([SpinningProcess], profiler='cprofile')
+
+
+@raises(ValueError)
+def test_profiled_multiprocess_test_needs_a_profile_dir():
+    class ProfiledTest(MultiprocessTest):
+        profiler = 'sampling'
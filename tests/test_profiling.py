@@ -0,0 +1,77 @@
+import os
+import time
+from nose.tools import raises, eq_
+from testkit.directory import temp_directory
+from testkit.profiling import *
+
+
+def busy_work(count):
+    return sum(xrange(count))
+
+
+def spin(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        busy_work(100)
+
+
+def failing_work():
+    busy_work(10)
+    raise ValueError('failed')
+
+
+def test_call_profiler_keeps_profile_of_failed_calls():
+    profiler = CallProfiler()
+    try:
+        profiler.call(failing_work)
+    except ValueError:
+        pass
+    names = [key[2] for key in profiler.profile]
+    assert 'failing_work' in names
+    assert 'busy_work' in names
+
+
+def test_sampling_profiler_only_has_frames_of_the_call():
+    profiler = SamplingProfiler(0.001)
+    profiler.call(spin, 0.2)
+    assert profiler.profile
+    for stack in profiler.profile:
+        assert stack.startswith('spin ('), stack
+        assert 'test_sampling' not in stack
+
+
+def test_cprofile_profiles_are_merged():
+    profiles = []
+    for i in xrange(3):
+        profiler = CallProfiler()
+        profiler.call(busy_work, 10)
+        profiles.append(profiler.profile)
+    collector = ProfileCollector('cprofile')
+    for profile in profiles:
+        collector.add(profile)
+    collector.add(None)
+    calls = [stat[1] for key, stat in collector.merged.stats.iteritems()
+            if key[2] == 'busy_work']
+    eq_(calls, [3])
+
+
+def test_samples_are_merged():
+    collector = ProfileCollector('sampling')
+    collector.add({'a;b': 2, 'a': 1})
+    collector.add({'a;b': 3})
+    eq_(collector.merged, {'a;b': 5, 'a': 1})
+    with temp_directory() as temp_dir:
+        path = collector.dump(temp_dir, 'test')
+        eq_(path, os.path.join(temp_dir, 'test.collapsed'))
+        eq_(open(path).read(), 'a 1\na;b 5\n')
+
+
+def test_nothing_is_dumped_without_profiles():
+    with temp_directory() as temp_dir:
+        eq_(ProfileCollector('cprofile').dump(temp_dir, 'test'), None)
+        eq_(os.listdir(temp_dir), [])
+
+
+@raises(ValueError)
+def test_unknown_profiler():
+    new_profiler('line')
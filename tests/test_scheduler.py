@@ -0,0 +1,146 @@
+import os
+import time
+import signal
+import multiprocessing
+import subprocess
+from nose.tools import eq_
+from testkit.processes import *
+from testkit.scheduler import *
+from testkit.directory import temp_directory
+
+
+class CustomException(Exception):
+    pass
+
+
+class SleepingProcess(ProcessWrapper):
+    def run(self):
+        while True:
+            time.sleep(1.0)
+
+
+@multiprocess([SleepingProcess], limit=3.0)
+def sleep_briefly(initial, shared):
+    time.sleep(0.5)
+
+
+@multiprocess([SleepingProcess], limit=3.0)
+def fail_with_exception(initial, shared):
+    raise CustomException('error')
+
+
+def test_scheduler_runs_tests_concurrently():
+    scheduler = MultiprocessScheduler(max_tests=4)
+    for index in range(4):
+        scheduler.add('sleeping_%d' % index, sleep_briefly)
+    start = time.time()
+    outcomes = scheduler.run()
+    assert time.time() - start < 1.5
+    eq_([outcome.name for outcome in outcomes],
+            ['sleeping_%d' % index for index in range(4)])
+    assert all([outcome.passed for outcome in outcomes])
+
+
+def test_scheduler_reports_exceptions_per_test():
+    scheduler = MultiprocessScheduler(max_tests=2)
+    scheduler.add('sleeping', sleep_briefly)
+    scheduler.add('failing', fail_with_exception)
+    sleeping, failing = scheduler.run()
+    assert sleeping.passed
+    assert not failing.passed
+    try:
+        failing.check()
+    except CustomException:
+        pass
+    else:
+        assert False, 'CustomException was not raised'
+
+
+def test_scheduler_respects_process_budget():
+    # Each test uses two processes so only one fits at a time
+    scheduler = MultiprocessScheduler(max_tests=4, process_budget=3)
+    scheduler.add('first', sleep_briefly)
+    scheduler.add('second', sleep_briefly)
+    start = time.time()
+    scheduler.run()
+    assert time.time() - start >= 1.0
+
+
+def test_scheduler_limit():
+    scheduler = MultiprocessScheduler(limit=0.2)
+    scheduler.add('sleeping', time.sleep, (5.0,))
+    outcome, = scheduler.run()
+    assert not outcome.passed
+    eq_(outcome.exception_info._exc_type, TimeoutError)
+
+
+def kill_runner():
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def test_scheduler_fails_runners_that_die():
+    scheduler = MultiprocessScheduler()
+    scheduler.add('killed', kill_runner)
+    scheduler.add('exited', os._exit, (3,))
+    killed, exited = scheduler.run()
+    eq_(killed.exception_info._exc_type, ProcessError)
+    assert 'code -9' in str(killed.exception_info._exc_value)
+    eq_(exited.exception_info._exc_type, ProcessError)
+    assert 'code 3' in str(exited.exception_info._exc_value)
+
+
+def start_sleeper(pid_file):
+    sleeper = subprocess.Popen(['sleep', '30'])
+    open(pid_file, 'w').write(str(sleeper.pid))
+    sleeper.wait()
+
+
+def test_scheduler_limit_stops_the_runners_group():
+    with temp_directory() as temp_dir:
+        pid_file = os.path.join(temp_dir, 'pid')
+        scheduler = MultiprocessScheduler(limit=0.5)
+        scheduler.add('sleeping', start_sleeper, (pid_file,))
+        outcome, = scheduler.run()
+        sleeper_pid = int(open(pid_file).read())
+    assert not outcome.passed
+    assert not pid_exists(sleeper_pid)
+
+
+def leave_sleeping_child():
+    child = multiprocessing.Process(target=time.sleep, args=(30,))
+    child.start()
+
+
+def test_scheduler_limit_covers_children_left_behind():
+    scheduler = MultiprocessScheduler(limit=1.0)
+    scheduler.add('leaving', leave_sleeping_child)
+    start = time.time()
+    outcome, = scheduler.run()
+    assert time.time() - start < 5.0
+    assert not outcome.passed
+    eq_(outcome.exception_info._exc_type, TimeoutError)
+
+
+def pid_exists(pid):
+    try:
+        stat = open('/proc/%d/stat' % pid).read()
+    except IOError:
+        return False
+    return stat.split()[2] != 'Z'
+
+
+class ParallelTests(MultiprocessTest):
+    wrappers = [SleepingProcess]
+
+    def test_one(self):
+        time.sleep(0.3)
+
+    def test_two(self):
+        time.sleep(0.3)
+
+
+def test_scheduler_runs_test_classes():
+    scheduler = MultiprocessScheduler(max_tests=2)
+    scheduler.add_test_class(ParallelTests)
+    for outcome in scheduler.run():
+        yield outcome.check
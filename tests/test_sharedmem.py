@@ -0,0 +1,65 @@
+import os
+import array
+from testkit.sharedmem import *
+
+
+def test_shared_data_round_trip():
+    for value in ['abc', bytearray('abc'), array.array('i', [1, 2, 3])]:
+        yield check_shared_data_round_trip, value
+
+
+def check_shared_data_round_trip(value):
+    shared = SharedData.from_value(value)
+    try:
+        loaded = shared.load()
+        assert type(loaded) == type(value)
+        assert loaded == value
+    finally:
+        shared.unlink()
+    assert not os.path.exists(shared.path)
+
+
+def test_shared_data_map_is_read_only():
+    shared = SharedData.from_value('hello')
+    try:
+        mapped = shared.map()
+        assert mapped[:] == 'hello'
+        try:
+            mapped[0] = 'j'
+        except TypeError:
+            pass
+        else:
+            assert False, 'Map was writable'
+    finally:
+        shared.unlink()
+
+
+def test_share_large_value_only_moves_large_buffers():
+    assert share_large_value('small') == 'small'
+    assert share_large_value([1] * 10, size=1) == [1] * 10
+    shared = share_large_value('large', size=5)
+    assert isinstance(shared, SharedData)
+    assert load_shared_value(shared) == 'large'
+    assert not os.path.exists(shared.path)
+
+
+def test_map_shared_values_replaces_nested_handles():
+    shared = shared_buffer('hello')
+    try:
+        options = {'a': [shared, 1], 'b': (shared,), 'c': 'plain'}
+        assert list(iter_shared_data(options)) == [shared, shared]
+        mapped = map_shared_values(options)
+        assert mapped['a'][0][:] == 'hello'
+        assert mapped['a'][1] == 1
+        assert mapped['b'][0][:] == 'hello'
+        assert mapped['c'] == 'plain'
+    finally:
+        shared.unlink()
+
+
+def test_unlink_segments_of_a_process():
+    shared = SharedData.from_value('hello')
+    unlink_segments(os.getpid() + 1)
+    assert os.path.exists(shared.path)
+    unlink_segments(os.getpid())
+    assert not os.path.exists(shared.path)
@@ -1,6 +1,22 @@
 import time
-from nose.tools import raises
-from testkit.timeouts import timeout
+import threading
+import array
+import os
+import sys
+import glob
+import signal
+import stat
+import subprocess
+import pstats
+import multiprocessing
+from testkit.directory import temp_directory
+from nose.tools import raises, eq_
+import testkit.sharedmem
+import testkit.timeouts
+import testkit.stacks
+from testkit.timeouts import *
+from testkit.stacks import (prepare_stack_dumps, start_stack_dumper,
+        collect_stacks)
 
 
 @raises(AssertionError)
@@ -19,3 +35,446 @@ def test_timeout_with_infinite_loop():
 @timeout(0.5)
 def test_timeout_no_errors():
     assert 1 == 1
+
+
+class CustomException(Exception):
+    pass
+
+
+@raises(AssertionError)
+@timeout(0.05, pooled=True)
+def test_pooled_timeout():
+    time.sleep(0.1)
+
+
+@timeout(0.5, pooled=True)
+def test_pooled_timeout_no_errors():
+    assert 1 == 1
+
+
+@raises(CustomException)
+@timeout(0.5, pooled=True)
+def test_pooled_timeout_reraises_exceptions():
+    raise CustomException('error')
+
+
+def test_pooled_timeout_unpicklable_arguments():
+    @timeout(0.5, pooled=True)
+    def call(value):
+        assert value() is None
+    call(lambda: None)
+
+
+def test_pooled_worker_replaced_after_timeout():
+    pool = TimeoutWorkerPool(size=1)
+    key = register_pooled_function(time.sleep)
+    try:
+        assert pool.run(key, (0,), {}, 0.5) == (None, None, None)
+        try:
+            pool.run(key, (1.0,), {}, 0.05)
+        except TimeoutError:
+            pass
+        else:
+            assert False, 'TimeoutError was not raised'
+        assert pool.run(key, (0,), {}, 0.5) == (None, None, None)
+    finally:
+        pool.shutdown()
+
+
+PARENT_PID = os.getpid()
+
+
+def load_in_child_only():
+    if os.getpid() == PARENT_PID:
+        raise ValueError('Cannot load the result here')
+
+
+class LoadsInChildOnly(object):
+    def __reduce__(self):
+        return load_in_child_only, ()
+
+
+def logged_call(path):
+    log_file = open(path, 'a')
+    log_file.write('call\n')
+    log_file.close()
+    return LoadsInChildOnly()
+
+
+@raises(ValueError)
+def test_pooled_call_is_not_repeated_on_pool_errors():
+    timed = timeout(2.0, pooled=True)(logged_call)
+    with temp_directory() as temp_dir:
+        path = os.path.join(temp_dir, 'calls.log')
+        try:
+            timed(path)
+        finally:
+            eq_(open(path).read(), 'call\n')
+
+
+def test_pooled_functions_are_registered_once():
+    key = register_pooled_function(logged_call)
+    eq_(register_pooled_function(logged_call), key)
+    limit = testkit.timeouts.POOLED_FUNCTIONS_LIMIT
+    testkit.timeouts.POOLED_FUNCTIONS_LIMIT = len(
+            testkit.timeouts._pooled_functions)
+    try:
+        eq_(register_pooled_function(lambda: None), None)
+        eq_(register_pooled_function(logged_call), key)
+    finally:
+        testkit.timeouts.POOLED_FUNCTIONS_LIMIT = limit
+
+
+@raises(TimeoutError)
+@timeout(0.05, engine='inprocess')
+def test_inprocess_timeout():
+    time.sleep(0.1)
+
+
+@raises(TimeoutError)
+@timeout(0.05, engine='inprocess')
+def test_inprocess_timeout_with_infinite_loop():
+    while True:
+        pass
+
+
+@raises(CustomException)
+@timeout(0.5, engine='inprocess')
+def test_inprocess_timeout_reraises_exceptions():
+    raise CustomException('error')
+
+
+def test_inprocess_timeout_shares_state():
+    state = []
+
+    @timeout(0.5, engine='inprocess')
+    def append():
+        state.append(1)
+    append()
+    assert state == [1]
+
+
+def test_inprocess_timeout_in_thread():
+    errors = []
+
+    @timeout(0.05, engine='inprocess')
+    def loop():
+        while True:
+            pass
+
+    def run():
+        try:
+            loop()
+        except TimeoutError:
+            errors.append(TimeoutError)
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join(2.0)
+    assert errors == [TimeoutError]
+
+
+def test_nested_inprocess_timeout_falls_back_to_process():
+    state = []
+
+    @timeout(0.5, engine='inprocess')
+    def inner():
+        state.append(1)
+
+    @timeout(1.0, engine='inprocess')
+    def outer():
+        inner()
+    outer()
+    # The inner function ran in a separate process
+    assert state == []
+
+
+@raises(ValueError)
+def test_unknown_timeout_engine():
+    timeout(1.0, engine='unknown')
+
+
+@timeout(0.5)
+def return_value(value):
+    return value
+
+
+@timeout(0.5, pooled=True)
+def pooled_return_value(value):
+    return value
+
+
+@timeout(0.5, engine='inprocess')
+def inprocess_return_value(value):
+    return value
+
+
+def test_timeout_returns_values():
+    for timed_function in [return_value, pooled_return_value,
+            inprocess_return_value]:
+        yield check_returns_values, timed_function
+
+
+def check_returns_values(timed_function):
+    assert timed_function({'a': 1}) == {'a': 1}
+    large_string = 'a' * (2 * 1024 * 1024)
+    assert timed_function(large_string) == large_string
+    large_array = array.array('d', xrange(300000))
+    assert timed_function(large_array) == large_array
+
+
+def shared_segments():
+    names = os.listdir(testkit.sharedmem.SHARED_MEMORY_DIR)
+    return set(name for name in names if name.startswith('testkit-'))
+
+
+def share_and_hang():
+    testkit.sharedmem.SharedData.from_value('a' * 1024)
+    time.sleep(10)
+
+
+def test_timed_out_process_segments_are_removed():
+    before = shared_segments()
+    for timed_function in [timeout(0.2)(share_and_hang),
+            timeout(0.2, pooled=True)(share_and_hang)]:
+        try:
+            timed_function()
+        except TimeoutError:
+            pass
+        else:
+            assert False, 'Did not time out'
+    eq_(shared_segments(), before)
+
+
+@raises(OSError)
+@timeout(0.5)
+def test_errors_sharing_the_result_are_reported():
+    testkit.sharedmem.SHARED_MEMORY_DIR = os.path.join(os.sep, 'nonexistent')
+    return 'a' * (2 * 1024 * 1024)
+
+
+def ignore_sigterm_forever():
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    while True:
+        time.sleep(0.01)
+
+
+def test_terminate_process_escalates_to_sigkill():
+    process = multiprocessing.Process(target=ignore_sigterm_forever)
+    process.start()
+    time.sleep(0.1)
+    start = time.time()
+    terminate_process(process, grace_period=0.2)
+    assert not process.is_alive()
+    assert process.exitcode == -signal.SIGKILL
+    assert time.time() - start < 1.0
+
+
+def start_grandchild(pid_file):
+    grandchild = subprocess.Popen(['sleep', '30'])
+    open(pid_file, 'w').write(str(grandchild.pid))
+    grandchild.wait()
+
+
+def pid_exists(pid):
+    try:
+        stat = open('/proc/%d/stat' % pid).read()
+    except IOError:
+        return False
+    # Killed orphans can linger as zombies until init reaps them
+    return stat.split()[2] != 'Z'
+
+
+def test_terminate_process_group_kills_grandchildren():
+    with temp_directory() as temp_dir:
+        pid_file = os.path.join(temp_dir, 'pid')
+        process = ProcessGroupLeader(target=start_grandchild,
+                args=(pid_file,))
+        process.start()
+        while not os.path.exists(pid_file) or not open(pid_file).read():
+            time.sleep(0.01)
+        grandchild_pid = int(open(pid_file).read())
+        terminate_process(process, grace_period=0.2)
+    assert not process.is_alive()
+    assert not pid_exists(grandchild_pid)
+
+
+def test_reaped_processes_are_not_signalled():
+    process = multiprocessing.Process(target=time.sleep, args=(0,))
+    process.start()
+    process.join()
+    signalled = []
+    kill = os.kill
+    os.kill = lambda pid, signum: signalled.append(pid)
+    try:
+        terminate_process(process, grace_period=0.2)
+    finally:
+        os.kill = kill
+    eq_(signalled, [])
+
+
+@raises(ValueError)
+def test_timeout_rejects_unavailable_start_method():
+    timeout(1.0, start_method='forkserver')
+
+
+def has_preloaded_module():
+    return 'mailcap' in sys.modules
+
+
+def test_timeout_preloads_modules():
+    eq_(timeout(2.0, preload=['mailcap'], start_method='fork')(
+        has_preloaded_module)(), True)
+
+
+def deadlock():
+    lock = threading.Lock()
+    lock.acquire()
+    lock.acquire()
+
+
+def test_timeout_error_has_stacks_of_the_child():
+    for options in [{}, {'pooled': True}]:
+        yield check_timeout_error_has_stacks, options
+
+
+def check_timeout_error_has_stacks(options):
+    timed = timeout(0.3, **options)(deadlock)
+    try:
+        timed()
+    except TimeoutError, e:
+        stacks = e.stacks['deadlock']
+        assert 'in deadlock' in stacks, stacks
+        assert 'lock.acquire()' in str(e)
+    else:
+        raise AssertionError('Did not time out')
+
+
+def wait_forever(ready):
+    start_stack_dumper()
+    ready.set()
+    threading.Event().wait()
+
+
+def test_stacks_are_collected_without_polling():
+    prepare_stack_dumps()
+    ready = multiprocessing.Event()
+    waiting = multiprocessing.Process(target=wait_forever, args=(ready,))
+    silent = multiprocessing.Process(target=ready.wait)
+    waiting.start()
+    silent.start()
+    try:
+        ready.wait()
+        start = time.time()
+        stacks = collect_stacks({'waiting': waiting.pid,
+            'silent': silent.pid}, timeout=5.0)
+        # Processes without a dumper don't hold up the others
+        assert time.time() - start < 1.0
+    finally:
+        terminate_processes([waiting, silent])
+    assert 'threading.Event().wait()' in stacks['waiting'], stacks
+    eq_(stacks['silent'], None)
+
+
+def test_stack_dumps_are_private():
+    mode = os.stat(prepare_stack_dumps()).st_mode
+    eq_(stat.S_IMODE(mode), 0700)
+
+
+def test_exited_processes_leave_no_pipes():
+    dump_dir = prepare_stack_dumps()
+    process = multiprocessing.Process(target=start_stack_dumper)
+    process.start()
+    process.join()
+    eq_([name for name in os.listdir(dump_dir)
+        if name.startswith('%d.' % process.pid)], [])
+
+
+def test_stacks_are_collected_above_fd_setsize():
+    prepare_stack_dumps()
+    ready = multiprocessing.Event()
+    waiting = multiprocessing.Process(target=wait_forever, args=(ready,))
+    waiting.start()
+    # Push the dump's descriptor past what select takes
+    fillers = [os.open(os.devnull, os.O_RDONLY) for i in range(1100)]
+    try:
+        ready.wait()
+        stacks = collect_stacks({'waiting': waiting.pid}, timeout=5.0)
+    finally:
+        for fd in fillers:
+            os.close(fd)
+        terminate_processes([waiting])
+    assert 'threading.Event().wait()' in stacks['waiting'], stacks
+
+
+def prepare_own_stack_dumps(queue):
+    # Like a scheduler runner that times its test in a fresh process tree
+    testkit.stacks._dump_dir = None
+    queue.put(prepare_stack_dumps())
+
+
+def test_child_stack_dumps_are_removed():
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=prepare_own_stack_dumps,
+            args=(queue,))
+    process.start()
+    dump_dir = queue.get()
+    process.join()
+    assert not os.path.exists(dump_dir)
+
+
+def recurse(depth):
+    if depth:
+        return recurse(depth - 1)
+    return depth
+
+
+def test_timeout_writes_profiles():
+    for options in [{}, {'pooled': True}]:
+        yield check_timeout_writes_profiles, options
+
+
+def check_timeout_writes_profiles(options):
+    with temp_directory() as temp_dir:
+        profiled = timeout(2.0, profiler='cprofile', profile_dir=temp_dir,
+                **options)(recurse)
+        eq_(profiled(5), 0)
+        eq_(profiled(5), 0)
+        # Every call has its own file
+        paths = glob.glob(os.path.join(temp_dir, 'recurse-*.pstats'))
+        eq_(len(paths), 2)
+        for path in paths:
+            stats = pstats.Stats(path)
+            calls = [stat[1] for key, stat in stats.stats.iteritems()
+                    if key[2] == 'recurse']
+            eq_(calls, [6])
+
+
+def spin_until_killed():
+    while True:
+        recurse(5)
+
+
+def test_timed_out_calls_write_profiles():
+    for options in [{}, {'pooled': True}]:
+        yield check_timed_out_calls_write_profiles, options
+
+
+def check_timed_out_calls_write_profiles(options):
+    with temp_directory() as temp_dir:
+        profiled = timeout(0.2, profiler='cprofile', profile_dir=temp_dir,
+                **options)(spin_until_killed)
+        try:
+            profiled()
+        except TimeoutError, e:
+            assert e.profile
+        else:
+            raise AssertionError('Did not time out')
+        path, = glob.glob(os.path.join(temp_dir,
+            'spin_until_killed-*.pstats'))
+        names = [key[2] for key in pstats.Stats(path).stats]
+        assert 'recurse' in names, names
+
+
+@raises(ValueError)
+def test_profiling_needs_a_profile_dir():
+    timeout(1.0, profiler='cprofile')
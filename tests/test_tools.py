@@ -1,4 +1,5 @@
 import os
+import random
 import fudge
 from nose.tools import raises
 from testkit import *
@@ -106,3 +107,87 @@ def test_dict_to_object():
     obj = dict_to_object(dict(a=1, b=2))
     assert obj.a == 1
     assert obj.b == 2
+
+
+def test_random_strings_have_fixed_lengths():
+    strings = random_strings(1000, 12, chars=ALPHAS_LOWER)
+    assert len(strings) == 1000
+    assert set(len(string) for string in strings) == set([12])
+    assert set(''.join(strings)) <= set(ALPHAS_LOWER)
+    assert len(set(strings)) == 1000
+    assert random_strings(3, 0) == ['', '', '']
+
+
+def test_random_strings_are_reproducible():
+    first = random_strings(100, (1, 20), seed=42)
+    assert random_strings(100, (1, 20), seed=42) == first
+    assert random_strings(100, (1, 20), seed=43) != first
+    assert set(len(string) for string in first) <= set(range(1, 21))
+    assert random_strings(10, 5, rng=random.Random(7)) == random_strings(
+            10, 5, seed=7)
+
+
+def test_random_strings_use_every_char_equally():
+    # 3 chars don't divide 256 so some bytes must be thrown away
+    counts = {}
+    for char in ''.join(random_strings(300, 100, chars='abc', seed=1)):
+        counts[char] = counts.get(char, 0) + 1
+    assert sorted(counts) == ['a', 'b', 'c']
+    for count in counts.values():
+        assert 9400 < count < 10600, counts
+
+
+def test_random_strings_with_length_function():
+    strings = random_strings(50, lambda rng: rng.choice([4, 8]), seed=3)
+    assert set(len(string) for string in strings) == set([4, 8])
+
+
+class FakeArray(list):
+    def tolist(self):
+        return list(self)
+
+
+class FakeGenerator(object):
+    """Like numpy.random.Generator, which has no randint"""
+    def __init__(self, seed):
+        self._random = random.Random(seed)
+
+    def integers(self, low, high, size):
+        return FakeArray(self._random.randrange(low, high)
+                for i in xrange(size))
+
+    def bytes(self, count):
+        return ''.join(chr(self._random.randrange(256))
+                for i in xrange(count))
+
+
+def test_random_strings_with_generator():
+    strings = random_strings(50, (2, 4), rng=FakeGenerator(5))
+    assert set(len(string) for string in strings) == set([2, 3, 4])
+
+
+def test_random_strings_reject_negative_lengths():
+    for length in [-1, (-1, 3), (3, 2), lambda rng: -1]:
+        yield check_random_strings_reject_length, length
+
+
+@raises(ValueError)
+def check_random_strings_reject_length(length):
+    random_strings(5, length, seed=1)
+
+
+@raises(ValueError)
+def test_random_strings_reject_too_many_chars():
+    random_strings(1, 1, chars=''.join(chr(byte) for byte in range(256)) +
+            'a')
+
+
+def test_random_strings_with_unicode_chars():
+    chars = u'ab\xe9\u4e2d'
+    strings = random_strings(200, 5, chars=chars, seed=2)
+    for string in strings:
+        assert isinstance(string, unicode)
+        assert len(string) == 5
+        assert set(string) <= set(chars)
+    assert set(u''.join(strings)) == set(chars)
+    assert random_strings(2, 0, chars=u'abc') == [u'', u'']